@@ -2,7 +2,7 @@
 import os
 from flask import Flask
 from flask_cors import CORS
-from .config import Config
+from .config import Config, check_text_engine
 from .database import create_db_and_table  # <-- 只需要导入这一个函数
 
 def create_app():
@@ -14,12 +14,18 @@ def create_app():
     # 1. 加载配置
     app.config.from_object(Config)
 
+    # (*** 新增 ***) 校验文本提取引擎: 名称错误时每个 PDF 都会解析失败并被计为跳过，这里直接拒绝启动
+    # (只核对名称，不导入 text_engines / pdfplumber)
+    check_text_engine(app.config['PDF_TEXT_ENGINE'])
+
     # 2. 初始化 CORS (关键：允许前端从 file:// 或其他域访问)
     CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
     # 3. 确保配置中定义的目录存在
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['EXTRACT_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['PREVIEW_CACHE_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['QUARANTINE_FOLDER'], exist_ok=True)
 
     # 4. 在应用上下文中创建数据库表
     # (确保在任何请求之前数据库已就绪)
@@ -31,7 +37,16 @@ def create_app():
     # 所有 API 路由都将以 /api/v1/ 开头
     app.register_blueprint(api_bp, url_prefix='/api/v1')
 
-    # 6. (可选) 添加一个根路由用于测试
+    # 6. (*** 新增 ***) 启动后台文件回收线程 (启动对账 + 分批删除墓碑文件)
+    if app.config['FILE_REAPER_ENABLED']:
+        from .services import file_reaper
+        file_reaper.start_reaper(app)
+
+    # 7. (*** 新增 ***) 注册命令行命令 (例如 flask --app run startup-report)
+    from .cli import register_commands
+    register_commands(app)
+
+    # 8. (可选) 添加一个根路由用于测试
     @app.route('/')
     def index():
         return "发票后端 API 正在运行。请访问 /api/v1/invoices 查看数据。"
@@ -1,18 +1,24 @@
 # app/api/routes.py
 import os
 import io
-import tempfile
+import re
+import random
 import zipfile
-import shutil
+import tempfile
 import urllib.parse
 import threading  # <-- 使用 threading
-import traceback  # <-- 用于捕获错误
 from flask import (
-    Blueprint, request, jsonify, send_file, make_response, current_app
+    Blueprint, request, jsonify, make_response, current_app
 )
+from werkzeug.utils import send_file as _werkzeug_send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from .. import database as db
-from ..services import zip_handler, invoice_parser
-from ..services.invoice_parser import _parse_date, _safe_float
+from .. import tasks
+# (*** 修改 ***) 不在模块加载时导入 invoice_parser (pdfplumber / pdfminer / PIL)，
+# Web 进程只在确实需要解析时才按需导入
+from ..services import file_reaper, reextract, previews, profiling, packstore
+from ..services.fingerprint import sha256_file, save_with_sha256
+from ..services.values import parse_date as _parse_date, safe_float as _safe_float
 
 # 创建一个 API 蓝图
 api_bp = Blueprint('api', __name__)
@@ -24,6 +30,11 @@ def calculate_stats(invoices):
     total_count = len(invoices)
     total_amount = sum(inv['amount'] for inv in invoices if inv['amount'])
     total_tax_amount = sum(inv['total_amount'] for inv in invoices if inv['total_amount'])
+    return format_stats(total_count, total_amount, total_tax_amount)
+
+
+def format_stats(total_count, total_amount, total_tax_amount):
+    """(*** 新增 ***) 统一统计数据的输出格式 (列表接口和分页接口共用)"""
     return {
         'total_count': total_count,
         'total_amount': f"¥{total_amount:,.2f}",
@@ -31,66 +42,87 @@ def calculate_stats(invoices):
     }
 
 
-# --- (修改后的后台处理函数) ---
+def serialize_invoice(inv):
+    """(*** 新增 ***) 把数据库行转换为可 JSON 序列化的字典 (日期转字符串)"""
+    if inv.get('issue_date') and hasattr(inv['issue_date'], 'strftime'):
+        inv['issue_date'] = inv['issue_date'].strftime('%Y-%m-%d')
+    return inv
 
-def process_zip_in_background(app, zip_path, job_id):
-    """
-    这个函数在一个单独的线程中运行，负责所有耗时的 PDF 处理工作。
-    它现在接受一个 job_id 来向数据库报告状态。
-    """
-    # 线程没有 Flask 的应用上下文，必须手动创建
-    with app.app_context():
-        temp_extract_dir = tempfile.mkdtemp()
-        print(f"[后台 Job {job_id}] 创建临时目录: {temp_extract_dir}")
-
-        try:
-            # 1. 更新状态为 "处理中"
-            db.update_job_status(job_id, 'processing')
-
-            # 2. 解压
-            print(f"[后台 Job {job_id}] 开始解压: {zip_path}")
-            pdf_count = zip_handler.recursive_extract_all_pdfs(zip_path, temp_extract_dir)
-            print(f"[后台 Job {job_id}] 解压完成，找到 {pdf_count} 个PDF。")
-
-            # 3. 解析 (耗时操作)
-            print(f"[后台 Job {job_id}] 开始解析目录: {temp_extract_dir}")
-            stats = invoice_parser.process_extracted_pdfs(temp_extract_dir)
-            stats['pdf_found'] = pdf_count  # 补充统计
-            print(f"[后台 Job {job_id}] 解析完成。 统计: {stats}")
-
-            # 4. 更新状态为 "已完成"，并保存 stats 结果
-            db.update_job_status(job_id, 'finished', result=stats)
-
-        except Exception as e:
-            # 5. 捕获异常，更新状态为 "失败"
-            error_msg = traceback.format_exc()
-            print(f"[后台 Job {job_id}] 处理失败: {str(e)}")
-            db.update_job_status(job_id, 'failed', result=error_msg)
-
-        finally:
-            # 6. 清理临时目录
-            if os.path.exists(temp_extract_dir):
-                shutil.rmtree(temp_extract_dir, ignore_errors=True)
-                print(f"[后台 Job {job_id}] 清理临时目录: {temp_extract_dir}")
-
-            # 7. (推荐) 清理原始 ZIP 文件
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-                print(f"[后台 Job {job_id}] 清理原始 ZIP: {zip_path}")
 
+# --- (修改后的后台处理函数) ---
+# (*** 修改 ***) process_zip_in_background 已移到 tasks.py (上传接口和任务恢复共用)
 
 # --- 发票 CRUD API (保持不变) ---
 
 @api_bp.route('/invoices', methods=['GET'])
 def get_invoices_api():
-    """ (R)ead: 获取发票列表 (带搜索) """
+    """
+    (R)ead: 获取发票列表 (带搜索)
+    (*** 新增 ***) 支持 ?limit=&offset= 分页参数:
+    前端虚拟滚动按需加载下一页，统计数据由数据库聚合，
+    不再需要一次性返回全部发票。
+    """
     search_term = request.args.get('search', '')
-    invoices = db.get_invoices(search_term)
-    stats = calculate_stats(invoices)
+    limit = request.args.get('limit', type=int)
+    # (*** 新增 ***) 查询前的变更序号: 客户端之后用 GET /invoices/changes?since=<sync_seq> 增量同步
+    sync_seq = db.get_change_seq()
+
+    if limit is None:
+        # 旧行为: 返回全部结果
+        invoices = db.get_invoices(search_term)
+        stats = calculate_stats(invoices)
+        for inv in invoices:
+            serialize_invoice(inv)
+        return jsonify({'invoices': invoices, 'stats': stats, 'sync_seq': sync_seq})
+
+    limit = max(1, min(limit, current_app.config['INVOICE_PAGE_MAX_SIZE']))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    invoices = db.get_invoices(search_term, limit=limit, offset=offset)
     for inv in invoices:
-        if inv.get('issue_date'):
-            inv['issue_date'] = inv['issue_date'].strftime('%Y-%m-%d')
-    return jsonify({'invoices': invoices, 'stats': stats})
+        serialize_invoice(inv)
+    raw_stats = db.get_invoice_stats(search_term)
+    stats = format_stats(raw_stats['total_count'], raw_stats['total_amount'], raw_stats['total_tax_amount'])
+
+    return jsonify({
+        'invoices': invoices,
+        'stats': stats,
+        'total': raw_stats['total_count'],
+        'offset': offset,
+        'has_more': offset + len(invoices) < raw_stats['total_count'],
+        'sync_seq': sync_seq
+    })
+
+
+@api_bp.route('/invoices/changes', methods=['GET'])
+def get_invoice_changes_api():
+    """
+    (*** 新增 API ***)
+    (R)ead: 增量同步 —— 只返回 since 之后发生变化的发票
+    GET /api/v1/invoices/changes?since=<seq>&search=<关键词>&limit=<日志条数>
+    返回 invoices (变化后的完整行)、deleted (需要从列表中移除的 id)、since (下次请求使用)、
+    has_more (还有更多变更)、reset (需要重新加载完整列表)；有变化时附带当前搜索条件下的 stats / total。
+    """
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return jsonify({'error': '缺少参数 since'}), 400
+    search_term = request.args.get('search', '')
+    max_limit = current_app.config['CHANGES_PAGE_MAX_SIZE']
+    limit = max(1, min(request.args.get('limit', max_limit, type=int), max_limit))
+
+    changes = db.get_invoice_changes(since, search_term, limit)
+    response = {
+        'reset': changes['reset'],
+        'since': changes['next_since'],
+        'invoices': [serialize_invoice(inv) for inv in changes.get('invoices', [])],
+        'deleted': changes.get('deleted', []),
+        'has_more': changes.get('has_more', False),
+    }
+    if response['invoices'] or response['deleted']:
+        raw_stats = db.get_invoice_stats(search_term)
+        response['stats'] = format_stats(raw_stats['total_count'], raw_stats['total_amount'], raw_stats['total_tax_amount'])
+        response['total'] = raw_stats['total_count']
+    return jsonify(response)
 
 
 @api_bp.route('/invoices/<int:invoice_id>', methods=['PUT'])  # <-- (*** 修复: api_py -> api_bp ***)
@@ -115,11 +147,92 @@ def update_invoice_api(invoice_id):
 def delete_invoice_api(invoice_id):
     """ (D)elete: 删除单张发票 """
     if db.delete_invoice_record(invoice_id):
+        file_reaper.wake()
         return jsonify({'success': True, 'message': f'发票 {invoice_id} 已删除'})
     else:
         return jsonify({'error': '删除失败'}), 500
 
 
+def _parse_bulk_selection(data):
+    """
+    (*** 新增 ***)
+    解析批量操作的目标: {"ids": [...]} 或 {"filter": {"search": "..."}}。
+    返回 (ids, search_term, error)。
+    为防止误操作，空的过滤条件不会匹配全部发票 (清空请使用 /clear-all)。
+    """
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or len(ids) == 0:
+            return None, None, '"ids" 必须是一个非空列表'
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return None, None, '"ids" 中包含无效的 ID'
+        return ids, None, None
+
+    filter_data = data.get('filter')
+    if isinstance(filter_data, dict) and filter_data.get('search'):
+        return None, filter_data['search'], None
+
+    return None, None, '需要提供 "ids" 列表或非空的 "filter.search" 条件'
+
+
+@api_bp.route('/invoices/bulk-delete', methods=['POST'])
+def bulk_delete_invoices_api():
+    """
+    (*** 新增 API ***)
+    (D)elete: 批量删除发票 (单个事务)
+    POST /api/v1/invoices/bulk-delete  {"ids": [...]} 或 {"filter": {"search": "..."}}
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': '无效的 JSON 数据'}), 400
+    ids, search_term, error = _parse_bulk_selection(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    deleted = db.bulk_delete_invoices(ids=ids, search_term=search_term)
+    if deleted is None:
+        return jsonify({'error': '批量删除失败'}), 500
+    file_reaper.wake()
+    return jsonify({'success': True, 'deleted': deleted, 'message': f'已删除 {deleted} 张发票'})
+
+
+@api_bp.route('/invoices/bulk', methods=['PATCH'])
+def bulk_update_invoices_api():
+    """
+    (*** 新增 API ***)
+    (U)pdate: 批量更新发票 (单个事务)
+    PATCH /api/v1/invoices/bulk  {"ids": [...] 或 "filter": {...}, "data": {字段: 值}}
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': '无效的 JSON 数据'}), 400
+    ids, search_term, error = _parse_bulk_selection(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    changes = data.get('data')
+    if not isinstance(changes, dict):
+        return jsonify({'error': '需要提供 "data" 对象'}), 400
+    changes = {k: v for k, v in changes.items() if k in db.BULK_UPDATABLE_FIELDS}
+    if not changes:
+        return jsonify({'error': f'"data" 中没有可修改的字段 (允许: {", ".join(db.BULK_UPDATABLE_FIELDS)})'}), 400
+    try:
+        if 'issue_date' in changes:
+            changes['issue_date'] = _parse_date(changes['issue_date'])
+        for key in ('amount', 'total_amount'):
+            if key in changes:
+                changes[key] = _safe_float(changes[key])
+    except Exception as e:
+        return jsonify({'error': f'数据格式解析错误: {e}'}), 400
+
+    updated = db.bulk_update_invoices(changes, ids=ids, search_term=search_term)
+    if updated is None:
+        return jsonify({'error': '批量更新失败'}), 500
+    return jsonify({'success': True, 'updated': updated, 'message': f'已更新 {updated} 张发票'})
+
+
 # --- 文件和批量操作 API ---
 
 @api_bp.route('/upload', methods=['POST'])
@@ -127,6 +240,10 @@ def upload_zip_api():
     """
     (C)reate: 上传 ZIP 文件
     (使用 数据库 + 线程 方案)
+    (*** 新增 ***) 按 ZIP 内容去重: 相同的 ZIP 已处理完成时直接返回该任务的结果 (200, deduplicated)，
+    正在处理时返回该任务的 job_id (202, deduplicated)。表单字段 force=1 时强制重新处理。
+    (*** 新增 ***) 表单字段 profile=1 时记录该任务的性能 (各阶段耗时 + cProfile，总是重新处理)；
+    其他任务按 PROFILE_SAMPLE_RATE 抽样记录各阶段耗时。结果见 GET /upload/profile/<job_id>。
     """
     if 'zip_file' not in request.files:
         return jsonify({'error': '未找到 "zip_file" 字段'}), 400
@@ -138,26 +255,62 @@ def upload_zip_api():
         return jsonify({'error': '文件类型错误，请上传 ZIP 压缩包'}), 400
 
     # 1. 保存 ZIP 到 UPLOAD_FOLDER
+    # (*** 修改 ***) 边写入边计算 SHA-256；以唯一的文件名保存，同名的不同 ZIP 不会互相覆盖
     filename = file.filename
-    zip_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    fd, zip_path = tempfile.mkstemp(
+        prefix='upload_', suffix=f"_{os.path.basename(filename)}", dir=current_app.config['UPLOAD_FOLDER']
+    )
+    os.close(fd)
     try:
-        file.save(zip_path)
+        zip_sha256 = save_with_sha256(file.stream, zip_path)
     except Exception as e:
+        os.remove(zip_path)
         return jsonify({'error': f'保存 ZIP 文件失败: {e}'}), 500
 
     # 2. 在数据库中创建 Job 记录
+    # (*** 修改 ***) 相同的 ZIP 已处理过或正在处理时直接返回该任务 (force=1 时强制重新处理)
+    force = request.values.get('force', '').lower() in ('1', 'true', 'yes')
+    if request.values.get('profile', '').lower() in ('1', 'true', 'yes'):
+        profile, force = profiling.PROFILE_FULL, True
+    elif random.random() < current_app.config['PROFILE_SAMPLE_RATE']:
+        profile = profiling.PROFILE_TIMELINE
+    else:
+        profile = profiling.PROFILE_OFF
     try:
-        job_id = db.create_job(filename)
+        job, created = db.find_or_create_upload_job(filename, zip_path, zip_sha256, force=force, profile=profile)
     except Exception as e:
+        os.remove(zip_path)
         return jsonify({'error': f'创建任务失败: {e}'}), 500
+    job_id = job['id']
+
+    if not created:
+        os.remove(zip_path)
+        if job['status'] == 'finished':
+            return jsonify({
+                'success': True,
+                'deduplicated': True,
+                'status': 'finished',
+                'message': f'相同的 ZIP 已处理过 (任务 #{job_id})，未重复处理',
+                'job_id': job_id,
+                'stats': job['result']
+            })
+        return jsonify({
+            'success': True,
+            'deduplicated': True,
+            'status': job['status'],
+            'message': f'相同的 ZIP 正在处理中，已关联到任务 #{job_id}',
+            'job_id': job_id
+        }), 202
 
     # 3. 启动后台线程，并传入 job_id
-    app = current_app._get_current_object()
-    thread = threading.Thread(
-        target=process_zip_in_background,
-        args=(app, zip_path, job_id)  # <-- 传入 job_id
-    )
-    thread.start()
+    # (*** 新增 ***) JOB_EXECUTOR = 'worker' 时，任务留在 jobs 表中由常驻 worker 进程 (worker.py) 领取
+    if current_app.config['JOB_EXECUTOR'] == 'thread':
+        app = current_app._get_current_object()
+        thread = threading.Thread(
+            target=tasks.process_zip_in_background,
+            args=(app, zip_path, job_id)  # <-- 传入 job_id
+        )
+        thread.start()
 
     # 4. 立即返回响应，包含 job_id
     return jsonify({
@@ -167,6 +320,28 @@ def upload_zip_api():
     }), 202  # 202 Accepted 状态码
 
 
+@api_bp.route('/upload/profile/<int:job_id>', methods=['GET'])
+def get_upload_profile_api(job_id):
+    """
+    (*** 新增 API ***)
+    (R)ead: 任务的性能记录 (每个文件各阶段的耗时、最慢的文件、cProfile 结果)
+    GET /api/v1/upload/profile/<job_id>
+    任务还在处理时返回 202；任务不存在或没有开启性能记录时返回 404。
+    """
+    job = db.get_job_status(job_id)
+    if job is None:
+        return jsonify({'status': 'not_found', 'message': '未找到该任务'}), 404
+    if not job.get('profile'):
+        return jsonify({'status': 'not_profiled', 'message': '该任务没有开启性能记录 (上传时指定 profile=1)'}), 404
+
+    profile = db.get_job_profile(job_id)
+    if profile is None:
+        if job['status'] in ('queued', 'processing'):
+            return jsonify({'status': job['status'], 'message': '任务处理中，完成后才有性能记录'}), 202
+        return jsonify({'status': 'not_found', 'message': '没有找到该任务的性能记录'}), 404
+    return jsonify({'status': job['status'], 'job_id': job_id, 'profile': profile})
+
+
 @api_bp.route('/upload/status/<int:job_id>', methods=['GET'])
 def get_upload_status_api(job_id):
     """
@@ -191,11 +366,16 @@ def get_upload_status_api(job_id):
             'stats': result  # <-- result 字段包含 stats 字典
         })
     elif status == 'failed':
-        return jsonify({
+        response = {
             'status': 'failed',
             'message': '处理失败',
             'error': result  # <-- result 字段包含错误信息
-        })
+        }
+        if isinstance(result, dict):
+            # (*** 新增 ***) 超出解压预算时 result 为 {'error': ..., 'partial_stats': ...}
+            response['error'] = result.get('error')
+            response['stats'] = result.get('partial_stats')
+        return jsonify(response)
     else:
         # 'queued' 或 'processing'
         return jsonify({
@@ -206,28 +386,130 @@ def get_upload_status_api(job_id):
 
 # --- (其他下载和清空 API 保持不变) ---
 
+def _send_stored_file(file_path, download_name, etag, mimetype='application/pdf'):
+    """
+    (*** 新增 ***)
+    发送已保存的发票文件 (入库后内容不会再变化):
+    - ETag / Last-Modified 条件请求 (If-None-Match / If-Modified-Since -> 304)；
+    - Range 断点续传 / 分段下载 (206)；
+    - 长期缓存 (Cache-Control: private, max-age=DOWNLOAD_CACHE_MAX_AGE, immutable)；
+    - DOWNLOAD_OFFLOAD = 'x-sendfile' / 'x-accel' 时只返回响应头，由前置的 Apache / nginx 发送文件内容，
+      不占用 Python 工作线程。
+    (*** 修改 ***) file_path 也可以是打包存储的 packstore.BlobRef: 从段文件中取出该 PDF 后发送
+    (没有 Last-Modified，条件请求只用 ETag；不能交给前置服务器发送)。
+    """
+    config = current_app.config
+    offload = config['DOWNLOAD_OFFLOAD']
+
+    if isinstance(file_path, packstore.BlobRef):
+        file_path = io.BytesIO(packstore.read_blob(file_path))
+        offload = 'none'
+
+    accel_path = None
+    if offload == 'x-accel':
+        # nginx 的 internal location 对应 EXTRACT_FOLDER；不在其中的文件仍由 Python 发送
+        relative = os.path.relpath(file_path, config['EXTRACT_FOLDER'])
+        if not relative.startswith('..'):
+            accel_path = config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + urllib.parse.quote(
+                relative.replace(os.sep, '/'))
+
+    response = _werkzeug_send_file(
+        file_path, request.environ,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=etag or True,
+        max_age=config['DOWNLOAD_CACHE_MAX_AGE'],
+        use_x_sendfile=offload == 'x-sendfile' or accel_path is not None,
+        response_class=current_app.response_class,
+    )
+    if accel_path is not None and response.headers.pop('X-Sendfile', None) is not None:
+        response.headers['X-Accel-Redirect'] = accel_path
+
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+
+    encoded_filename = urllib.parse.quote(download_name, safe='')
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=\"{download_name}\"; filename*=UTF-8''{encoded_filename}"
+    )
+    return response
+
+
 @api_bp.route('/download/<int:invoice_id>', methods=['GET'])
 def download_file_api(invoice_id):
-    """ (R)ead: 下载单个 PDF """
-    invoice = db.get_invoice_by_id(invoice_id)
-    if not (invoice and invoice.get('file_path') and os.path.exists(invoice['file_path'])):
+    """
+    (R)ead: 下载单个 PDF
+    (*** 修改 ***) 只查询需要的列；支持条件请求、Range、长期缓存和 X-Sendfile / X-Accel-Redirect
+    (见 _send_stored_file)。ETag 使用文件的 SHA-256。
+    """
+    invoice = db.get_invoice_file(invoice_id)
+    source = packstore.stored_source(current_app.config, invoice) if invoice else None
+    if source is None:
         return jsonify({'error': '文件未找到或路径无效'}), 404
-    file_path = invoice['file_path']
-    download_name = os.path.basename(file_path)
+    download_name = os.path.basename(invoice['file_path'])
     if not download_name.lower().endswith(('.pdf', '.zip', '.jpg', '.png')):
         new_name = invoice.get('invoice_number') or invoice.get('summary_id') or f"invoice_{invoice_id}"
         download_name = f"{new_name}.pdf"
     try:
-        response = make_response(send_file(file_path, as_attachment=True, download_name=download_name))
-        encoded_filename = urllib.parse.quote(download_name, safe='')
-        response.headers["Content-Disposition"] = (
-            f"attachment; filename=\"{download_name}\"; filename*=UTF-8''{encoded_filename}"
-        )
-        return response
+        return _send_stored_file(source, download_name, invoice.get('file_hash'))
+    except RequestedRangeNotSatisfiable:
+        raise
     except Exception as e:
         return jsonify({'error': f'发送文件时出错: {e}'}), 500
 
 
+@api_bp.route('/invoices/<int:invoice_id>/preview', methods=['GET'])
+def preview_invoice_api(invoice_id):
+    """
+    (*** 新增 API ***)
+    (R)ead: PDF 第一页的缩略图 (?width=像素&format=png|webp)
+    缩略图按 文件 SHA-256 + 宽度 缓存在磁盘上，入库时已预先渲染默认宽度。
+    """
+    config = current_app.config
+    invoice = db.get_invoice_by_id(invoice_id)
+    source = packstore.stored_source(config, invoice) if invoice else None
+    if source is None:
+        return jsonify({'error': '文件未找到或路径无效'}), 404
+
+    fmt = request.args.get('format', previews.DEFAULT_FORMAT).lower()
+    if fmt not in previews.FORMATS:
+        return jsonify({'error': f"format 参数必须是: {', '.join(previews.FORMATS)}"}), 400
+    width = previews.normalize_width(request.args.get('width', type=int), config)
+
+    file_hash = invoice.get('file_hash')
+    if not file_hash:
+        # (旧数据: 第一次预览时计算并保存；打包存储的发票入库时一定有 file_hash)
+        file_hash = sha256_file(source)
+        db.set_invoice_file_hash(invoice_id, file_hash)
+
+    # 浏览器已缓存同一张缩略图时直接返回 304
+    etag = f"{file_hash[:32]}-{width}.{fmt}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        data = previews.get_preview(config, source, file_hash, width, fmt)
+    except previews.PreviewBusy:
+        response = jsonify({'error': '预览渲染繁忙，请稍后重试'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    except TimeoutError:
+        return jsonify({'error': '预览渲染超时'}), 504
+    except Exception as e:
+        return jsonify({'error': f'预览渲染失败: {e}'}), 500
+
+    response = make_response(data)
+    response.headers['Content-Type'] = previews.FORMATS[fmt]
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    response.set_etag(etag)
+    return response
+
+
 @api_bp.route('/download/zip', methods=['POST'])
 def download_selected_zip_api():
     """ (R)ead: 批量下载 ZIP """
@@ -237,23 +519,34 @@ def download_selected_zip_api():
     selected_ids = data.get('selected_ids')
     if not isinstance(selected_ids, list) or len(selected_ids) == 0:
         return jsonify({'error': '"selected_ids" 必须是一个非空列表'}), 400
-    file_paths = []
+    # (*** 修改 ***) 打包存储的发票从段文件读取 (每个段文件只映射一次)；ZIP 中的文件名重复时加序号
+    sources = []
     for invoice_id in selected_ids:
         try:
             invoice = db.get_invoice_by_id(int(invoice_id))
-            if invoice and invoice.get('file_path') and os.path.exists(invoice['file_path']):
-                file_paths.append(invoice['file_path'])
+            source = packstore.stored_source(current_app.config, invoice) if invoice else None
+            if source is not None:
+                sources.append((invoice['file_path'], source))
         except ValueError:
             pass
-    if not file_paths:
+    if not sources:
         return jsonify({'error': '未找到所选 ID 对应的任何有效文件'}), 404
     memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for file_path in file_paths:
+    used_names = set()
+    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf, packstore.BlobReader() as reader:
+        for file_path, source in sources:
             filename = os.path.basename(file_path)
             if not filename.lower().endswith('.pdf'):
                 filename = f"{filename}.pdf"
-            zf.write(file_path, filename)
+            stem, counter = filename[:-4], 1
+            while filename in used_names:
+                counter += 1
+                filename = f"{stem}_{counter}.pdf"
+            used_names.add(filename)
+            if isinstance(source, packstore.BlobRef):
+                zf.writestr(filename, reader.read(source))
+            else:
+                zf.write(source, filename)
     memory_file.seek(0)
     download_name = "selected_invoices.zip"
     response = make_response(memory_file.read())
@@ -269,6 +562,132 @@ def download_selected_zip_api():
 def clear_all_api():
     """ (D)elete: 清空所有数据 """
     if db.clear_all_invoices():
-        return jsonify({'success': True, 'message': '数据库和 PDF 文件已清空'})
+        file_reaper.wake()
+        return jsonify({'success': True, 'message': '数据库已清空，PDF 文件正在后台删除'})
     else:
-        return jsonify({'error': '清空数据库失败'}), 500
\ No newline at end of file
+        return jsonify({'error': '清空数据库失败'}), 500
+
+
+_MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+
+@api_bp.route('/analytics', methods=['GET'])
+def analytics_api():
+    """
+    (*** 新增 API ***)
+    (R)ead: 按月份汇总的统计 (发票数、金额合计、价税合计)，直接读取预先汇总的表。
+    参数:
+        by     = seller (按销方税号, 默认) | buyer (按购方税号) | type (按发票类型)
+        from   = 起始月份 YYYY-MM (含)，to = 结束月份 YYYY-MM (含)
+        key    = 只返回某个税号 / 类型
+        limit / offset = 分页
+    """
+    by = request.args.get('by', 'seller')
+    if by not in db.ANALYTICS_ROLLUPS:
+        return jsonify({'error': f"by 参数必须是: {', '.join(db.ANALYTICS_ROLLUPS)}"}), 400
+
+    month_from = request.args.get('from') or None
+    month_to = request.args.get('to') or None
+    for month in (month_from, month_to):
+        if month and not _MONTH_PATTERN.match(month):
+            return jsonify({'error': f'月份格式应为 YYYY-MM: {month}'}), 400
+
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, current_app.config['INVOICE_PAGE_MAX_SIZE']))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    rows, totals = db.get_analytics(by, month_from, month_to, request.args.get('key'), limit, offset)
+    for row in rows:
+        row['amount_sum'] = round(row['amount_sum'], 2)
+        row['total_amount_sum'] = round(row['total_amount_sum'], 2)
+    totals['amount_sum'] = round(totals['amount_sum'], 2)
+    totals['total_amount_sum'] = round(totals['total_amount_sum'], 2)
+
+    return jsonify({
+        'by': by,
+        'key_field': db.ANALYTICS_ROLLUPS[by][1],
+        'rows': rows,
+        'totals': totals,
+        'offset': offset,
+        'has_more': limit is not None and offset + len(rows) < totals['groups']
+    })
+
+
+@api_bp.route('/maintenance/storage-gc', methods=['GET'])
+def storage_gc_status_api():
+    """
+    (*** 新增 API ***)
+    (R)ead: 查询后台文件回收状态
+    返回待回收的文件数、累计回收的空间，以及最近一次启动对账的结果。
+    (*** 新增 ***) pack: 打包存储的压缩统计和各状态 (active / sealed / retired) 的段数。
+    """
+    report = file_reaper.get_report()
+    report['pending_tombstones'] = db.count_tombstones()
+    segments = {}
+    for segment in db.get_pack_segments():
+        segments[segment['status']] = segments.get(segment['status'], 0) + 1
+    report['pack']['segments'] = segments
+    return jsonify(report)
+
+
+@api_bp.route('/maintenance/quarantine', methods=['GET'])
+def quarantine_list_api():
+    """
+    (*** 新增 API ***)
+    (R)ead: 列出隔离区中的 PDF (解析超时或导致解析进程崩溃) 及原因
+    GET /api/v1/maintenance/quarantine?job_id=<id>&limit=100
+    """
+    job_id = request.args.get('job_id', type=int)
+    limit = min(request.args.get('limit', 100, type=int), current_app.config['INVOICE_PAGE_MAX_SIZE'])
+    return jsonify({'files': db.get_quarantine_records(job_id, max(limit, 1))})
+
+
+@api_bp.route('/maintenance/db-locks', methods=['GET', 'DELETE'])
+def db_lock_stats_api():
+    """
+    (*** 新增 API ***)
+    (R)ead: 当前进程的 SQLite 写锁等待统计 (需要 DB_LOCK_STATS=1，供压力测试使用)
+    DELETE 清零统计。多进程部署 (gunicorn) 时只反映处理本次请求的进程。
+    """
+    if request.method == 'DELETE':
+        db.reset_lock_wait_stats()
+    stats = db.get_lock_wait_stats()
+    if stats is None:
+        return jsonify({'error': '当前数据库后端不支持写锁等待统计'}), 404
+    return jsonify({'enabled': current_app.config['DB_LOCK_STATS'], 'lock_waits': stats})
+
+
+@api_bp.route('/maintenance/reextract', methods=['POST'])
+def start_reextract_api():
+    """
+    (*** 新增 API ***)
+    启动 (或续跑) 批量重新提取: 用当前版本的解析器重新处理已保存的 PDF，
+    只更新提取结果发生变化的行。
+    """
+    app = current_app._get_current_object()
+    run_id, started = reextract.start_reextract(app)
+    if not started:
+        return jsonify({'error': '重新提取任务已在运行中'}), 409
+    return jsonify({
+        'success': True,
+        'run_id': run_id,
+        'parser_version': reextract.current_parser_version(),
+        'message': '重新提取任务已在后台启动'
+    }), 202
+
+
+@api_bp.route('/maintenance/reextract/pause', methods=['POST'])
+def pause_reextract_api():
+    """(*** 新增 API ***) 暂停重新提取 (当前块完成后保存进度，之后可通过 POST /maintenance/reextract 续跑)"""
+    reextract.pause_reextract()
+    return jsonify({'success': True, 'message': '已请求暂停'})
+
+
+@api_bp.route('/maintenance/reextract', methods=['GET'])
+def reextract_status_api():
+    """(*** 新增 API ***) 查询最近一次重新提取任务的进度"""
+    run = db.get_latest_reextract_run()
+    if run is None:
+        return jsonify({'status': 'not_found', 'message': '还没有重新提取任务'}), 404
+    return jsonify(run)
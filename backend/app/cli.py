@@ -0,0 +1,131 @@
+# app/cli.py
+"""
+(*** 新增 ***) Flask 命令行命令
+
+用法 (在 backend/ 目录中):
+    flask --app run startup-report
+    flask --app run rebuild-analytics
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+import click
+
+backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Web 进程不应在启动时加载的重量级模块 (只有解析 PDF 时才需要)
+HEAVY_MODULES = ('pdfplumber', 'pdfminer', 'PIL', 'pypdfium2')
+
+# 在全新的子进程中测量冷启动: 创建 App 的耗时、RSS、加载了哪些重量级模块
+_PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+elapsed = time.perf_counter() - started
+from app.services.resources import current_rss_bytes
+heavy = sorted({name.split('.')[0] for name in sys.modules} & set(%r))
+print(json.dumps({'startup_ms': elapsed * 1000, 'rss_mb': current_rss_bytes() / 1048576, 'heavy_modules': heavy}))
+''' % (HEAVY_MODULES,)
+
+
+def _parse_importtime(stderr, top, max_depth=2):
+    """
+    解析 `python -X importtime` 的输出，返回累计耗时最多的导入 [(模块, 毫秒)]。
+    只统计嵌套层级不超过 max_depth 的导入 (0 = 顶层 import)，避免深层子模块刷屏。
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative_us = int(parts[1])
+        except ValueError:
+            continue  # (表头行)
+        name = parts[2]
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= max_depth:
+            imports.append((name.strip(), cumulative_us / 1000))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return imports[:top]
+
+
+def _run_probe():
+    env = dict(os.environ, FILE_REAPER_ENABLED='0')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE],
+        cwd=backend_dir, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise click.ClickException(f"启动测量失败:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result, completed.stderr
+
+
+@click.command('startup-report')
+@click.option('--runs', default=3, show_default=True, help='测量次数 (取中位数)')
+@click.option('--top', default=15, show_default=True, help='列出耗时最多的 N 个导入')
+@click.option('--max-startup-ms', type=float, default=None, help='冷启动耗时上限 (毫秒)，超出时返回非零退出码')
+@click.option('--max-rss-mb', type=float, default=None, help='启动后 RSS 上限 (MB)，超出时返回非零退出码')
+@click.option('--allow-heavy', is_flag=True, help='允许 Web 进程启动时加载 pdfplumber 等重量级模块')
+@click.option('--json', 'as_json', is_flag=True, help='以 JSON 输出 (便于 CI 记录)')
+def startup_report_command(runs, top, max_startup_ms, max_rss_mb, allow_heavy, as_json):
+    """测量 Web 进程的冷启动耗时、导入耗时和 RSS，用于发现启动性能回退。"""
+    results = []
+    importtime_stderr = ''
+    for _ in range(max(1, runs)):
+        result, importtime_stderr = _run_probe()
+        results.append(result)
+
+    report = {
+        'runs': len(results),
+        'startup_ms': statistics.median(r['startup_ms'] for r in results),
+        'rss_mb': statistics.median(r['rss_mb'] for r in results),
+        'heavy_modules': results[-1]['heavy_modules'],
+        'top_imports': [{'module': m, 'cumulative_ms': ms} for m, ms in _parse_importtime(importtime_stderr, top)],
+    }
+
+    failures = []
+    if max_startup_ms is not None and report['startup_ms'] > max_startup_ms:
+        failures.append(f"冷启动 {report['startup_ms']:.0f}ms 超过上限 {max_startup_ms:.0f}ms")
+    if max_rss_mb is not None and report['rss_mb'] > max_rss_mb:
+        failures.append(f"RSS {report['rss_mb']:.1f}MB 超过上限 {max_rss_mb:.1f}MB")
+    if report['heavy_modules'] and not allow_heavy:
+        failures.append(f"启动时加载了重量级模块: {', '.join(report['heavy_modules'])}")
+    report['failures'] = failures
+
+    if as_json:
+        click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        click.echo(f"冷启动 (create_app, {report['runs']} 次中位数): {report['startup_ms']:.0f} ms")
+        click.echo(f"启动后 RSS: {report['rss_mb']:.1f} MB")
+        click.echo(f"已加载的重量级模块: {', '.join(report['heavy_modules']) or '无'}")
+        click.echo(f"耗时最多的导入 (前 {top}):")
+        for item in report['top_imports']:
+            click.echo(f"  {item['cumulative_ms']:8.1f} ms  {item['module']}")
+        for failure in failures:
+            click.echo(f"[失败] {failure}", err=True)
+
+    if failures:
+        sys.exit(1)
+
+
+@click.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """根据 invoices 表全量重建统计汇总表 (/api/v1/analytics 使用)。"""
+    from . import database as db
+
+    counts = db.rebuild_analytics()
+    for name, count in counts.items():
+        click.echo(f"{name}: {count} 行汇总")
+
+
+def register_commands(app):
+    """(由 create_app 调用) 注册命令行命令"""
+    app.cli.add_command(startup_report_command)
+    app.cli.add_command(rebuild_analytics_command)
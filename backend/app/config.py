@@ -15,6 +15,18 @@ env_path = os.path.join(basedir, '../.env') # 假设 .env 在 fapiao-project 根
 
 load_dotenv(env_path)
 
+# (*** 新增 ***) PDF 文本提取引擎的名称 (services/text_engines.py 使用)。
+# 放在这里而不是 text_engines 中: 校验 PDF_TEXT_ENGINE 时不能导入 pdfplumber / pdfminer (见 startup-report)
+TEXT_ENGINES = ('pdfplumber', 'pdfium')
+DEFAULT_TEXT_ENGINE = 'pdfplumber'
+
+
+def check_text_engine(engine):
+    """未知的引擎名称抛出 ValueError (create_app 启动时校验 PDF_TEXT_ENGINE)"""
+    if engine not in TEXT_ENGINES:
+        raise ValueError(f"未知的文本提取引擎: {engine} (可选: {', '.join(TEXT_ENGINES)})")
+
+
 class Config:
     """
     从环境变量加载配置
@@ -28,9 +40,127 @@ class Config:
     DB_NAME = os.environ.get('DB_NAME', 'invoice_db')
 
     # 路径配置
+    # SQLite 数据库文件 (使用绝对路径，Web 进程和 worker 进程无论在哪个目录启动都指向同一个库)
+    DATABASE_PATH = os.path.abspath(os.environ.get('DATABASE_PATH', os.path.join(basedir, '../instance/invoices.db')))
     UPLOAD_FOLDER = os.path.abspath(os.environ.get('UPLOAD_FOLDER', os.path.join(basedir, '../../uploads')))
     EXTRACT_FOLDER = os.path.abspath(os.environ.get('EXTRACT_FOLDER', os.path.join(basedir, '../../extracted_invoices')))
 
+    # 发票列表分页: 单页最多返回的行数 (防止客户端一次请求过多数据)
+    INVOICE_PAGE_MAX_SIZE = int(os.environ.get('INVOICE_PAGE_MAX_SIZE', 500))
+
+    # 增量同步 (GET /invoices/changes): 保留的变更日志条数 / 单次请求最多读取的日志条数
+    # (客户端落后超过保留条数时会收到 reset，重新加载完整列表)
+    CHANGE_LOG_RETENTION = int(os.environ.get('CHANGE_LOG_RETENTION', 100000))
+    CHANGES_PAGE_MAX_SIZE = int(os.environ.get('CHANGES_PAGE_MAX_SIZE', 2000))
+
+    # 后台文件回收 (file_reaper): 是否启用 / 每批删除的文件数 / 轮询间隔 (秒)
+    FILE_REAPER_ENABLED = os.environ.get('FILE_REAPER_ENABLED', '1') == '1'
+    REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', 500))
+    REAPER_INTERVAL_SECONDS = float(os.environ.get('REAPER_INTERVAL_SECONDS', 5))
+    # 启动对账时，只删除超过此时长 (秒) 未修改的孤立文件，避免误删正在处理的任务文件
+    REAPER_ORPHAN_GRACE_SECONDS = int(os.environ.get('REAPER_ORPHAN_GRACE_SECONDS', 3600))
+
+    # ZIP 解压预算 (防止 ZIP 炸弹占满磁盘)，超出时任务立即失败
+    ZIP_MAX_TOTAL_BYTES = int(os.environ.get('ZIP_MAX_TOTAL_BYTES', 2 * 1024 * 1024 * 1024))
+    ZIP_MAX_MEMBER_RATIO = float(os.environ.get('ZIP_MAX_MEMBER_RATIO', 100))
+    ZIP_MAX_MEMBERS = int(os.environ.get('ZIP_MAX_MEMBERS', 20000))
+    ZIP_MAX_DEPTH = int(os.environ.get('ZIP_MAX_DEPTH', 5))
+    # (*** 新增 ***) 解压线程数: 多个成员 / 嵌套 ZIP 同时解压 (1 表示逐个解压；结果与逐个解压相同)
+    ZIP_EXTRACT_THREADS = int(os.environ.get('ZIP_EXTRACT_THREADS', min(4, os.cpu_count() or 1)))
+
+    # 多页 PDF: 页数达到 PDF_PARALLEL_MIN_PAGES 时，把页面分发到 PDF_PAGE_WORKERS 个进程并行提取
+    # (0 表示不启用页级并行)
+    PDF_PAGE_WORKERS = int(os.environ.get('PDF_PAGE_WORKERS', 0))
+    PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 16))
+
+    # 批量重新提取: 并行解析的进程数 / 每块行数 / 每块之间的休眠 (秒) / 有上传任务时是否让路
+    REEXTRACT_WORKERS = int(os.environ.get('REEXTRACT_WORKERS', 2))
+    REEXTRACT_CHUNK_SIZE = int(os.environ.get('REEXTRACT_CHUNK_SIZE', 200))
+    REEXTRACT_THROTTLE_SECONDS = float(os.environ.get('REEXTRACT_THROTTLE_SECONDS', 0.5))
+    REEXTRACT_YIELD_TO_UPLOADS = os.environ.get('REEXTRACT_YIELD_TO_UPLOADS', '1') == '1'
+
+    # 上传任务的执行方式:
+    # 'thread' = 在 Web 进程中启动后台线程处理 (默认)；
+    # 'worker' = 只写入 jobs 表，由常驻 worker 进程 (worker.py) 领取处理
+    JOB_EXECUTOR = os.environ.get('JOB_EXECUTOR', 'thread')
+
+    # 常驻 worker: 进程数 / 处理多少个任务后回收 / RSS 上限 (MB) / 空闲轮询间隔 (秒)
+    WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', 1))
+    WORKER_MAX_JOBS = int(os.environ.get('WORKER_MAX_JOBS', 200))
+    WORKER_MAX_RSS_MB = int(os.environ.get('WORKER_MAX_RSS_MB', 1024))
+    WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 0.5))
+
+    # 上传任务的 PDF 解析 (services/parse_worker.py):
+    # 是否在独立的解析进程中解析 / 解析多少个文件后回收该进程 / 解析进程 RSS 上限 (MB, 超过后回收)
+    # (PARSER_MAX_FILES 同时用于重新提取和离线批量导入的进程池，0 表示不限)
+    PARSER_SUBPROCESS = os.environ.get('PARSER_SUBPROCESS', '1') == '1'
+    PARSER_MAX_FILES = int(os.environ.get('PARSER_MAX_FILES', 500))
+    PARSER_MAX_RSS_MB = int(os.environ.get('PARSER_MAX_RSS_MB', 768))
+    # 单个 PDF 的解析时间上限 (秒，0 表示不限；需要 PARSER_SUBPROCESS)，超时或导致解析进程崩溃的文件
+    # 移到隔离区 QUARANTINE_FOLDER，任务继续处理其他文件
+    PARSE_TIMEOUT_SECONDS = float(os.environ.get('PARSE_TIMEOUT_SECONDS', 120))
+    QUARANTINE_FOLDER = os.path.abspath(os.environ.get('QUARANTINE_FOLDER', os.path.join(basedir, '../../quarantine')))
+    # (*** 新增 ***) PDF 文本提取引擎: 'pdfplumber' (默认) 或 'pdfium' (快得多，字段校验不通过的页面
+    # 自动回退到 pdfplumber；汇总单的表格框线总是由 pdfplumber 解析)，见 services/text_engines.py
+    PDF_TEXT_ENGINE = os.environ.get('PDF_TEXT_ENGINE', DEFAULT_TEXT_ENGINE)
+    # (*** 新增 ***) 任务性能记录: 上传时 profile=1 的任务记录各阶段耗时和 cProfile；
+    # 另外按 PROFILE_SAMPLE_RATE (0~1) 抽样记录各阶段耗时。报告最多保留 PROFILE_MAX_FILES 个文件的明细
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 2000))
+
+    # 多个进程共享 SQLite 时，等待写锁的最长时间 (秒)
+    DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 30))
+    # (*** 新增 ***) 记录 SQLite 写锁等待时间 (GET /maintenance/db-locks，压力测试使用；有少量开销，默认关闭)
+    DB_LOCK_STATS = os.environ.get('DB_LOCK_STATS', '0') == '1'
+
+    # 数据库后端 (见 db_backends/__init__.py): 目前只有 'sqlite' (DATABASE_PATH)
+    DB_BACKEND = os.environ.get('DB_BACKEND', 'sqlite')
+
+    # 生产模式 (serve.py / gunicorn.conf.py):
+    # 监听地址 / 进程数 / 每个进程的线程数 / 请求超时 (秒) / 优雅重启时等待请求完成的时间 (秒) /
+    # 每个进程处理多少个请求后重启 (0 表示不限，加随机抖动避免所有进程同时重启)
+    SERVER_BIND = os.environ.get('SERVER_BIND', '127.0.0.1:5000')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', min(2 * (os.cpu_count() or 1) + 1, 8)))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 4))
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', 120))
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 60))
+    SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', 5))
+    SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS', 2000))
+    SERVER_MAX_REQUESTS_JITTER = int(os.environ.get('SERVER_MAX_REQUESTS_JITTER', 200))
+
+    # PDF 预览缩略图 (GET /invoices/<id>/preview):
+    # 缓存目录 / 缓存总大小上限 (MB, 超出后按最近最少使用淘汰) / 默认宽度 / 最大宽度 (像素) /
+    # 渲染进程数 / 最多排队的渲染请求 (超出时返回 503) / 等待渲染的超时 (秒) / 入库时是否预先渲染
+    PREVIEW_CACHE_FOLDER = os.path.abspath(os.environ.get('PREVIEW_CACHE_FOLDER', os.path.join(basedir, '../instance/previews')))
+    PREVIEW_CACHE_MAX_MB = int(os.environ.get('PREVIEW_CACHE_MAX_MB', 256))
+    PREVIEW_DEFAULT_WIDTH = int(os.environ.get('PREVIEW_DEFAULT_WIDTH', 320))
+    PREVIEW_MAX_WIDTH = int(os.environ.get('PREVIEW_MAX_WIDTH', 1600))
+    PREVIEW_RENDER_WORKERS = int(os.environ.get('PREVIEW_RENDER_WORKERS', 1))
+    PREVIEW_MAX_PENDING = int(os.environ.get('PREVIEW_MAX_PENDING', 8))
+    PREVIEW_RENDER_TIMEOUT = float(os.environ.get('PREVIEW_RENDER_TIMEOUT', 30))
+    PREVIEW_PRERENDER = os.environ.get('PREVIEW_PRERENDER', '1') == '1'
+
+    # 单个 PDF 下载 (GET /download/<id>):
+    # 浏览器缓存时间 (秒，入库后的文件不会再变化) /
+    # 文件发送方式: 'none' = 由 Python 发送；'x-sendfile' = 返回 X-Sendfile 头由 Apache / lighttpd 发送；
+    # 'x-accel' = 返回 X-Accel-Redirect 头由 nginx 发送 (DOWNLOAD_ACCEL_PREFIX 是 nginx 中
+    # 指向 EXTRACT_FOLDER 的 internal location)
+    DOWNLOAD_CACHE_MAX_AGE = int(os.environ.get('DOWNLOAD_CACHE_MAX_AGE', 365 * 24 * 3600))
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', 'none')
+    DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-invoices/')
+
+    # (*** 新增 ***) 发票 PDF 的存储方式:
+    # 'files' (默认) = EXTRACT_FOLDER 中每个 PDF 一个文件；
+    # 'pack' = 追加写入 PACK_FOLDER 中的段文件 (services/packstore.py)，数据库记录 段 / 偏移 / 长度，
+    # 大量小文件不再占用 inode 和目录项。两种方式的数据可以并存 (切换后已入库的发票不受影响)。
+    # 段文件超过 PACK_SEGMENT_MAX_MB 后换新段 / 已删除数据占段的比例超过 PACK_COMPACT_GARBAGE_RATIO 时由后台压缩 /
+    # 每次追加后是否 fsync
+    FILE_STORAGE = os.environ.get('FILE_STORAGE', 'files')
+    PACK_FOLDER = os.path.abspath(os.environ.get('PACK_FOLDER', os.path.join(basedir, '../../packs')))
+    PACK_SEGMENT_MAX_MB = int(os.environ.get('PACK_SEGMENT_MAX_MB', 256))
+    PACK_COMPACT_GARBAGE_RATIO = float(os.environ.get('PACK_COMPACT_GARBAGE_RATIO', 0.5))
+    PACK_FSYNC = os.environ.get('PACK_FSYNC', '1') == '1'
+
     # --- (新添加) ---
     # 创建一个字典，供 database.py 使用
     # (这解决了 KeyError: 'DB_CONFIG' 问题)
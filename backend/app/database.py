@@ -1,8 +1,14 @@
 # app/database.py
-import sqlite3
-import json
 import os
+import json
 from flask import current_app, g
+# (*** 新增 ***) 与数据库方言有关的部分由后端模块实现 (DB_BACKEND，见 db_backends/)
+from .db_backends import ANALYTICS_ROLLUPS, ROLLUP_MONTH, get_backend
+
+
+def _backend():
+    """当前配置选择的数据库后端模块"""
+    return get_backend(current_app.config.get('DB_BACKEND', 'sqlite'))
 
 
 def get_db():
@@ -10,20 +16,10 @@ def get_db():
     (*** 解决 "未解析的引用 'get_db'" ***)
     连接到数据库。
     如果 g.db 不存在，则创建一个新的连接。
+    (*** 修改 ***) 连接由后端创建，用法相同: db.execute(sql, params)。
     """
     if 'db' not in g:
-        db_path = current_app.config.get('DATABASE_PATH', 'instance/invoices.db')
-
-        # 确保数据库所在的目录 (instance) 存在
-        db_dir = os.path.dirname(db_path)
-        if db_dir:
-            os.makedirs(db_dir, exist_ok=True)
-
-        g.db = sqlite3.connect(
-            db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row  # 允许通过列名访问数据
+        g.db = _backend().connect(current_app.config)
     return g.db
 
 
@@ -52,51 +48,28 @@ def create_db_and_table():
     (*** 修改 ***)
     初始化数据库表。
     现在此函数会同时创建 'invoices' 和 'jobs' 两个表。
+    (*** 修改 ***) 建表语句和结构迁移由后端实现 (db_backends/sqlite.py)。
     """
     db = get_db()
+    backend = _backend()
 
-    # 1. 创建发票表
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS invoices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            summary_id TEXT,
-            invoice_code TEXT,
-            invoice_number TEXT,
-            issue_date DATE,
-            amount REAL,
-            total_amount REAL,
-            buyer_name TEXT,
-            buyer_tax_id TEXT,
-            seller_name TEXT,
-            seller_tax_id TEXT,
-            file_path TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            -- 添加唯一约束防止重复 (发票代码 + 发票号码)
-            UNIQUE(invoice_code, invoice_number)
-        )
-    ''')
-
-    # 2. (*** 新增 ***) 创建后台任务表
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS jobs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'queued',
-            result TEXT,  -- 用于存储 JSON 格式的 stats 或错误信息
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # 统计汇总表由触发器增量维护；旧数据库第一次创建汇总表时，根据现有发票重建一次
+    needs_rebuild = not backend.table_exists(db, ANALYTICS_ROLLUPS['seller'][0])
+    backend.create_schema(db, ANALYTICS_ROLLUPS)
+    if needs_rebuild:
+        _fill_analytics_rollups(db)
 
     db.commit()
 
 
 # --- 发票 (Invoices) 相关函数 ---
 
-def add_invoice_record(info, permanent_path):
+def add_invoice_record(info, permanent_path, parser_version=1, file_hash=None):
     """
     (由 invoice_parser.py 调用)
     向数据库中添加一条发票记录。
+    parser_version: 提取该记录的解析器版本 (invoice_parser.PARSER_VERSION)。
+    file_hash: PDF 文件的 SHA-256。
     """
     (type, summary_id, invoice_code, invoice_number, issue_date, amount, total_amount, buyer_name, buyer_tax_id, seller_name, seller_tax_id,
      pdf_path) = info
@@ -106,15 +79,16 @@ def add_invoice_record(info, permanent_path):
         db.execute(
             """
             INSERT INTO invoices 
-            (type, summary_id, invoice_code, invoice_number, issue_date, amount, total_amount, buyer_name, buyer_tax_id, seller_name, seller_tax_id, file_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            (type, summary_id, invoice_code, invoice_number, issue_date, amount, total_amount, buyer_name, buyer_tax_id, seller_name, seller_tax_id, file_path,
+             parser_version, file_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (type, summary_id, invoice_code, invoice_number, issue_date, amount, total_amount, buyer_name, buyer_tax_id, seller_name, seller_tax_id,
-             permanent_path)
+             permanent_path, parser_version, file_hash)
         )
         db.commit()
         return True, "插入成功"
-    except sqlite3.IntegrityError:
+    except _backend().IntegrityError:
         # 触发了 UNIQUE 约束 (发票代码 + 发票号码)
         return False, "插入失败：发票已存在。"
     except Exception as e:
@@ -122,36 +96,153 @@ def add_invoice_record(info, permanent_path):
         return False, f"插入失败：{str(e)}"
 
 
-def get_invoices(search_term=''):
+# 批量插入时每条 INSERT 语句的行数 (17 列 x 56 行，低于旧版 SQLite 每条语句 999 个变量的上限)
+_INSERT_BATCH_ROWS = 56
+
+
+def add_invoice_records(records, parser_version=1, pack_locations=None):
     """
-    (由 routes.py 调用)
-    获取所有发票，支持模糊搜索。
-    """
-    db = get_db()
-    query = "SELECT * FROM invoices"
-    params = []
-    if search_term:
-        # 搜索多个字段
-        like_term = f"%{search_term}%"
-        query += """
-            WHERE buyer_name LIKE ? 
-            OR seller_name LIKE ? 
-            OR invoice_number LIKE ? 
-            OR summary_id LIKE ? 
-            OR file_path LIKE ?
-            OR buyer_tax_id LIKE ?
-            OR seller_tax_id LIKE ?
-        """
-        params = [like_term] * 7
+    (*** 新增 ***)
+    (由 invoice_parser.py 调用)
+    批量添加发票记录: records 为 [(info, permanent_path, file_hash), ...]。
+    使用多行 INSERT + 忽略重复 (SQLite: INSERT OR IGNORE)，整批只提交一次。
+    permanent_path 在本批中必须唯一。返回 (成功插入的 permanent_path 集合, 错误信息或 None)；
+    不在集合中的记录是已存在的发票 (发票代码 + 发票号码重复)。
+    (*** 新增 ***) pack_locations: {permanent_path: (段, 偏移, 长度)}，打包存储的 PDF 在段文件中的位置。
+    """
+    if not records:
+        return set(), None
+
+    pack_locations = pack_locations or {}
+    db = get_db()
+    backend = _backend()
+    inserted = set()
+    try:
+        for start in range(0, len(records), _INSERT_BATCH_ROWS):
+            chunk = records[start:start + _INSERT_BATCH_ROWS]
+            params = []
+            for info, permanent_path, file_hash in chunk:
+                params.extend(info[:11])
+                params.extend((permanent_path, parser_version, file_hash))
+                params.extend(pack_locations.get(permanent_path, (None, None, None)))
+            db.execute(
+                f"""
+                {backend.INSERT_IGNORE} INTO invoices
+                (type, summary_id, invoice_code, invoice_number, issue_date, amount, total_amount, buyer_name, buyer_tax_id, seller_name, seller_tax_id, file_path,
+                 parser_version, file_hash, pack_segment, pack_offset, pack_length)
+                VALUES {", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(chunk))}
+                """,
+                params
+            )
+
+            # 找出本批实际插入的行: 重复的发票在库中对应的是另一个 file_path。
+            # 发票代码或号码为 NULL 时 UNIQUE 约束不生效，这些记录一定会被插入。
+            numbers = sorted({info[3] for info, _, _ in chunk if info[2] is not None and info[3] is not None})
+            stored = set()
+            if numbers:
+                rows = db.execute(
+                    f"SELECT file_path FROM invoices WHERE invoice_number IN ({', '.join(['?'] * len(numbers))})",
+                    numbers
+                ).fetchall()
+                stored = {row[0] for row in rows}
+            for info, permanent_path, _ in chunk:
+                if info[2] is None or info[3] is None or permanent_path in stored:
+                    inserted.add(permanent_path)
+        db.commit()
+        return inserted, None
+    except Exception as e:
+        db.rollback()
+        return set(), f"插入失败：{str(e)}"
+
+
+def get_existing_invoice_keys(keys):
+    """
+    (*** 新增 ***)
+    (由 invoice_parser.py 调用) keys 为 [(发票代码, 发票号码), ...]，返回其中已在库中的键集合。
+    """
+    numbers = sorted({number for code, number in keys if code is not None and number is not None})
+    if not numbers:
+        return set()
+    db = get_db()
+    rows = db.execute(
+        f"SELECT invoice_code, invoice_number FROM invoices WHERE invoice_number IN ({_backend().list_subquery('VARCHAR(64)')})",
+        (json.dumps(numbers),)
+    ).fetchall()
+    wanted = set(keys)
+    return {(row[0], row[1]) for row in rows if (row[0], row[1]) in wanted}
+
+
+def _search_condition(search_term):
+    """
+    (*** 新增 ***)
+    搜索关键词对应的条件表达式 (不含 WHERE) 和参数；没有关键词时返回 ("", [])。
+    """
+    if not search_term:
+        return "", []
+    # 搜索多个字段
+    like_term = f"%{search_term}%"
+    condition = """(
+        buyer_name LIKE ? 
+        OR seller_name LIKE ? 
+        OR invoice_number LIKE ? 
+        OR summary_id LIKE ? 
+        OR file_path LIKE ?
+        OR buyer_tax_id LIKE ?
+        OR seller_tax_id LIKE ?
+    )"""
+    return condition, [like_term] * 7
 
+
+def _build_search_clause(search_term):
+    """
+    (*** 新增 ***)
+    根据搜索关键词构建 WHERE 子句和参数。
+    列表查询和统计查询共用同一套条件，保证两者结果一致。
+    """
+    condition, params = _search_condition(search_term)
+    return (" WHERE " + condition if condition else ""), params
+
+
+def get_invoices(search_term='', limit=None, offset=0):
+    """
+    (由 routes.py 调用)
+    获取发票，支持模糊搜索。
+    (*** 新增 ***) 传入 limit 时只返回一页 (配合前端的增量加载)，
+    不传则保持原行为，返回全部结果。
+    """
+    db = get_db()
+    where_clause, params = _build_search_clause(search_term)
+    query = "SELECT * FROM invoices" + where_clause
     query += " ORDER BY issue_date DESC, id DESC"
 
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params = params + [limit, offset]
+
     cursor = db.execute(query, params)
-    # 将 sqlite3.Row 转换为字典列表
+    # 将数据库行转换为字典列表
     invoices = [dict(row) for row in cursor.fetchall()]
     return invoices
 
 
+def get_invoice_stats(search_term=''):
+    """
+    (*** 新增 ***)
+    在数据库中直接聚合统计数据 (总数 / 金额合计 / 价税合计)，
+    分页加载时无需把全部发票取回 Python 再求和。
+    """
+    db = get_db()
+    where_clause, params = _build_search_clause(search_term)
+    row = db.execute(
+        "SELECT COUNT(*) AS total_count, "
+        "COALESCE(SUM(amount), 0) AS total_amount, "
+        "COALESCE(SUM(total_amount), 0) AS total_tax_amount "
+        "FROM invoices" + where_clause,
+        params
+    ).fetchone()
+    return dict(row)
+
+
 def get_invoice_by_id(invoice_id):
     """
     (由 routes.py 调用)
@@ -163,6 +254,27 @@ def get_invoice_by_id(invoice_id):
     return dict(row) if row else None
 
 
+def get_invoice_file(invoice_id):
+    """
+    (*** 新增 ***)
+    (由 routes.py 的下载接口调用) 只查询下载需要的列。
+    """
+    db = get_db()
+    row = db.execute(
+        "SELECT id, file_path, file_hash, invoice_number, summary_id, pack_segment, pack_offset, pack_length "
+        "FROM invoices WHERE id = ?",
+        (invoice_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def set_invoice_file_hash(invoice_id, file_hash):
+    """(*** 新增 ***) (由 routes.py 调用) 为旧数据补上文件的 SHA-256"""
+    db = get_db()
+    db.execute("UPDATE invoices SET file_hash = ? WHERE id = ?", (file_hash, invoice_id))
+    db.commit()
+
+
 def update_invoice_record(invoice_id, data):
     """
     (由 routes.py 调用)
@@ -174,7 +286,7 @@ def update_invoice_record(invoice_id, data):
             """
             UPDATE invoices SET 
             buyer_name = ?, seller_name = ?, issue_date = ?, amount = ?, total_amount = ?,
-            buyer_tax_id = ?, seller_tax_id = ?
+            buyer_tax_id = ?, seller_tax_id = ?, manually_edited = 1
             WHERE id = ?
             """,
             (data.get('buyer_name'), data.get('seller_name'), data.get('issue_date'),
@@ -192,21 +304,21 @@ def update_invoice_record(invoice_id, data):
 def delete_invoice_record(invoice_id):
     """
     (由 routes.py 调用)
-    删除发票记录 (并尝试删除关联文件)。
+    删除发票记录。
+    (*** 修改 ***) 关联文件不再在请求中删除，而是写入墓碑表，由后台回收线程删除。
     """
     db = get_db()
     try:
-        # 1. 先获取文件路径
-        invoice = get_invoice_by_id(invoice_id)
+        # 1. 记录待删除的文件 (与删除行在同一个事务中)
+        db.execute(
+            "INSERT INTO file_tombstones (file_path) "
+            "SELECT file_path FROM invoices WHERE id = ? AND file_path IS NOT NULL",
+            (invoice_id,)
+        )
 
         # 2. 从数据库删除
         db.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
         db.commit()
-
-        # 3. 尝试删除文件
-        if invoice and invoice.get('file_path') and os.path.exists(invoice['file_path']):
-            os.remove(invoice['file_path'])
-
         return True
     except Exception as e:
         db.rollback()
@@ -218,24 +330,25 @@ def clear_all_invoices():
     """
     (由 routes.py 调用)
     清空所有发票和文件。
+    (*** 修改 ***) 文件路径直接在数据库内转存到墓碑表 (不再全部读入内存)，
+    请求立即返回，文件由后台回收线程分批删除。
     """
     db = get_db()
     try:
-        # 1. 获取所有文件路径
-        cursor = db.execute("SELECT file_path FROM invoices")
-        file_paths = [row['file_path'] for row in cursor.fetchall()]
+        # 1. 所有文件路径写入墓碑表
+        db.execute(
+            "INSERT INTO file_tombstones (file_path) "
+            "SELECT file_path FROM invoices WHERE file_path IS NOT NULL"
+        )
 
         # 2. 清空数据库表
         db.execute("DELETE FROM invoices")
         db.execute("DELETE FROM jobs")  # (也清空 jobs 历史)
+        db.execute("DELETE FROM job_profiles")
+        # (*** 新增 ***) 变更日志只留一条 'reset'，增量同步的客户端会重新加载
+        db.execute("DELETE FROM invoice_changes")
+        db.execute("INSERT INTO invoice_changes (invoice_id, op) VALUES (0, 'reset')")
         db.commit()
-
-        # 3. 遍历删除文件
-        extract_folder = current_app.config['EXTRACT_FOLDER']
-        for path in file_paths:
-            if path and os.path.exists(path) and os.path.dirname(path) == extract_folder:
-                os.remove(path)
-
         return True
     except Exception as e:
         db.rollback()
@@ -243,21 +356,530 @@ def clear_all_invoices():
         return False
 
 
+# --- (*** 新增 ***) 增量同步 (变更日志) 相关函数 ---
+
+def get_change_seq():
+    """(由 routes.py 调用) 当前最新的变更序号 (客户端从这里开始增量同步)"""
+    db = get_db()
+    return db.execute("SELECT COALESCE(MAX(seq), 0) FROM invoice_changes").fetchone()[0]
+
+
+def get_invoice_changes(since, search_term='', limit=1000):
+    """
+    (由 routes.py 调用)
+    返回 seq > since 的变更 (最多 limit 条日志)，按当前搜索条件过滤:
+    - invoices: 发生变化且仍符合搜索条件的发票 (完整行)；
+    - deleted: 已删除、或修改后不再符合搜索条件的发票 id (客户端从列表中移除)；
+    - next_since: 下次请求使用的 since；has_more: 还有更多变更 (继续请求)；
+    - reset: since 之前的日志已被清理或数据已被清空，客户端需要重新加载完整列表。
+    """
+    db = get_db()
+    floor = db.execute("SELECT COALESCE(MIN(seq), 1) - 1 FROM invoice_changes").fetchone()[0]
+    if since < floor:
+        return {'reset': True, 'next_since': get_change_seq()}
+
+    window = db.execute(
+        "SELECT seq, invoice_id, op FROM invoice_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+        (since, limit)
+    ).fetchall()
+    if not window:
+        return {'reset': False, 'invoices': [], 'deleted': [], 'next_since': since, 'has_more': False}
+    if any(row['op'] == 'reset' for row in window):
+        return {'reset': True, 'next_since': get_change_seq()}
+
+    ids = sorted({row['invoice_id'] for row in window})
+    condition, params = _search_condition(search_term)
+    query = f"SELECT * FROM invoices WHERE id IN ({_backend().list_subquery('BIGINT')})"
+    if condition:
+        query += " AND " + condition
+    cursor = db.execute(query + " ORDER BY issue_date DESC, id DESC", [json.dumps(ids)] + params)
+    invoices = [dict(row) for row in cursor.fetchall()]
+    present = {invoice['id'] for invoice in invoices}
+
+    return {
+        'reset': False,
+        'invoices': invoices,
+        'deleted': [invoice_id for invoice_id in ids if invoice_id not in present],
+        'next_since': window[-1]['seq'],
+        'has_more': len(window) == limit,
+    }
+
+
+def prune_invoice_changes(keep):
+    """
+    (由 file_reaper.py 调用)
+    只保留最近 keep 条变更日志。since 落在被清理范围内的客户端会收到 reset，重新加载完整列表。
+    返回删除的行数。
+    """
+    db = get_db()
+    cursor = db.execute(
+        "DELETE FROM invoice_changes WHERE seq <= (SELECT max_seq FROM (SELECT MAX(seq) - ? AS max_seq FROM invoice_changes) AS latest)",
+        (max(keep, 1),)
+    )
+    db.commit()
+    return cursor.rowcount
+
+
+# --- (*** 新增 ***) 批量操作相关函数 ---
+
+# 允许批量修改的字段 (与 update_invoice_record 可修改的字段一致)
+BULK_UPDATABLE_FIELDS = (
+    'buyer_name', 'seller_name', 'issue_date', 'amount', 'total_amount',
+    'buyer_tax_id', 'seller_tax_id'
+)
+
+
+def _build_selection_clause(ids=None, search_term=None):
+    """
+    根据 id 列表或搜索条件构建 WHERE 子句。
+    id 列表以一个 JSON 参数传入 (SQLite: json_each)，无论选中多少行都只有一个绑定变量，
+    不会触发 SQLite 的变量数量上限。
+    """
+    if ids is not None:
+        return f" WHERE id IN ({_backend().list_subquery('BIGINT')})", [json.dumps([int(i) for i in ids])]
+    return _build_search_clause(search_term)
+
+
+def bulk_delete_invoices(ids=None, search_term=None):
+    """
+    (由 routes.py 调用)
+    在同一个事务中批量删除发票: 一条 INSERT ... SELECT 把所有关联文件路径写入墓碑表，
+    一条 DELETE 删除所有行。文件在提交之后由后台回收线程删除。
+    返回删除的行数，失败时返回 None。
+    """
+    db = get_db()
+    where_clause, params = _build_selection_clause(ids, search_term)
+    try:
+        _backend().begin_write(db)
+        file_filter = " AND file_path IS NOT NULL" if where_clause else " WHERE file_path IS NOT NULL"
+        db.execute(
+            "INSERT INTO file_tombstones (file_path) SELECT file_path FROM invoices" + where_clause + file_filter,
+            params
+        )
+        cursor = db.execute("DELETE FROM invoices" + where_clause, params)
+        deleted = cursor.rowcount
+        db.commit()
+        return deleted
+    except Exception as e:
+        db.rollback()
+        print(f"批量删除失败: {e}")
+        return None
+
+
+def bulk_update_invoices(data, ids=None, search_term=None):
+    """
+    (由 routes.py 调用)
+    在同一个事务中批量更新发票。
+    data 中只包含需要修改的字段 (必须属于 BULK_UPDATABLE_FIELDS)。
+    返回更新的行数，失败时返回 None。
+    """
+    fields = [field for field in BULK_UPDATABLE_FIELDS if field in data]
+    if not fields:
+        return 0
+
+    db = get_db()
+    where_clause, where_params = _build_selection_clause(ids, search_term)
+    set_clause = ", ".join(f"{field} = ?" for field in fields) + ", manually_edited = 1"
+    params = [data[field] for field in fields] + where_params
+    try:
+        cursor = db.execute("UPDATE invoices SET " + set_clause + where_clause, params)
+        updated = cursor.rowcount
+        db.commit()
+        return updated
+    except Exception as e:
+        db.rollback()
+        print(f"批量更新失败: {e}")
+        return None
+
+
+# --- (*** 新增 ***) 文件回收 (墓碑) 相关函数 ---
+
+def get_tombstone_batch(batch_size):
+    """
+    (由 file_reaper.py 调用)
+    按写入顺序取出一批待删除的文件。
+    """
+    db = get_db()
+    cursor = db.execute(
+        "SELECT id, file_path FROM file_tombstones ORDER BY id LIMIT ?",
+        (batch_size,)
+    )
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def delete_tombstones(tombstone_ids):
+    """
+    (由 file_reaper.py 调用)
+    文件删除完成后，移除对应的墓碑记录。
+    """
+    if not tombstone_ids:
+        return
+    db = get_db()
+    db.execute(
+        f"DELETE FROM file_tombstones WHERE id IN ({_backend().list_subquery('BIGINT')})",
+        (json.dumps(list(tombstone_ids)),)
+    )
+    db.commit()
+
+
+def count_tombstones():
+    """(由 routes.py 调用) 返回尚未回收的文件数量"""
+    db = get_db()
+    return db.execute("SELECT COUNT(*) FROM file_tombstones").fetchone()[0]
+
+
+def iter_referenced_file_paths():
+    """
+    (由 file_reaper.py 调用)
+    逐行遍历数据库中引用的文件路径 (包括尚未回收的墓碑)，用于对账。
+    """
+    db = get_db()
+    cursor = db.execute(
+        "SELECT file_path FROM invoices WHERE file_path IS NOT NULL "
+        "UNION SELECT file_path FROM file_tombstones"
+    )
+    for row in cursor:
+        yield row['file_path']
+
+
+def get_active_job_filenames():
+    """
+    (由 file_reaper.py 调用)
+    返回仍在排队或处理中的任务对应的上传文件名。
+    """
+    db = get_db()
+    cursor = db.execute("SELECT filename, zip_path FROM jobs WHERE status IN ('queued', 'processing')")
+    # (*** 修改 ***) 上传文件不再直接以原文件名保存，以 zip_path 的文件名为准
+    return {os.path.basename(row['zip_path']) if row['zip_path'] else row['filename'] for row in cursor.fetchall()}
+
+
+# --- (*** 新增 ***) 批量重新提取相关函数 ---
+
+# 重新提取时比较 / 更新的字段 (顺序与 invoice_parser 返回的 info 元组一致)
+EXTRACTED_FIELDS = (
+    'type', 'summary_id', 'invoice_code', 'invoice_number', 'issue_date', 'amount', 'total_amount',
+    'buyer_name', 'buyer_tax_id', 'seller_name', 'seller_tax_id'
+)
+
+
+def get_active_reextract_run(target_version):
+    """(由 reextract.py 调用) 返回该版本尚未完成的重新提取任务 (用于续跑)"""
+    db = get_db()
+    row = db.execute(
+        "SELECT * FROM reextract_runs WHERE target_version = ? AND status IN ('running', 'pausing', 'paused') "
+        "ORDER BY id DESC LIMIT 1",
+        (target_version,)
+    ).fetchone()
+    return _reextract_run_to_dict(row)
+
+
+def get_reextract_run(run_id):
+    """(由 reextract.py 调用) 根据 ID 返回重新提取任务"""
+    db = get_db()
+    row = db.execute("SELECT * FROM reextract_runs WHERE id = ?", (run_id,)).fetchone()
+    return _reextract_run_to_dict(row)
+
+
+def get_latest_reextract_run():
+    """(由 routes.py 调用) 返回最近一次重新提取任务"""
+    db = get_db()
+    row = db.execute("SELECT * FROM reextract_runs ORDER BY id DESC LIMIT 1").fetchone()
+    return _reextract_run_to_dict(row)
+
+
+def _reextract_run_to_dict(row):
+    if row is None:
+        return None
+    run = dict(row)
+    run['stats'] = json.loads(run['stats']) if run['stats'] else {}
+    return run
+
+
+def create_reextract_run(target_version):
+    """(由 reextract.py 调用) 创建新的重新提取任务，返回 run_id"""
+    db = get_db()
+    cursor = db.execute(
+        "INSERT INTO reextract_runs (target_version, status, stats) VALUES (?, 'running', ?)",
+        (target_version, json.dumps({}))
+    )
+    db.commit()
+    return cursor.lastrowid
+
+
+def update_reextract_run(run_id, status=None, last_invoice_id=None, stats=None):
+    """(由 reextract.py 调用) 保存重新提取任务的进度"""
+    db = get_db()
+    db.execute(
+        "UPDATE reextract_runs SET status = COALESCE(?, status), "
+        "last_invoice_id = COALESCE(?, last_invoice_id), "
+        "stats = COALESCE(?, stats), updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (status, last_invoice_id, json.dumps(stats) if stats is not None else None, run_id)
+    )
+    db.commit()
+
+
+def request_reextract_pause():
+    """
+    (*** 新增 ***)
+    (由 reextract.py 调用) 把运行中的重新提取任务标记为 'pausing'。
+    执行任务的进程可能不是收到暂停请求的进程，它在每块之间检查此状态。
+    """
+    db = get_db()
+    db.execute("UPDATE reextract_runs SET status = 'pausing', updated_at = CURRENT_TIMESTAMP WHERE status = 'running'")
+    db.commit()
+
+
+def get_reextract_chunk(after_id, target_version, limit):
+    """
+    (由 reextract.py 调用)
+    按 id 顺序取出一批解析器版本低于 target_version 的发票。
+    """
+    db = get_db()
+    cursor = db.execute(
+        "SELECT * FROM invoices WHERE id > ? AND parser_version < ? ORDER BY id LIMIT ?",
+        (after_id, target_version, limit)
+    )
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def apply_reextract_results(changed_rows, unchanged_ids, parser_version):
+    """
+    (由 reextract.py 调用)
+    在一个事务中写回一批重新提取的结果:
+    - changed_rows: [(invoice_id, {字段: 新值})]，只更新字段发生变化的行；
+    - unchanged_ids: 字段没有变化的行，只更新 parser_version。
+    返回因唯一约束冲突 (代码+号码已被其他行占用) 而未更新的行数。
+    """
+    db = get_db()
+    backend = _backend()
+    conflicts = 0
+    try:
+        for invoice_id, fields in changed_rows:
+            set_clause = ", ".join(f"{field} = ?" for field in fields)
+            try:
+                db.execute(
+                    "UPDATE invoices SET " + set_clause + ", parser_version = ? WHERE id = ?",
+                    list(fields.values()) + [parser_version, invoice_id]
+                )
+            except backend.IntegrityError:
+                conflicts += 1
+                unchanged_ids = list(unchanged_ids) + [invoice_id]
+        if unchanged_ids:
+            db.execute(
+                f"UPDATE invoices SET parser_version = ? WHERE id IN ({backend.list_subquery('BIGINT')})",
+                (parser_version, json.dumps(list(unchanged_ids)))
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return conflicts
+
+
+def count_processing_jobs():
+    """(由 reextract.py 调用) 当前正在处理的上传任务数 (重新提取会为其让路)"""
+    db = get_db()
+    return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'processing'").fetchone()[0]
+
+
+# --- (*** 新增 ***) 统计汇总 (Analytics) 相关函数 ---
+
+# 汇总维度和汇总表见 db_backends.ANALYTICS_ROLLUPS，汇总表和触发器由后端的 create_schema 创建。
+
+
+def _fill_analytics_rollups(db):
+    """清空汇总表并根据 invoices 全量重新计算 (不提交事务)"""
+    counts = {}
+    for name, (table, key) in ANALYTICS_ROLLUPS.items():
+        db.execute(f"DELETE FROM {table}")
+        month = ROLLUP_MONTH.format(row='invoices')
+        cursor = db.execute(
+            f"INSERT INTO {table} (month, {key}, invoice_count, amount_sum, total_amount_sum) "
+            f"SELECT {month}, COALESCE({key}, ''), COUNT(*), "
+            f"COALESCE(SUM(amount), 0), COALESCE(SUM(total_amount), 0) "
+            f"FROM invoices GROUP BY 1, 2"
+        )
+        counts[name] = cursor.rowcount
+    return counts
+
+
+def rebuild_analytics():
+    """
+    (由 cli.py 的 rebuild-analytics 命令调用)
+    在一个写事务中全量重建汇总表 (例如修复浮点累计误差，或直接改过数据库之后)。
+    返回每个维度的汇总行数。
+    """
+    db = get_db()
+    try:
+        _backend().begin_write(db)
+        counts = _fill_analytics_rollups(db)
+        db.commit()
+        return counts
+    except Exception:
+        db.rollback()
+        raise
+
+
+def get_analytics(by, month_from=None, month_to=None, key=None, limit=None, offset=0):
+    """
+    (由 routes.py 调用)
+    查询某个维度的汇总: 返回 (rows, totals)。
+    rows 按月份倒序、价税合计倒序排列；totals 是筛选范围内的合计。
+    """
+    table, key_column = ANALYTICS_ROLLUPS[by]
+    conditions, params = [], []
+    if month_from:
+        conditions.append("month >= ?")
+        params.append(month_from)
+    if month_to:
+        conditions.append("month <= ?")
+        params.append(month_to)
+    if key is not None:
+        conditions.append(f"{key_column} = ?")
+        params.append(key)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    db = get_db()
+    query = (f"SELECT month, {key_column}, invoice_count, amount_sum, total_amount_sum FROM {table}{where} "
+             f"ORDER BY month DESC, total_amount_sum DESC, {key_column}")
+    query_params = list(params)
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        query_params += [limit, offset]
+    rows = [dict(row) for row in db.execute(query, query_params).fetchall()]
+
+    totals = db.execute(
+        f"SELECT COUNT(*) AS group_count, COALESCE(SUM(invoice_count), 0) AS invoice_count, "
+        f"COALESCE(SUM(amount_sum), 0) AS amount_sum, COALESCE(SUM(total_amount_sum), 0) AS total_amount_sum "
+        f"FROM {table}{where}",
+        params
+    ).fetchone()
+    totals = dict(totals)
+    # (groups 是部分数据库 (如 MySQL 8) 的保留字，SQL 中使用 group_count 作为别名)
+    totals['groups'] = totals.pop('group_count')
+    return rows, totals
+
+
 # --- 任务 (Jobs) 相关函数 ---
 
-def create_job(filename):
+def _invoices_deleted_since(db, change_seq):
+    """变更序号 change_seq 之后是否删除过发票 (或清空过；日志已被清理到 change_seq 之后时也视为删除过)"""
+    if change_seq is None:
+        return True
+    floor = db.execute("SELECT COALESCE(MIN(seq), 1) - 1 FROM invoice_changes").fetchone()[0]
+    if change_seq < floor:
+        return True
+    row = db.execute(
+        "SELECT 1 FROM invoice_changes WHERE seq > ? AND op IN ('delete', 'reset') LIMIT 1", (change_seq,)
+    ).fetchone()
+    return row is not None
+
+
+def find_or_create_upload_job(filename, zip_path, zip_sha256, force=False, profile=0):
     """
+    (*** 新增 ***)
     (由 routes.py 调用)
-    在数据库中创建一个新任务，并返回 job_id。
+    按上传 ZIP 的 SHA-256 去重 (查找和创建在同一个写事务中，同时上传的相同 ZIP 只会创建一个任务):
+    - 有相同 ZIP 的排队中 / 处理中的任务: 返回该任务，客户端轮询同一个任务；
+    - 有相同 ZIP 的已完成任务，且之后没有删除过发票 (再处理一次只会全部重复): 返回该任务；
+    - 否则 (或 force=True) 创建新任务。失败的任务不参与去重。
+    (*** 新增 ***) profile: 新任务的性能记录级别 (见 services/profiling.py)。
+    返回 (job, created)，job 为 {'id', 'status', 'result'}。
+    """
+    db = get_db()
+    _backend().begin_write(db)
+    try:
+        if not force:
+            row = db.execute(
+                "SELECT id, status, result, change_seq FROM jobs "
+                "WHERE zip_sha256 = ? AND status <> 'failed' ORDER BY id DESC LIMIT 1",
+                (zip_sha256,)
+            ).fetchone()
+            if row and (row['status'] != 'finished' or not _invoices_deleted_since(db, row['change_seq'])):
+                db.commit()
+                result = json.loads(row['result']) if row['result'] else None
+                return {'id': row['id'], 'status': row['status'], 'result': result}, False
+
+        cursor = db.execute(
+            "INSERT INTO jobs (filename, zip_path, status, zip_sha256, change_seq, profile) "
+            "VALUES (?, ?, 'queued', ?, ?, ?)",
+            (filename, zip_path, zip_sha256, get_change_seq(), profile)
+        )
+        db.commit()
+        return {'id': cursor.lastrowid, 'status': 'queued', 'result': None}, True
+    except Exception:
+        db.rollback()
+        raise
+
+
+def claim_job(job_id, worker_id):
+    """
+    (*** 新增 ***)
+    领取指定任务: 只有状态仍为 'queued' 时才会成功 (原子操作)。
+    多个进程同时领取同一任务时，只有一个会返回 True。
     """
     db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        "INSERT INTO jobs (filename, status) VALUES (?, 'queued')",
-        (filename,)
+    cursor = db.execute(
+        "UPDATE jobs SET status = 'processing', worker = ? WHERE id = ? AND status = 'queued'",
+        (worker_id, job_id)
     )
     db.commit()
-    return cursor.lastrowid  # 返回新创建的任务 ID (int)
+    return cursor.rowcount == 1
+
+
+def claim_next_job(worker_id):
+    """
+    (*** 新增 ***)
+    (由 worker.py 调用)
+    领取最早排队的任务，返回 {'id', 'filename', 'zip_path'}；没有任务时返回 None。
+    在写事务中领取 (SQLite: BEGIN IMMEDIATE 写锁)，
+    保证多个 worker 进程不会领取同一个任务。
+    """
+    db = get_db()
+    backend = _backend()
+    try:
+        backend.begin_write(db)
+        row = db.execute(
+            "SELECT id, filename, zip_path FROM jobs "
+            "WHERE status = 'queued' AND zip_path IS NOT NULL ORDER BY id LIMIT 1" + backend.FOR_UPDATE
+        ).fetchone()
+        if row is None:
+            db.rollback()
+            return None
+        db.execute(
+            "UPDATE jobs SET status = 'processing', worker = ? WHERE id = ?",
+            (worker_id, row['id'])
+        )
+        db.commit()
+        return dict(row)
+    except Exception:
+        db.rollback()
+        raise
+
+
+def get_processing_jobs():
+    """
+    (*** 新增 ***)
+    (由 tasks.recover_stale_jobs 调用) 返回所有处理中的任务 [{'id', 'zip_path', 'worker'}]
+    """
+    db = get_db()
+    cursor = db.execute("SELECT id, zip_path, worker FROM jobs WHERE status = 'processing'")
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def requeue_job(job_id, worker_id):
+    """
+    (*** 新增 ***)
+    把由 worker_id 领取、但该进程已退出的任务放回队列 (原子操作)。
+    任务状态或领取者已经变化时不做修改，返回 False。
+    """
+    db = get_db()
+    cursor = db.execute(
+        "UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ? AND status = 'processing' AND worker = ?",
+        (job_id, worker_id)
+    )
+    db.commit()
+    return cursor.rowcount == 1
 
 
 def update_job_status(job_id, status, result=None):
@@ -290,7 +912,7 @@ def get_job_status(job_id):
     job = cursor.fetchone()
 
     if job:
-        # 将数据库行 (sqlite3.Row) 转换为字典，以便 jsonify
+        # 将数据库行转换为字典，以便 jsonify
         job_dict = dict(job)
         # 尝试将 result 字段从 JSON 字符串解析回字典
         try:
@@ -299,4 +921,136 @@ def get_job_status(job_id):
             pass  # 如果不是 JSON (例如纯错误字符串)，则保持原样
         return job_dict
 
-    return None
\ No newline at end of file
+    return None
+
+# --- (*** 新增 ***) 任务性能记录 (Profiling) 相关函数 ---
+
+def get_job_profile_mode(job_id):
+    """(由 tasks.py 调用) 任务的性能记录级别 (0 = 不记录)"""
+    db = get_db()
+    row = db.execute("SELECT profile FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return row['profile'] if row and row['profile'] else 0
+
+
+def save_job_profile(job_id, data):
+    """(由 tasks.py 调用) 保存任务的性能记录 (data 为字典，以 JSON 保存)"""
+    db = get_db()
+    db.execute(
+        "REPLACE INTO job_profiles (job_id, data) VALUES (?, ?)",
+        (job_id, json.dumps(data, ensure_ascii=False))
+    )
+    db.commit()
+
+
+def get_job_profile(job_id):
+    """(由 routes.py 调用) 任务的性能记录；没有记录时返回 None"""
+    db = get_db()
+    row = db.execute("SELECT data FROM job_profiles WHERE job_id = ?", (job_id,)).fetchone()
+    return json.loads(row['data']) if row else None
+
+
+# --- (*** 新增 ***) 打包存储 (Packfile) 相关函数 ---
+
+def create_pack_segment(owner):
+    """(由 packstore.py 调用) 登记一个新的活动段，返回段 id"""
+    db = get_db()
+    cursor = db.execute("INSERT INTO pack_segments (status, owner) VALUES ('active', ?)", (owner,))
+    db.commit()
+    return cursor.lastrowid
+
+
+def set_pack_segment_status(segment_id, status):
+    """(由 packstore.py 调用) status: 'active' / 'sealed' / 'retired'"""
+    db = get_db()
+    db.execute("UPDATE pack_segments SET status = ? WHERE id = ?", (status, segment_id))
+    db.commit()
+
+
+def get_pack_segments(status=None):
+    """(由 packstore.py 调用) 按 id 顺序列出段 (可按状态过滤)"""
+    db = get_db()
+    if status is None:
+        cursor = db.execute("SELECT id, status, owner FROM pack_segments ORDER BY id")
+    else:
+        cursor = db.execute("SELECT id, status, owner FROM pack_segments WHERE status = ? ORDER BY id", (status,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def delete_pack_segment(segment_id):
+    """(由 packstore.py 调用) 段文件删除后移除登记"""
+    db = get_db()
+    db.execute("DELETE FROM pack_segments WHERE id = ?", (segment_id,))
+    db.commit()
+
+
+def get_pack_segment_blobs(segment_id):
+    """
+    (由 packstore.py 调用)
+    段中仍被引用的数据块 [(偏移, 长度), ...]，按偏移排序。
+    (同一个 PDF 中的多张发票共用一个数据块，只返回一次)
+    """
+    db = get_db()
+    cursor = db.execute(
+        "SELECT DISTINCT pack_offset, pack_length FROM invoices WHERE pack_segment = ? ORDER BY pack_offset",
+        (segment_id,)
+    )
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+def move_pack_blobs(moves):
+    """
+    (由 packstore.py 调用)
+    压缩后把发票指向新的位置: moves 为 [(旧段, 旧偏移, 新段, 新偏移), ...]，在一个事务中更新。
+    """
+    if not moves:
+        return
+    db = get_db()
+    try:
+        for old_segment, old_offset, new_segment, new_offset in moves:
+            db.execute(
+                "UPDATE invoices SET pack_segment = ?, pack_offset = ? WHERE pack_segment = ? AND pack_offset = ?",
+                (new_segment, new_offset, old_segment, old_offset)
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+# --- (*** 新增 ***) 隔离区 (Quarantine) 相关函数 ---
+
+def add_quarantine_record(job_id, filename, file_path, reason):
+    """
+    (由 services/quarantine.py 调用)
+    记录一个被移入隔离区的 PDF 及原因。
+    """
+    db = get_db()
+    db.execute(
+        "INSERT INTO quarantine (job_id, filename, file_path, reason) VALUES (?, ?, ?, ?)",
+        (job_id, filename, file_path, reason)
+    )
+    db.commit()
+
+
+def get_quarantine_records(job_id=None, limit=100):
+    """(由 routes.py 调用) 按时间倒序列出隔离区中的文件 (可按任务筛选)"""
+    db = get_db()
+    if job_id is None:
+        cursor = db.execute("SELECT * FROM quarantine ORDER BY id DESC LIMIT ?", (limit,))
+    else:
+        cursor = db.execute("SELECT * FROM quarantine WHERE job_id = ? ORDER BY id DESC LIMIT ?", (job_id, limit))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+# --- (*** 新增 ***) 写锁等待统计 ---
+
+def get_lock_wait_stats():
+    """
+    (由 routes.py 调用)
+    当前进程的写锁等待统计 (需要 DB_LOCK_STATS=1)；后端不支持时返回 None。
+    """
+    return _backend().lock_wait_stats()
+
+
+def reset_lock_wait_stats():
+    _backend().reset_lock_wait_stats()
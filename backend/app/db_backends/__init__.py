@@ -0,0 +1,47 @@
+# app/db_backends/__init__.py
+"""
+(*** 新增 ***) 数据库后端
+
+database.py 中的函数保持不变，只把与数据库方言有关的部分交给这里的后端模块:
+建立连接、建表 / 结构迁移、写事务、JSON 列表参数、插入去重、行锁。
+后端由 Config.DB_BACKEND 选择，目前只有:
+    'sqlite' (默认) —— 单个数据库文件，无需额外服务。
+其他数据库的后端实现相同的接口，并在真实的数据库服务器上验证 (建表、触发器、任务领取) 后再加入 BACKENDS。
+
+每个后端模块提供相同的接口:
+    IntegrityError, INSERT_IGNORE, FOR_UPDATE,
+    connect(config), create_schema(db, rollups), table_exists(db, table),
+    begin_write(db), list_subquery(column_type),
+    lock_wait_stats(), reset_lock_wait_stats()
+"""
+
+# 统计汇总维度: {维度名: (汇总表, invoices 中的列)}
+# 每个汇总表以 (月份, 维度值) 为主键，保存发票数、金额合计、价税合计。
+# invoices 上的触发器在插入 / 修改 / 删除时增量更新这些表，
+# 因此查询的开销只与汇总行数 (月份数 x 维度值个数) 有关，与发票总数无关。
+ANALYTICS_ROLLUPS = {
+    'seller': ('analytics_seller_month', 'seller_tax_id'),
+    'buyer': ('analytics_buyer_month', 'buyer_tax_id'),
+    'type': ('analytics_type_month', 'type'),
+}
+
+# 月份 'YYYY-MM' (issue_date 为空时为 '')
+ROLLUP_MONTH = "COALESCE(substr({row}.issue_date, 1, 7), '')"
+
+# 增量同步 (GET /invoices/changes): 这些列变化时，触发器向 invoice_changes 追加一条变更记录
+# (parser_version / file_hash 等内部列的变化不会通知客户端)
+CHANGE_TRACKED_COLUMNS = (
+    'type', 'summary_id', 'invoice_code', 'invoice_number', 'issue_date', 'amount', 'total_amount',
+    'buyer_name', 'buyer_tax_id', 'seller_name', 'seller_tax_id', 'file_path'
+)
+
+BACKENDS = ('sqlite',)
+
+
+def get_backend(name):
+    """返回名为 name 的后端模块 (按需导入，未使用的后端不需要安装其驱动)"""
+    if name == 'sqlite':
+        from . import sqlite as backend
+    else:
+        raise ValueError(f"未知的数据库后端: {name} (可选: {', '.join(BACKENDS)})")
+    return backend
@@ -0,0 +1,335 @@
+# app/db_backends/sqlite.py
+"""
+(*** 新增 ***) SQLite 后端 (默认)
+建表语句、结构迁移和统计汇总触发器原来都在 database.create_db_and_table 中。
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import deque
+from . import ROLLUP_MONTH, CHANGE_TRACKED_COLUMNS
+
+IntegrityError = sqlite3.IntegrityError
+
+# 插入时跳过违反唯一约束的行
+INSERT_IGNORE = "INSERT OR IGNORE"
+
+# SQLite 的写事务本身就是排他的 (BEGIN IMMEDIATE)，不需要行锁
+FOR_UPDATE = ""
+
+
+# (*** 新增 ***) 写锁等待统计 (DB_LOCK_STATS=1 时记录，供压力测试使用)
+# 开始写事务的语句 (BEGIN IMMEDIATE，或事务外的第一条 INSERT / UPDATE / DELETE) 需要先取得写锁，
+# 其耗时基本就是等待其他连接释放写锁的时间。只记录最近 _LOCK_SAMPLES 次，统计只针对当前进程。
+_LOCK_SAMPLES = 100000
+_WRITE_PREFIXES = ('BEGIN IMMEDIATE', 'BEGIN EXCLUSIVE', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+_lock_waits = deque(maxlen=_LOCK_SAMPLES)
+_lock_stats = {'busy_errors': 0}
+_lock_stats_lock = threading.Lock()
+
+
+def _timed_execute(execute, in_transaction, sql, parameters):
+    if in_transaction or not sql.lstrip().upper().startswith(_WRITE_PREFIXES):
+        return execute(sql, parameters)
+    start = time.perf_counter()
+    try:
+        return execute(sql, parameters)
+    except sqlite3.OperationalError as e:
+        if 'locked' in str(e):
+            with _lock_stats_lock:
+                _lock_stats['busy_errors'] += 1
+        raise
+    finally:
+        _lock_waits.append(time.perf_counter() - start)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed_execute(super().execute, self.connection.in_transaction, sql, parameters)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """记录写锁等待时间的连接 (connection.execute 和 cursor().execute 都会经过这里)"""
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return _timed_execute(super().execute, self.in_transaction, sql, parameters)
+
+
+def lock_wait_stats():
+    """
+    (*** 新增 ***)
+    当前进程的写锁等待统计: 次数、总耗时 / p50 / p95 / p99 / 最大值 (毫秒)、超过 DB_BUSY_TIMEOUT 的次数。
+    DB_LOCK_STATS 未开启时次数为 0。
+    """
+    samples = sorted(_lock_waits)
+    with _lock_stats_lock:
+        busy_errors = _lock_stats['busy_errors']
+
+    def percentile(p):
+        if not samples:
+            return 0.0
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+
+    return {
+        'count': len(samples),
+        'total_ms': round(sum(samples) * 1000, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(samples[-1] * 1000, 2) if samples else 0.0,
+        'busy_errors': busy_errors,
+    }
+
+
+def reset_lock_wait_stats():
+    _lock_waits.clear()
+    with _lock_stats_lock:
+        _lock_stats['busy_errors'] = 0
+
+
+def connect(config):
+    """打开数据库连接 (每个 App 上下文一个，见 database.get_db)"""
+    db_path = config.get('DATABASE_PATH', 'instance/invoices.db')
+
+    # 确保数据库所在的目录 (instance) 存在
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+
+    # 多个进程共享数据库时，遇到写锁等待 DB_BUSY_TIMEOUT 秒而不是立即报错
+    db = sqlite3.connect(
+        db_path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        timeout=config.get('DB_BUSY_TIMEOUT', 5.0),
+        factory=_TimedConnection if config.get('DB_LOCK_STATS') else sqlite3.Connection
+    )
+    db.row_factory = sqlite3.Row  # 允许通过列名访问数据
+    return db
+
+
+def begin_write(db):
+    """开始写事务并立即取得写锁"""
+    db.execute("BEGIN IMMEDIATE")
+
+
+def list_subquery(column_type):
+    """
+    把一个列表作为单个 JSON 参数传入 (json_each)，返回可用于 `IN (...)` 的子查询。
+    无论列表多长都只有一个绑定变量，不会触发 SQLite 的变量数量上限。
+    (column_type 供需要声明列类型的后端使用，SQLite 忽略)
+    """
+    return "SELECT value FROM json_each(?)"
+
+
+def table_exists(db, table):
+    row = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+
+def _ensure_column(db, table, column, definition):
+    """如果表中还没有该列，则通过 ALTER TABLE 添加 (简单的结构迁移)"""
+    columns = {row['name'] for row in db.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_schema(db, rollups):
+    """
+    (由 database.create_db_and_table 调用)
+    创建所有表、索引和统计汇总触发器 (不提交事务)。
+    """
+    # WAL 模式: 多个 Web / worker 进程同时读写时，读操作不会被写事务阻塞
+    # (此设置保存在数据库文件中，只需设置一次)
+    db.execute("PRAGMA journal_mode=WAL")
+
+    # 1. 创建发票表
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT,
+            summary_id TEXT,
+            invoice_code TEXT,
+            invoice_number TEXT,
+            issue_date DATE,
+            amount REAL,
+            total_amount REAL,
+            buyer_name TEXT,
+            buyer_tax_id TEXT,
+            seller_name TEXT,
+            seller_tax_id TEXT,
+            file_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            -- 添加唯一约束防止重复 (发票代码 + 发票号码)
+            UNIQUE(invoice_code, invoice_number)
+        )
+    ''')
+
+    # 2. 创建后台任务表
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            result TEXT,  -- 用于存储 JSON 格式的 stats 或错误信息
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 3. 文件删除墓碑表
+    # 删除发票时只记录待删除的文件路径，由后台回收线程 (file_reaper) 分批删除文件
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS file_tombstones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 4. 为旧数据库补充新增的列
+    # parser_version: 提取该行时的解析器版本 (旧数据视为版本 1)
+    # manually_edited: 用户手动修改过的行，重新提取时不覆盖其字段
+    _ensure_column(db, 'invoices', 'parser_version', 'INTEGER NOT NULL DEFAULT 1')
+    _ensure_column(db, 'invoices', 'manually_edited', 'INTEGER NOT NULL DEFAULT 0')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_invoices_parser_version ON invoices (parser_version, id)')
+    # file_hash: PDF 文件的 SHA-256 (预览缩略图缓存的键；旧数据在第一次预览时补上)
+    _ensure_column(db, 'invoices', 'file_hash', 'TEXT')
+    # jobs.zip_path: 上传文件的保存路径 (独立的 worker 进程据此处理任务)
+    # jobs.worker: 领取该任务的 worker 标识
+    _ensure_column(db, 'jobs', 'zip_path', 'TEXT')
+    _ensure_column(db, 'jobs', 'worker', 'TEXT')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+    # (*** 新增 ***) jobs.zip_sha256: 上传 ZIP 的 SHA-256 (相同的 ZIP 不重复处理)
+    # jobs.change_seq: 创建任务时的变更序号 (判断之后是否删除过发票)
+    _ensure_column(db, 'jobs', 'zip_sha256', 'TEXT')
+    _ensure_column(db, 'jobs', 'change_seq', 'INTEGER')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_zip_sha256 ON jobs (zip_sha256, id)')
+    # (*** 新增 ***) jobs.profile: 性能记录级别 (0 不记录，1 阶段耗时，2 阶段耗时 + cProfile，见 profiling.py)
+    _ensure_column(db, 'jobs', 'profile', 'INTEGER NOT NULL DEFAULT 0')
+
+    # 5. 批量重新提取任务的进度表 (用于断点续跑)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS reextract_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target_version INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_invoice_id INTEGER NOT NULL DEFAULT 0,
+            stats TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 6. 统计汇总表 (按 月份 x 销方 / 购方 / 类型)，由触发器增量维护
+    _create_analytics_rollups(db, rollups)
+
+    # 7. 隔离区: 解析超时或导致解析进程崩溃的 PDF (文件移到 QUARANTINE_FOLDER)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS quarantine (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 8. 变更日志 (增量同步)，由触发器维护
+    _create_change_log(db)
+
+    # 9. (*** 新增 ***) 任务的性能记录 (JSON，每个任务一行)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS job_profiles (
+            job_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 10. (*** 新增 ***) 打包存储 (FILE_STORAGE = 'pack'，见 services/packstore.py)
+    # 段文件: status 为 active (owner 进程正在追加) / sealed (只读) / retired (已压缩，等待删除)
+    # invoices.pack_*: PDF 在段文件中的位置 (为 NULL 时文件在 file_path)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pack_segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'active',
+            owner TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _ensure_column(db, 'invoices', 'pack_segment', 'INTEGER')
+    _ensure_column(db, 'invoices', 'pack_offset', 'INTEGER')
+    _ensure_column(db, 'invoices', 'pack_length', 'INTEGER')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_invoices_pack ON invoices (pack_segment, pack_offset)')
+
+
+def _create_change_log(db):
+    """
+    invoice_changes: 每次插入 / 修改 / 删除发票时追加一行，seq 单调递增 (AUTOINCREMENT 保证删除后也不复用)。
+    op: 'upsert' = 插入或修改，'delete' = 删除，'reset' = 清空全部 (客户端需要重新加载)。
+    """
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+    ''')
+    changed = ' OR '.join(f"OLD.{column} IS NOT NEW.{column}" for column in CHANGE_TRACKED_COLUMNS)
+    db.execute("CREATE TRIGGER IF NOT EXISTS trg_invoices_changes_insert AFTER INSERT ON invoices "
+               "BEGIN INSERT INTO invoice_changes (invoice_id, op) VALUES (NEW.id, 'upsert'); END")
+    db.execute("CREATE TRIGGER IF NOT EXISTS trg_invoices_changes_delete AFTER DELETE ON invoices "
+               "BEGIN INSERT INTO invoice_changes (invoice_id, op) VALUES (OLD.id, 'delete'); END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_invoices_changes_update AFTER UPDATE ON invoices WHEN {changed} "
+               f"BEGIN INSERT INTO invoice_changes (invoice_id, op) VALUES (NEW.id, 'upsert'); END")
+
+
+def _rollup_apply_sql(table, key, row, sign):
+    """生成一条把 row (NEW / OLD) 加入 (sign='+') 或移出 (sign='-') 汇总表的语句"""
+    month = ROLLUP_MONTH.format(row=row)
+    sql = (
+        f"INSERT INTO {table} (month, {key}, invoice_count, amount_sum, total_amount_sum) "
+        f"VALUES ({month}, COALESCE({row}.{key}, ''), {sign}1, "
+        f"{sign}COALESCE({row}.amount, 0), {sign}COALESCE({row}.total_amount, 0)) "
+        f"ON CONFLICT (month, {key}) DO UPDATE SET "
+        f"invoice_count = invoice_count + excluded.invoice_count, "
+        f"amount_sum = amount_sum + excluded.amount_sum, "
+        f"total_amount_sum = total_amount_sum + excluded.total_amount_sum;"
+    )
+    if sign == '-':
+        # 发票数减到 0 的汇总行直接删除
+        sql += (
+            f" DELETE FROM {table} WHERE month = {month} AND {key} = COALESCE({row}.{key}, '') "
+            f"AND invoice_count <= 0;"
+        )
+    return sql
+
+
+def _create_analytics_rollups(db, rollups):
+    """创建汇总表和维护它们的触发器"""
+    for table, key in rollups.values():
+        db.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                month TEXT NOT NULL,
+                {key} TEXT NOT NULL,
+                invoice_count INTEGER NOT NULL DEFAULT 0,
+                amount_sum REAL NOT NULL DEFAULT 0,
+                total_amount_sum REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, {key})
+            ) WITHOUT ROWID
+        ''')
+
+    add_new = ' '.join(_rollup_apply_sql(t, k, 'NEW', '+') for t, k in rollups.values())
+    remove_old = ' '.join(_rollup_apply_sql(t, k, 'OLD', '-') for t, k in rollups.values())
+    watched = ', '.join(['issue_date', 'amount', 'total_amount'] + [k for _, k in rollups.values()])
+
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_invoices_analytics_insert AFTER INSERT ON invoices "
+               f"BEGIN {add_new} END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_invoices_analytics_delete AFTER DELETE ON invoices "
+               f"BEGIN {remove_old} END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_invoices_analytics_update AFTER UPDATE OF {watched} ON invoices "
+               f"BEGIN {remove_old} {add_new} END")
@@ -0,0 +1,86 @@
+# app/services/coordination.py
+"""
+(*** 新增 ***) 多进程协调
+
+生产模式下 (serve.py / gunicorn) 同一个数据库会被多个 Web 进程和 worker 进程共享:
+- 任务领取由数据库保证 (database.claim_job / claim_next_job 是原子操作)；
+- 只应在一个进程中运行的后台工作 (文件回收、启动对账、卡住任务的恢复、批量重新提取)
+  通过本模块的文件锁选出唯一的执行者。锁由操作系统在进程退出时自动释放，
+  其他进程会在下一个周期接手。
+"""
+import os
+import socket
+
+try:
+    import fcntl
+except ImportError:  # (Windows)
+    fcntl = None
+    import msvcrt
+
+
+def process_id():
+    """当前进程的标识 (写入 jobs.worker): "主机名-PID" """
+    return local_process_id(os.getpid())
+
+
+def local_process_id(pid):
+    """(*** 新增 ***) 本机进程 pid 的标识 (与 process_id 格式相同)"""
+    return f"{socket.gethostname()}-{pid}"
+
+
+def is_local_process_dead(worker_id):
+    """
+    worker_id 属于本机且对应的进程已不存在时返回 True。
+    其他主机的进程、无法解析的标识、无法判断的平台一律返回 False (视为存活)。
+    """
+    host, _, pid = (worker_id or '').rpartition('-')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if os.name == 'nt':
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False  # (进程存在，只是属于其他用户)
+    return False
+
+
+def lock_path(config, name):
+    """锁文件放在数据库所在目录，作用范围与数据库一致"""
+    db_dir = os.path.dirname(config['DATABASE_PATH']) or '.'
+    os.makedirs(db_dir, exist_ok=True)
+    return os.path.join(db_dir, f"fapiao-{name}.lock")
+
+
+def try_lock(path):
+    """
+    尝试以非阻塞方式获得文件锁。
+    成功时返回打开的文件对象 (持有期间不要关闭)，锁已被其他进程持有时返回 None。
+    """
+    handle = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def release_lock(handle):
+    """释放 try_lock 获得的锁"""
+    if handle is None:
+        return
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        handle.close()
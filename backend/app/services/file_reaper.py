@@ -0,0 +1,252 @@
+# app/services/file_reaper.py
+"""
+后台文件回收 (Garbage Collection)
+
+- 删除发票时只在 file_tombstones 表中写入墓碑，请求立即返回；
+  本模块的后台线程按批次删除这些文件，再移除墓碑。
+- 进程启动时对账: 删除 EXTRACT_FOLDER / UPLOAD_FOLDER 中数据库不再引用的文件，
+  以及上次异常退出遗留的临时解压目录 (创建进程已退出的)，并报告回收的空间。
+- (*** 新增 ***) 打包存储 (FILE_STORAGE = 'pack') 的发票没有单独的文件，墓碑直接移除；
+  段文件中的垃圾由每个周期的 packstore.compact 回收。
+- (*** 新增 ***) 多进程部署时 (serve.py / gunicorn)，每个进程都会启动本线程，
+  但只有获得维护锁 (coordination.try_lock) 的进程执行上述工作和卡住任务的恢复；
+  其他进程每个周期重试一次，持有者退出后自动接手。
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+from .. import database as db
+from . import coordination, packstore
+
+# 本项目创建的临时目录统一使用此前缀 (tempfile.mkdtemp(prefix=...))，
+# 对账时据此识别遗留目录，不会误删其他程序的临时文件。
+TEMP_DIR_PREFIX = 'fapiao_'
+
+_wake_event = threading.Event()
+_reaper_thread = None
+_reaper_lock = threading.Lock()
+_maintenance_lock = None  # (持有时为锁文件对象)
+
+
+def temp_dir_prefix(kind=''):
+    """
+    (*** 新增 ***) 临时目录的前缀: "fapiao_<PID>_<kind>"。
+    对账时只删除创建进程已经退出的目录 (长时间运行的任务只在目录有直接子项变化时才更新 mtime，
+    不能按 mtime 判断是否仍在使用)。
+    """
+    return f"{TEMP_DIR_PREFIX}{os.getpid()}_{kind}"
+
+
+def _temp_dir_abandoned(name, path, grace):
+    """临时目录是否可以删除: 名称中带 PID 的，创建进程已退出；旧格式的目录仍按 mtime 判断"""
+    pid, _, _ = name[len(TEMP_DIR_PREFIX):].partition('_')
+    if pid.isdigit():
+        return coordination.is_local_process_dead(coordination.local_process_id(int(pid)))
+    return _is_older_than(path, grace)
+
+# 最近一次对账 / 累计回收的统计 (供 /maintenance/storage-gc 查询)
+_report = {
+    'last_reconcile': None,
+    'tombstones_reaped': 0,
+    'bytes_reclaimed': 0,
+    'jobs_recovered': 0,
+    'maintenance_process': False,  # 本进程是否负责后台维护
+    # (*** 新增 ***) 打包存储的段压缩 (累计，见 packstore.compact)
+    'pack': {'segments_sealed': 0, 'segments_compacted': 0, 'segments_deleted': 0,
+             'bytes_moved': 0, 'bytes_reclaimed': 0},
+}
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += _file_size(os.path.join(root, name))
+    return total
+
+
+def _is_older_than(path, seconds):
+    try:
+        return time.time() - os.path.getmtime(path) > seconds
+    except OSError:
+        return False
+
+
+def reap_tombstones(extract_folder, batch_size):
+    """
+    删除一批墓碑对应的文件。
+    返回 (处理的墓碑数, 回收的字节数)。
+    只删除位于 EXTRACT_FOLDER 中的文件 (与原 clear_all_invoices 的规则一致)。
+    """
+    batch = db.get_tombstone_batch(batch_size)
+    reclaimed = 0
+    for tombstone in batch:
+        path = tombstone['file_path']
+        if path and os.path.dirname(path) == extract_folder and os.path.exists(path):
+            size = _file_size(path)
+            try:
+                os.remove(path)
+                reclaimed += size
+            except OSError as e:
+                # (删除失败也移除墓碑: 遗留文件会在下次启动对账时再次处理)
+                print(f"[文件回收] 删除失败 {path}: {e}")
+
+    db.delete_tombstones([t['id'] for t in batch])
+    return len(batch), reclaimed
+
+
+def reconcile_storage(config):
+    """
+    启动时对账，删除数据库不再引用的文件和遗留的临时目录。
+    为避免与正在进行的任务竞争，只处理超过宽限期 (REAPER_ORPHAN_GRACE_SECONDS) 未修改的文件。
+    返回统计字典。
+    """
+    grace = config['REAPER_ORPHAN_GRACE_SECONDS']
+    extract_folder = config['EXTRACT_FOLDER']
+    upload_folder = config['UPLOAD_FOLDER']
+    report = {'orphan_pdfs': 0, 'orphan_uploads': 0, 'temp_dirs': 0, 'bytes_reclaimed': 0}
+
+    # 1. EXTRACT_FOLDER: 数据库中没有引用的 PDF
+    referenced = set(db.iter_referenced_file_paths())
+    with os.scandir(extract_folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.path in referenced or not _is_older_than(entry.path, grace):
+                continue
+            size = _file_size(entry.path)
+            try:
+                os.remove(entry.path)
+                report['orphan_pdfs'] += 1
+                report['bytes_reclaimed'] += size
+            except OSError as e:
+                print(f"[文件回收] 删除孤立文件失败 {entry.path}: {e}")
+    del referenced
+
+    # 2. UPLOAD_FOLDER: 不属于任何排队中/处理中任务的 ZIP
+    active = db.get_active_job_filenames()
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name in active or not _is_older_than(entry.path, grace):
+                continue
+            size = _file_size(entry.path)
+            try:
+                os.remove(entry.path)
+                report['orphan_uploads'] += 1
+                report['bytes_reclaimed'] += size
+            except OSError as e:
+                print(f"[文件回收] 删除遗留上传失败 {entry.path}: {e}")
+
+    # 3. 系统临时目录: 异常退出后遗留的解压目录
+    temp_root = tempfile.gettempdir()
+    with os.scandir(temp_root) as entries:
+        for entry in entries:
+            if not (entry.name.startswith(TEMP_DIR_PREFIX) and entry.is_dir()):
+                continue
+            if not _temp_dir_abandoned(entry.name, entry.path, grace):
+                continue
+            size = _dir_size(entry.path)
+            shutil.rmtree(entry.path, ignore_errors=True)
+            report['temp_dirs'] += 1
+            report['bytes_reclaimed'] += size
+
+    return report
+
+
+def _wait(config):
+    _wake_event.wait(config['REAPER_INTERVAL_SECONDS'])
+    _wake_event.clear()
+
+
+def _run(app):
+    """回收线程主循环"""
+    global _maintenance_lock
+    with app.app_context():
+        config = app.config
+
+        # 0. 等待获得维护锁 (同一数据库只有一个进程执行回收 / 对账 / 任务恢复)
+        lock_path = coordination.lock_path(config, 'maintenance')
+        while _maintenance_lock is None:
+            _maintenance_lock = coordination.try_lock(lock_path)
+            if _maintenance_lock is None:
+                _wait(config)
+        _report['maintenance_process'] = True
+        print(f"[文件回收] 进程 {coordination.process_id()} 负责后台维护")
+
+        try:
+            report = reconcile_storage(config)
+            report['finished_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            _report['last_reconcile'] = report
+            _report['bytes_reclaimed'] += report['bytes_reclaimed']
+            print(f"[文件回收] 启动对账完成: {report}")
+        except Exception as e:
+            print(f"[文件回收] 启动对账失败: {e}")
+
+        from .. import tasks  # (延迟导入，避免循环导入)
+
+        while True:
+            try:
+                _report['jobs_recovered'] += tasks.recover_stale_jobs(app)
+            except Exception as e:
+                print(f"[文件回收] 恢复卡住的任务失败: {e}")
+
+            try:
+                db.prune_invoice_changes(config['CHANGE_LOG_RETENTION'])
+            except Exception as e:
+                print(f"[文件回收] 清理变更日志失败: {e}")
+
+            try:
+                # (*** 新增 ***) 打包存储: 封存 / 压缩 / 删除段文件 (没有段时只是一次查询)
+                compacted = packstore.compact(config)
+                for key, value in compacted.items():
+                    _report['pack'][key] += value
+                _report['bytes_reclaimed'] += compacted['bytes_reclaimed']
+            except Exception as e:
+                print(f"[文件回收] 压缩打包存储失败: {e}")
+
+            try:
+                count, reclaimed = reap_tombstones(config['EXTRACT_FOLDER'], config['REAPER_BATCH_SIZE'])
+                _report['tombstones_reaped'] += count
+                _report['bytes_reclaimed'] += reclaimed
+                if count == config['REAPER_BATCH_SIZE']:
+                    continue  # (还有积压，立即处理下一批)
+            except Exception as e:
+                print(f"[文件回收] 回收失败: {e}")
+
+            _wait(config)
+
+
+def start_reaper(app):
+    """
+    (由 create_app 调用)
+    在当前进程中启动回收线程 (每个进程只启动一次)。
+    """
+    global _reaper_thread
+    with _reaper_lock:
+        if _reaper_thread is not None and _reaper_thread.is_alive():
+            return
+        _reaper_thread = threading.Thread(target=_run, args=(app,), name='file-reaper', daemon=True)
+        _reaper_thread.start()
+
+
+def wake():
+    """
+    有新的墓碑写入时唤醒回收线程 (不必等到下一个轮询周期)。
+    (只能唤醒本进程的线程；维护锁在其他进程时，由该进程在下一个周期处理)
+    """
+    _wake_event.set()
+
+
+def get_report():
+    """
+    返回回收统计 (累计值 + 最近一次启动对账的结果 + 打包存储的压缩统计)。
+    多进程部署时只有 maintenance_process 为 True 的进程有统计。
+    """
+    return dict(_report, pack=dict(_report['pack']))
@@ -0,0 +1,35 @@
+# app/services/fingerprint.py
+"""
+(*** 新增 ***) 文件指纹 (SHA-256)
+"""
+import hashlib
+
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path):
+    """分块读取文件并返回 SHA-256 的十六进制字符串"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_with_sha256(stream, path):
+    """
+    (*** 新增 ***)
+    把文件对象 stream 分块写入 path，同时计算 SHA-256 (上传的内容只读一遍)，返回十六进制字符串
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        while True:
+            chunk = stream.read(_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
@@ -1,49 +1,28 @@
 import re
 import os
 import shutil
-import pdfplumber
-from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from flask import current_app
 from .. import database as db
+from .values import parse_date, safe_float, UNKNOWN_DATE
+from .fingerprint import sha256_file
+from . import previews, parse_worker, quarantine, text_engines, packstore
+from .profiling import phase
 
 
-# --- 辅助函数 (保持不变) ---
-
-def _parse_date(date_str):
-    """
-    一个辅助函数，用于将不同格式的日期字符串（如 "2020年12月23日" 或 "2020-12-23"）
-    统一解析为 Python 的 date 对象。
-    如果解析失败或输入为空，返回一个默认日期（1900-01-01）。
-    """
-    if not date_str:
-        return datetime.strptime('1900-01-01', '%Y-%m-%d').date()
-    try:
-        if '年' in date_str:
-            return datetime.strptime(date_str, '%Y年%m月%d日').date()
-        else:
-            return datetime.strptime(date_str, '%Y-%m-%d').date()
-    except ValueError:
-        # 如果格式不匹配
-        print(f"日期格式错误: {date_str}，使用默认日期。")
-        return datetime.strptime('1900-01-01', '%Y-%m-%d').date()
+# (*** 新增 ***) 解析器版本号
+# 每当提取逻辑 (正则、区域、多页处理等) 发生变化并可能改变结果时递增，
+# 批量重新提取任务 (services/reextract.py) 会重新处理版本较低的记录。
+# 版本 1: 只处理第一页；版本 2: 多页 PDF 支持。
+PARSER_VERSION = 2
 
 
-def _safe_float(float_str):
-    """
-    一个辅助函数，用于安全地将字符串转换为浮点数。
-    它会清理掉货币符号 (¥, ￥), 空格, 和逗号, 然后再转换。
-    如果转换失败，返回 0.0。
-    """
-    if not float_str:
-        return 0.0
-    try:
-        # 将输入统一转为字符串，并移除首尾空格
-        cleaned_str = str(float_str).strip()
-        # 使用正则表达式移除所有 ¥, ￥, 空格, 和逗号
-        cleaned_str = re.sub(r'[¥￥\s,]', '', cleaned_str)
-        return float(cleaned_str)
-    except (ValueError, TypeError):
-        return 0.0
+# --- 辅助函数 ---
+# (*** 修改 ***) _parse_date / _safe_float 已移至轻量模块 values.py (Web 进程无需导入本模块)
+_parse_date = parse_date
+_safe_float = safe_float
 
 
 # --- 提取器 (*** 此处为关键修改 ***) ---
@@ -53,6 +32,7 @@ def _extract_fapiao_info(page, full_text, pdf_path):
     【标准发票提取器】
     使用区域裁剪 (Bounding Box) 提取除 "价税合计" 之外的所有字段。
     "价税合计" (total_amount) 使用全局 full_text 搜索，这是最健壮的方法。
+    (*** 修改 ***) page 是文本提取引擎的页面 (见 text_engines.py)，不再直接使用 pdfplumber。
     """
     # 1. 获取页面尺寸
     width, height = page.width, page.height
@@ -65,10 +45,11 @@ def _extract_fapiao_info(page, full_text, pdf_path):
 
     try:
         # 3. 从每个区域提取文本
-        buyer_text = page.crop(buyer_box).extract_text() or ""
-        meta_text = page.crop(meta_box).extract_text() or ""
-        amount_text = page.crop(amount_box).extract_text() or ""
-        seller_text = page.crop(seller_box).extract_text() or ""  # 只用于提取销售方
+        with phase('crop'):
+            buyer_text = page.crop_text(buyer_box)
+            meta_text = page.crop_text(meta_box)
+            amount_text = page.crop_text(amount_box)
+            seller_text = page.crop_text(seller_box)  # 只用于提取销售方
 
     except Exception as e:
         print(f"页面裁剪失败 {pdf_path}: {e}")
@@ -201,40 +182,225 @@ def _extract_summary_info(full_text, tables, pdf_path):
     return infos
 
 
-def extract_invoice_info(pdf_path):
+# --- (*** 新增 ***) 多页 PDF 支持 ---
+
+# 汇总单标题 / 标准发票标题 (用于逐页分类)
+SUMMARY_MARKER = '收费公路通行费电子票据汇总单'
+FAPIAO_MARKERS = ('电子普通发票', '电子专用发票')
+
+# 页级并行使用的进程池 (按需创建，进程内复用)
+_page_pool = None
+_page_pool_size = 0
+
+
+def _classify_page(full_text):
+    """根据页面文本判断页面类型: 'summary' / 'fapiao' / 'unknown'"""
+    if SUMMARY_MARKER in full_text:
+        return 'summary'
+    elif any(marker in full_text for marker in FAPIAO_MARKERS):
+        return 'fapiao'
+    return 'unknown'
+
+
+def _fapiao_info_valid(info):
+    """
+    (*** 新增 ***) 标准发票的关键字段是否都已识别 (发票代码可以为空: 全电发票没有发票代码；
+    开票日期未识别时 parse_date 返回 UNKNOWN_DATE)。
+    不通过时用 pdfplumber 重新提取该页。
+    """
+    (_, _, _, invoice_number, issue_date, _, total_amount, buyer_name, _, seller_name, _, _) = info
+    return (invoice_number != 'Unknown' and issue_date != UNKNOWN_DATE and total_amount > 0
+            and buyer_name != 'Unknown' and seller_name != 'Unknown')
+
+
+def _extract_page_content(page, pdf_path, want_tables):
+    with phase('extract_text'):
+        full_text = page.extract_text()
+    with phase('classify'):
+        kind = _classify_page(full_text)
+    result = {'kind': kind, 'text': full_text, 'tables': [], 'infos': []}
+
+    if kind == 'summary' or (kind == 'unknown' and want_tables):
+        with phase('table'):
+            result['tables'] = page.extract_tables()
+    elif kind == 'fapiao':
+        result['infos'] = _extract_fapiao_info(page, full_text, pdf_path)
+    return result
+
+
+def _extract_page(page, pdf_path, want_tables):
+    """
+    提取单页，返回可序列化的页结果 (可在进程之间传递):
+    {'kind', 'text', 'tables', 'infos'}
+    want_tables: 该页如果类型未知，是否仍提取表格 (可能是汇总单的续页)。
+    提取完成后立即释放该页缓存的对象 (chars / objects / layout)，控制内存占用。
+    (*** 新增 ***) 使用 pdfium 引擎时，页面没有文本 (可能是字体无法解码) 或标准发票字段校验不通过，
+    用 pdfplumber 重新提取该页。
+    """
+    try:
+        result = _extract_page_content(page, pdf_path, want_tables)
+        fallback = page.fallback()
+        if fallback is not None and (
+                not result['text'].strip() or not all(_fapiao_info_valid(info) for info in result['infos'])):
+            with phase('fallback'):
+                result = _extract_page_content(fallback, pdf_path, want_tables)
+        return result
+    finally:
+        page.close()
+
+
+def _extract_page_range(pdf_path, start, end, continues_summary, engine=text_engines.DEFAULT_ENGINE):
+    """
+    (进程池中执行) 打开 PDF，只解析 [start, end) 范围内的页面。
+    continues_summary: 范围内第一页之前是否是汇总单 (决定未知页面是否提取表格)。
+    """
+    with text_engines.open_document(pdf_path, engine, page_range=(start, end)) as document:
+        results = []
+        in_summary = continues_summary
+        for index in range(start, end):
+            result = _extract_page(document.page(index), pdf_path, want_tables=in_summary)
+            in_summary = result['kind'] == 'summary' or (result['kind'] == 'unknown' and bool(result['tables']))
+            results.append(result)
+        return results
+
+
+def _get_page_pool(workers):
+    """返回页级并行的进程池 (使用 spawn，避免在带线程的 Web 进程中 fork)"""
+    global _page_pool, _page_pool_size
+    if _page_pool is None or _page_pool_size != workers:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=False)
+        _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        _page_pool_size = workers
+    return _page_pool
+
+
+def _discard_page_pool():
+    """(*** 新增 ***) 丢弃已损坏的进程池 (子进程异常退出后不能再提交)，下次调用 _get_page_pool 时重新创建"""
+    global _page_pool, _page_pool_size
+    if _page_pool is not None:
+        _page_pool.shutdown(wait=False)
+    _page_pool = None
+    _page_pool_size = 0
+
+
+def _summary_id_of(full_text):
+    match = re.search(r'汇总单号\s*:\s*(\d+)', full_text, re.IGNORECASE | re.DOTALL)
+    return match.group(1) if match else None
+
+
+def _is_code_header(row):
+    header = ''.join(cell.strip() for cell in row if cell)
+    return '票据代码' in header or '票据号码' in header
+
+
+def _stitch_continuation_tables(summary_tables, page_tables):
+    """
+    把续页上的表格接到汇总单后面。
+    续页表格通常没有表头 (票据代码/票据号码)，这里补上最近一个明细表的表头，
+    使 _extract_summary_info 能识别它们。
+    """
+    last_header = None
+    for table in summary_tables:
+        if table and _is_code_header(table[0]):
+            last_header = table[0]
+
+    for table in page_tables:
+        if not table:
+            continue
+        if last_header is not None and not _is_code_header(table[0]):
+            table = [last_header] + table
+        summary_tables.append(table)
+
+
+def _assemble_document(page_results, pdf_path):
+    """
+    把逐页结果组装为发票记录列表:
+    - 汇总单: 标题页 + 后续续页 (未知类型但有表格的页，或汇总单号相同的页) 合并后统一提取；
+    - 标准发票: 每页单独提取，同一文件中的重复号码 (例如销货清单页) 只保留一次。
+    """
+    infos = []
+    summary = None  # {'summary_id', 'texts', 'tables'}
+
+    def flush_summary():
+        if summary is not None:
+            infos.extend(_extract_summary_info('\n'.join(summary['texts']), summary['tables'], pdf_path))
+
+    for result in page_results:
+        kind = result['kind']
+        if kind == 'summary':
+            summary_id = _summary_id_of(result['text'])
+            if summary is not None and summary_id in (None, summary['summary_id']):
+                # 重复标题的续页
+                summary['texts'].append(result['text'])
+                _stitch_continuation_tables(summary['tables'], result['tables'])
+                continue
+            flush_summary()
+            summary = {'summary_id': summary_id, 'texts': [result['text']], 'tables': list(result['tables'])}
+        elif kind == 'unknown' and summary is not None and result['tables']:
+            summary['texts'].append(result['text'])
+            _stitch_continuation_tables(summary['tables'], result['tables'])
+        else:
+            flush_summary()
+            summary = None
+            infos.extend(result['infos'])
+    flush_summary()
+
+    # 去重: 同一文件中相同 (代码, 号码) 只保留第一条；
+    # 非首条的标准发票如果号码未识别 (续页 / 清单页)，不作为新发票
+    unique_infos = []
+    seen = set()
+    for info in infos:
+        key = (info[2], info[3])
+        if info[0] == 'invoice' and info[3] == 'Unknown' and unique_infos:
+            continue
+        if key in seen and info[0] == 'invoice':
+            continue
+        seen.add(key)
+        unique_infos.append(info)
+    return unique_infos
+
+
+def extract_invoice_info(pdf_path, page_workers=0, parallel_min_pages=16, engine=text_engines.DEFAULT_ENGINE):
     """
     【主提取路由函数】
-    (此函数逻辑正确，保持不变)
     使用 try...finally 块确保 pdf.close() 被显式调用，防止 PermissionError。
+
+    (*** 修改 ***) 处理所有页面 (原来只看第一页):
+    逐页分类，汇总单的续页表格会拼接到汇总单中，打包多张发票的 PDF 会返回每一张。
+    page_workers > 0 且页数 >= parallel_min_pages 时，页面按区间分发到进程池并行提取。
+    (*** 新增 ***) engine: 文本提取引擎 'pdfplumber' / 'pdfium' (见 text_engines.py，由 PDF_TEXT_ENGINE 配置)。
     """
     pdf = None  # (1) 在 try 之外定义
     try:
-        # (2) 在 try 块中打开。如果 pdfplumber.open 失败, pdf 保持为 None
-        pdf = pdfplumber.open(pdf_path)
+        # (2) 在 try 块中打开。如果打开失败, pdf 保持为 None
+        with phase('open'):
+            pdf = text_engines.open_document(pdf_path, engine)
+            page_count = pdf.page_count
 
-        if not pdf.pages:
+        if not page_count:
             print(f"PDF {pdf_path} 没有页面。")
             return []  # (finally 块会运行)
 
-        page = pdf.pages[0]
-        full_text = page.extract_text() or ""
-
-        # --- 路由逻辑 ---
-        if '收费公路通行费电子票据汇总单' in full_text:
-            tables = page.extract_tables() or []
-            return _extract_summary_info(full_text, tables, pdf_path)
-
-        elif '电子普通发票' in full_text or '电子专用发票' in full_text:
-            # *** 此处将调用更新后的函数 ***
-            return _extract_fapiao_info(page, full_text, pdf_path)
-
+        if page_workers and page_count >= parallel_min_pages:
+            page_results = _extract_pages_parallel(pdf, pdf_path, page_workers, engine)
         else:
+            page_results = []
+            in_summary = False
+            for index in range(page_count):
+                result = _extract_page(pdf.page(index), pdf_path, want_tables=in_summary)
+                in_summary = result['kind'] == 'summary' or (result['kind'] == 'unknown' and bool(result['tables']))
+                page_results.append(result)
+
+        with phase('assemble'):
+            infos = _assemble_document(page_results, pdf_path)
+        if not infos:
             # (这是 apply.pdf 会进入的路径, 导致它被跳过)
             print(f"文件 {os.path.basename(pdf_path)} 类型未知，跳过。")
-            return []
+        return infos
 
     except Exception as e:
-        # (如果 pdfplumber.open 失败, e.g. 文件损坏, 会进入这里)
+        # (如果打开失败, e.g. 文件损坏, 会进入这里)
         print(f"提取 {pdf_path} 失败 (可能是损坏的文件或非PDF): {e}")
         return []
 
@@ -246,61 +412,227 @@ def extract_invoice_info(pdf_path):
             # print(f"DEBUG: 显式关闭 {os.path.basename(pdf_path)}") # (调试时取消注释)
 
 
-# --- 主服务函数 (保持不变) ---
-def process_extracted_pdfs(temp_extract_dir):
+def _extract_pages_parallel(pdf, pdf_path, page_workers, engine=text_engines.DEFAULT_ENGINE):
     """
-    (此函数逻辑正确，保持不变)
-    处理临时目录中的所有PDF，将其解析并存入数据库
+    页级并行: 第一页在当前进程提取 (用于确定文档类型)，
+    其余页面按连续区间分发给进程池，每个子进程只解析自己负责的页面。
     """
-    stats = {"processed": 0, "inserted": 0, "skipped": 0, "duplicates": 0}
-
-    for filename in os.listdir(temp_extract_dir):
-        if not filename.lower().endswith('.pdf'):
-            continue
-
-        temp_pdf_path = os.path.abspath(os.path.join(temp_extract_dir, filename))
+    first = _extract_page(pdf.page(0), pdf_path, want_tables=False)
+    first_in_summary = first['kind'] == 'summary'
+
+    page_count = pdf.page_count
+    chunk_size = max(1, -(-(page_count - 1) // page_workers))  # 向上取整
+    page_results = [first]
+    with phase('parallel_pages'):
+        for attempt in range(2):
+            pool = _get_page_pool(page_workers)
+            try:
+                futures = [
+                    pool.submit(_extract_page_range, pdf_path, start, min(start + chunk_size, page_count),
+                                first_in_summary, engine)
+                    for start in range(1, page_count, chunk_size)
+                ]
+                for future in futures:
+                    page_results.extend(future.result())
+                break
+            except BrokenProcessPool:
+                # (*** 新增 ***) 有子进程异常退出 (OOM / 崩溃)，整个进程池都不能再用:
+                # 换一个新进程池重试一次；再次失败时该文件按解析失败处理，之后的文件使用新进程池
+                _discard_page_pool()
+                del page_results[1:]
+                if attempt:
+                    raise
+                print(f"页级并行的子进程异常退出，重建进程池后重试: {os.path.basename(pdf_path)}")
+
+    # 区间边界修正: 汇总单从某个区间中间开始、延续到下一个区间时，
+    # 下一区间的第一页没有提取表格，这里补提取。
+    for index in range(1, page_count):
+        previous, result = page_results[index - 1], page_results[index]
+        previous_in_summary = previous['kind'] == 'summary' or (previous['kind'] == 'unknown' and previous['tables'])
+        if result['kind'] == 'unknown' and previous_in_summary and not result['tables']:
+            page = pdf.page(index)
+            try:
+                with phase('table'):
+                    result['tables'] = page.extract_tables()
+            finally:
+                page.close()
+    return page_results
+
+
+def _permanent_path(filename):
+    """
+    确定永久路径 (防止文件名冲突)。
+    (*** 修改 ***) 用 O_CREAT | O_EXCL 创建空文件占住文件名: 从选定文件名到插入数据库、复制文件之间
+    隔着整批插入，多个进程 / 任务同时保存同名文件时只检查 os.path.exists 会选中同一路径，后复制的会覆盖先复制的。
+    未插入数据库的路径由调用方删除 (_release_paths)。
+    """
+    extract_folder = current_app.config['EXTRACT_FOLDER']
+    name, ext = os.path.splitext(filename)
+    permanent_path = os.path.join(extract_folder, filename)
+    counter = 1
+    while True:
+        try:
+            os.close(os.open(permanent_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return permanent_path
+        except FileExistsError:
+            permanent_path = os.path.join(extract_folder, f"{name}_{counter}{ext}")
+            counter += 1
+
+
+def _release_paths(paths):
+    """删除 _permanent_path 占住、但没有用上的文件"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def store_parsed_pdfs(parsed, stats):
+    """
+    (*** 新增 ***)
+    (由 process_extracted_pdfs 和 scripts/bulk_ingest.py 调用)
+    把已解析的 PDF 存入数据库: parsed 为 [(源 PDF 路径, 文件 SHA-256, infos), ...]。
+    所有发票一次批量插入 (重复的发票由数据库忽略)，插入成功的才复制到 EXTRACT_FOLDER。
+    结果累加到 stats 的 inserted / duplicates / skipped 中。
+    (*** 新增 ***) 打包存储 (FILE_STORAGE = 'pack') 时先把 PDF 追加到段文件，位置随发票一起插入
+    (其中发票都已存在的 PDF 不追加)，不再复制文件。
+    """
+    config = current_app.config
+    packed = packstore.is_enabled(config)
+    if packed:
+        existing = db.get_existing_invoice_keys([(info[2], info[3]) for _, _, infos in parsed for info in infos])
+    records, sources, pack_locations = [], [], {}
+    try:
+        for source_path, file_hash, infos in parsed:
+            location = None
+            if packed:
+                if all((info[2], info[3]) in existing for info in infos):
+                    stats["duplicates"] += len(infos)
+                    continue
+                with phase('copy'):
+                    location = packstore.append_file(config, source_path)
+            for info in infos:
+                if packed:
+                    permanent_path = packstore.logical_path(os.path.basename(source_path))
+                    pack_locations[permanent_path] = location
+                else:
+                    permanent_path = _permanent_path(os.path.basename(source_path))
+                records.append((info, permanent_path, file_hash))
+                sources.append(source_path)
+
+        with phase('insert'):
+            inserted_paths, error = db.add_invoice_records(records, parser_version=PARSER_VERSION,
+                                                           pack_locations=pack_locations)
+    except BaseException:
+        if not packed:
+            _release_paths(permanent_path for _, permanent_path, _ in records)
+        raise
+    if error:
+        print(error)
+    if not packed:
+        # 重复 / 插入失败的发票不需要占住的文件名
+        _release_paths(permanent_path for _, permanent_path, _ in records if permanent_path not in inserted_paths)
+
+    for (info, permanent_path, file_hash), source_path in zip(records, sources):
+        if permanent_path in inserted_paths:
+            # 插入成功后，才复制文件 (覆盖占位的空文件)
+            if not packed:
+                try:
+                    with phase('copy'):
+                        shutil.copy2(source_path, permanent_path)
+                except Exception as e:
+                    print(f"文件复制失败 (但数据库已插入!): {e}")
+                    continue
+            stats["inserted"] += 1
+            # (*** 新增 ***) 后台预渲染预览缩略图 (同一文件只渲染一次)
+            if config['PREVIEW_PRERENDER']:
+                source = packstore.blob_ref(config, pack_locations[permanent_path]) if packed else permanent_path
+                previews.prerender(config, source, file_hash)
+        elif error:
+            stats["skipped"] += 1  # 记为跳过（其他错误）
+        else:
+            # 插入失败 (重复)
+            stats["duplicates"] += 1
 
-        # 1. 提取信息 (infos 是一个列表)
-        #    (现在 extract_invoice_info 已经修复了文件占用问题)
-        infos = extract_invoice_info(temp_pdf_path)
 
-        if not infos:
-            # (如果 infos 为空, 意味着它是 'apply.pdf' 或其他非发票文件)
-            stats["skipped"] += 1
-            continue
+def _process_one_pdf(temp_pdf_path, worker, config, stats, memory, job_id, profiler):
+    """
+    (*** 新增 ***) (原 process_extracted_pdfs 的循环体)
+    解析并保存一个 PDF，返回 (结果, 发票数)，结果为 'stored' / 'skipped' / 'quarantined'。
+    """
+    page_workers = config['PDF_PAGE_WORKERS']
+    parallel_min_pages = config['PDF_PARALLEL_MIN_PAGES']
+    engine = config['PDF_TEXT_ENGINE']
+
+    # 1. 提取信息 (infos 是一个列表)
+    #    (现在 extract_invoice_info 已经修复了文件占用问题)
+    with phase('parse'):
+        if worker is not None:
+            try:
+                infos = worker.parse(
+                    temp_pdf_path, page_workers, parallel_min_pages, memory,
+                    config['PARSE_TIMEOUT_SECONDS'] or None, profiler, engine
+                )
+            except parse_worker.ParseFailed as e:
+                stats["quarantined"] += 1
+                if isinstance(e, parse_worker.ParseTimeout):
+                    stats["timed_out"] += 1
+                quarantine.quarantine_file(config, temp_pdf_path, e.reason, job_id)
+                return 'quarantined', 0
+        else:
+            infos = extract_invoice_info(temp_pdf_path, page_workers, parallel_min_pages, engine)
+    parse_worker.record_process_rss(memory)
 
-        stats["processed"] += 1
+    if not infos:
+        # (如果 infos 为空, 意味着它是 'apply.pdf' 或其他非发票文件)
+        stats["skipped"] += 1
+        return 'skipped', 0
 
-        for info in infos:
-            # 2. 确定永久路径 (防止文件名冲突)
+    stats["processed"] += 1
+    # (*** 新增 ***) 文件指纹: 预览缩略图缓存的键
+    with phase('hash'):
+        file_hash = sha256_file(temp_pdf_path)
 
-            # --- (文件名逻辑已在您提供的代码中修复) ---
-            permanent_filename = os.path.basename(temp_pdf_path)
-            # --- (修复结束) ---
+    # 2. 存入数据库并复制文件 (一个 PDF 中的所有发票一次批量插入)
+    store_parsed_pdfs([(temp_pdf_path, file_hash, infos)], stats)
+    return 'stored', len(infos)
 
-            permanent_path = os.path.join(current_app.config['EXTRACT_FOLDER'], permanent_filename)
-            counter = 1
-            while os.path.exists(permanent_path):
-                name, ext = os.path.splitext(permanent_filename)
-                new_name = f"{name}_{counter}{ext}"
-                permanent_path = os.path.join(current_app.config['EXTRACT_FOLDER'], new_name)
-                counter += 1
 
-            # 3. 尝试插入数据库
-            success, message = db.add_invoice_record(info, permanent_path)
+# --- 主服务函数 (保持不变) ---
+def process_extracted_pdfs(temp_extract_dir, job_id=None, profiler=None):
+    """
+    (此函数逻辑正确，保持不变)
+    处理临时目录中的所有PDF，将其解析并存入数据库
+    (*** 新增 ***) 解析超时 / 解析进程崩溃的文件移入隔离区 (记录 job_id 和原因)，
+    计入 stats 的 quarantined (其中超时的同时计入 timed_out)，然后继续处理下一个文件。
+    (*** 新增 ***) profiler (profiling.JobProfiler) 不为 None 时记录每个文件各阶段的耗时。
+    """
+    stats = {"processed": 0, "inserted": 0, "skipped": 0, "duplicates": 0, "timed_out": 0, "quarantined": 0}
+    config = current_app.config
+    # (*** 新增 ***) 在可回收的独立解析进程中提取 (见 parse_worker.py)，内存高水位写入任务统计
+    memory = parse_worker.new_memory_stats()
+    worker = parse_worker.acquire(config) if config['PARSER_SUBPROCESS'] else None
 
-            if success:
-                # 4. 插入成功后，才复制文件
-                try:
-                    shutil.copy2(temp_pdf_path, permanent_path)
-                    stats["inserted"] += 1
-                except Exception as e:
-                    print(f"文件复制失败 (但数据库已插入!): {e}")
-            else:
-                # 插入失败 (重复)
-                if "已存在" in message:
-                    stats["duplicates"] += 1
-                else:
-                    stats["skipped"] += 1  # 记为跳过（其他错误）
+    try:
+        for filename in os.listdir(temp_extract_dir):
+            if not filename.lower().endswith('.pdf'):
+                continue
+
+            temp_pdf_path = os.path.abspath(os.path.join(temp_extract_dir, filename))
+            if profiler is not None:
+                profiler.start_file(temp_pdf_path)
+            outcome, invoice_count = 'failed', 0
+            try:
+                outcome, invoice_count = _process_one_pdf(
+                    temp_pdf_path, worker, config, stats, memory, job_id, profiler
+                )
+            finally:
+                if profiler is not None:
+                    profiler.end_file(outcome, invoice_count)
+    finally:
+        if worker is not None:
+            parse_worker.release(worker)
 
-    return stats
\ No newline at end of file
+    stats["memory"] = memory
+    return stats
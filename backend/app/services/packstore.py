@@ -0,0 +1,249 @@
+# app/services/packstore.py
+"""
+(*** 新增 ***) 打包存储 (FILE_STORAGE = 'pack')
+
+大量几十 KB 的 PDF 各占一个文件时，inode、目录项和文件系统元数据的开销比数据本身还大。
+打包存储把 PDF 依次追加到 PACK_FOLDER 中的段文件 ({段 id:08d}.pack)，发票行记录
+(pack_segment, pack_offset, pack_length):
+- 写入: 每个进程只向自己的活动段追加 (进程内由 _writer_lock 串行化)，段超过 PACK_SEGMENT_MAX_MB 后封存并换新段。
+  先写段文件、再插入数据库行，进程在两步之间退出只会留下未引用的数据 (由压缩回收)，不会出现指向缺失数据的发票；
+- 读取: 通过 mmap 取出 [偏移, 偏移 + 长度) (下载、打包下载、预览、重新提取)；
+- 删除: 删除发票行即可，段中的数据变成垃圾；
+- 压缩 (compact，由 file_reaper 的维护线程周期调用): 封存所属进程已退出的活动段；
+  垃圾比例超过 PACK_COMPACT_GARBAGE_RATIO 的封存段 (封存后超过 REAPER_ORPHAN_GRACE_SECONDS 未修改)，
+  把仍被引用的数据复制到活动段、更新发票行，旧段标记为 retired，再过一个宽限期后删除
+  (正在读取旧位置的请求有足够时间完成)。
+
+打包存储的发票 file_path 为逻辑路径 "pack:<随机 id>/<原文件名>" (不对应磁盘文件，每张发票一个)，
+保留原文件名用于下载文件名和搜索。
+"""
+import os
+import mmap
+import time
+import uuid
+import threading
+from collections import namedtuple
+from .. import database as db
+from . import coordination
+
+PATH_PREFIX = 'pack:'
+
+# 段文件中的一个 PDF (可在进程之间传递，预览渲染进程据此读取)
+BlobRef = namedtuple('BlobRef', 'segment_path offset length')
+
+_writer_lock = threading.Lock()
+_writers = {}  # PACK_FOLDER -> 本进程的活动段 _Writer
+
+
+def is_enabled(config):
+    return config['FILE_STORAGE'] == 'pack'
+
+
+def logical_path(filename):
+    """
+    打包存储的发票使用的 file_path (每张发票唯一，与普通文件一样)。
+    同一 PDF 中的多张发票指向段文件中的同一位置，但 file_path 各不相同:
+    add_invoice_records 按 file_path 返回插入成功的发票。
+    """
+    return f"{PATH_PREFIX}{uuid.uuid4().hex}/{filename}"
+
+
+def segment_path(config, segment_id):
+    return os.path.join(config['PACK_FOLDER'], f"{segment_id:08d}.pack")
+
+
+def blob_ref(config, location):
+    """(段, 偏移, 长度) -> BlobRef"""
+    segment_id, offset, length = location
+    return BlobRef(segment_path(config, segment_id), offset, length)
+
+
+def stored_source(config, invoice):
+    """
+    发票 PDF 的读取来源: 打包存储时为 BlobRef，普通文件为路径；文件不存在时返回 None。
+    invoice 需要包含 file_path / pack_segment / pack_offset / pack_length 列。
+    """
+    if invoice.get('pack_segment') is not None:
+        return blob_ref(config, (invoice['pack_segment'], invoice['pack_offset'], invoice['pack_length']))
+    file_path = invoice.get('file_path')
+    if file_path and os.path.isfile(file_path):
+        return file_path
+    return None
+
+
+# --- 读取 ---
+
+class BlobReader:
+    """
+    读取多个 BlobRef (支持 with)。每个段文件只映射一次，打包下载时不会为每张发票重复 mmap。
+    """
+
+    def __init__(self):
+        self._maps = {}
+
+    def read(self, ref):
+        mapped = self._maps.get(ref.segment_path)
+        if mapped is None:
+            with open(ref.segment_path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[ref.segment_path] = mapped
+        end = ref.offset + ref.length
+        if end > len(mapped):
+            # (段文件被截断: 与普通文件缺失一样按读取失败处理)
+            raise OSError(f"段文件数据不完整: {ref.segment_path} [{ref.offset}, {end})")
+        return mapped[ref.offset:end]
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_blob(ref):
+    """读取单个 BlobRef，返回 bytes"""
+    with BlobReader() as reader:
+        return reader.read(ref)
+
+
+# --- 写入 ---
+
+class _Writer:
+    def __init__(self, segment_id, path):
+        self.segment_id = segment_id
+        self.pid = os.getpid()
+        self.file = open(path, 'ab')
+        self.size = self.file.tell()
+
+
+def _active_writer(config):
+    """(在 _writer_lock 内调用) 本进程的活动段；没有时登记一个新段"""
+    folder = config['PACK_FOLDER']
+    writer = _writers.get(folder)
+    if writer is not None and writer.pid != os.getpid():
+        # (fork 出的子进程不能与父进程共用同一个段，换一个新段)
+        writer = None
+    if writer is None:
+        os.makedirs(folder, exist_ok=True)
+        segment_id = db.create_pack_segment(coordination.process_id())
+        writer = _writers[folder] = _Writer(segment_id, segment_path(config, segment_id))
+    return writer
+
+
+def append_bytes(config, data):
+    """把一个 PDF 追加到本进程的活动段，返回 (段 id, 偏移, 长度)"""
+    with _writer_lock:
+        writer = _active_writer(config)
+        offset = writer.size
+        writer.file.write(data)
+        writer.file.flush()
+        if config['PACK_FSYNC']:
+            os.fsync(writer.file.fileno())
+        writer.size += len(data)
+        location = (writer.segment_id, offset, len(data))
+
+        if writer.size >= config['PACK_SEGMENT_MAX_MB'] * 1024 * 1024:
+            writer.file.close()
+            del _writers[config['PACK_FOLDER']]
+            db.set_pack_segment_status(writer.segment_id, 'sealed')
+    return location
+
+
+def append_file(config, file_path):
+    with open(file_path, 'rb') as f:
+        return append_bytes(config, f.read())
+
+
+# --- 压缩 ---
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _is_older_than(path, seconds):
+    try:
+        return time.time() - os.path.getmtime(path) > seconds
+    except OSError:
+        return False
+
+
+def _compact_segment(config, segment_id):
+    """把段中仍被引用的数据复制到活动段并更新发票行，返回 (移动的字节数, 数据块数)"""
+    moved_bytes = 0
+    blobs = db.get_pack_segment_blobs(segment_id)
+    moves = []
+    with BlobReader() as reader:
+        for offset, length in blobs:
+            data = reader.read(blob_ref(config, (segment_id, offset, length)))
+            new_segment, new_offset, _ = append_bytes(config, data)
+            moves.append((segment_id, offset, new_segment, new_offset))
+            moved_bytes += length
+            if len(moves) >= 500:
+                db.move_pack_blobs(moves)
+                moves = []
+    db.move_pack_blobs(moves)
+    return moved_bytes, len(blobs)
+
+
+def compact(config):
+    """
+    (由 file_reaper 的维护线程周期调用)
+    封存遗留的活动段、压缩垃圾过多的封存段、删除已过宽限期的 retired 段。
+    返回本轮的统计字典。
+    """
+    report = {'segments_sealed': 0, 'segments_compacted': 0, 'segments_deleted': 0,
+              'bytes_moved': 0, 'bytes_reclaimed': 0}
+    grace = config['REAPER_ORPHAN_GRACE_SECONDS']
+    ratio = config['PACK_COMPACT_GARBAGE_RATIO']
+
+    for segment in db.get_pack_segments():
+        path = segment_path(config, segment['id'])
+
+        if segment['status'] == 'active':
+            # 1. 所属进程已退出的活动段不会再被追加，封存后参与压缩
+            if coordination.is_local_process_dead(segment['owner']):
+                db.set_pack_segment_status(segment['id'], 'sealed')
+                report['segments_sealed'] += 1
+            continue
+
+        if segment['status'] == 'sealed':
+            # 2. 垃圾比例 = 1 - 仍被引用的字节数 / 段文件大小。
+            # 刚封存的段可能还有已追加、尚未插入数据库的 PDF，宽限期内不处理
+            if not _is_older_than(path, grace):
+                continue
+            size = _file_size(path)
+            live = sum(length for _, length in db.get_pack_segment_blobs(segment['id']))
+            if size and (size - live) / size < ratio:
+                continue
+            moved, _ = _compact_segment(config, segment['id'])
+            db.set_pack_segment_status(segment['id'], 'retired')
+            if os.path.exists(path):
+                os.utime(path)  # (retired 的宽限期从现在开始计算)
+            report['segments_compacted'] += 1
+            report['bytes_moved'] += moved
+            report['bytes_reclaimed'] += max(size - moved, 0)
+            continue
+
+        # 3. retired: 宽限期过后删除段文件 (正在读取旧位置的请求已经完成)
+        if not _is_older_than(path, grace) and os.path.exists(path):
+            continue
+        if db.get_pack_segment_blobs(segment['id']):
+            # (仍有发票指向该段: 恢复为封存段，下一轮重新压缩)
+            db.set_pack_segment_status(segment['id'], 'sealed')
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        db.delete_pack_segment(segment['id'])
+        report['segments_deleted'] += 1
+
+    return report
@@ -0,0 +1,202 @@
+# app/services/parse_worker.py
+"""
+(*** 新增 ***) 内存受控的解析进程
+
+pdfplumber / pdfminer 在一个进程中连续解析成千上万个 PDF 时，内存会缓慢增长
+(字体 / 对象缓存、碎片)，长任务最终可能被 OOM killer 结束。因此上传任务的 PDF
+不在任务进程中解析，而是交给一个独立的解析进程 (ParseWorker):
+- 每个文件解析完后释放页面缓存并执行一次垃圾回收，然后报告该进程当前的 RSS 和峰值 RSS；
+- 解析了 PARSER_MAX_FILES 个文件，或 RSS 超过 PARSER_MAX_RSS_MB 后，结束该进程，
+  下一个文件由新的解析进程处理 (回收)；
+- 解析进程在任务之间复用 (acquire / release)，不必每个任务都重新导入 pdfplumber；
+- (*** 新增 ***) 单个文件解析超过 PARSE_TIMEOUT_SECONDS 时直接结束解析进程 (抛出 ParseTimeout)，
+  解析进程崩溃时抛出 ParseCrashed，调用方把该文件移入隔离区后继续处理下一个文件；
+- 进程池 (重新提取、离线批量导入) 使用 pool_kwargs 按文件数回收子进程。
+- (*** 新增 ***) 开启了性能记录的任务，解析进程同时返回该文件各阶段的耗时 (以及 cProfile 结果)，见 profiling.py。
+"""
+import gc
+import os
+import sys
+import signal
+import cProfile
+import threading
+import multiprocessing
+
+from .resources import current_rss_bytes, peak_rss_bytes
+
+_MB = 1024 * 1024
+
+_idle = []  # 空闲的解析进程 (任务之间复用)
+_idle_lock = threading.Lock()
+
+
+class ParseFailed(Exception):
+    """解析进程没有返回结果 (reason 为写入隔离区记录的原因)"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ParseTimeout(ParseFailed):
+    """单个文件解析超时 (解析进程已被结束)"""
+
+
+class ParseCrashed(ParseFailed):
+    """解析进程在解析过程中意外退出 (例如被 OOM killer 结束)"""
+
+
+def pool_kwargs(max_files):
+    """
+    ProcessPoolExecutor 的回收参数: 每个子进程处理 max_files 个任务后换新进程
+    (max_tasks_per_child 需要 Python 3.11+，更早的版本不回收)。
+    """
+    if max_files and sys.version_info >= (3, 11):
+        return {'max_tasks_per_child': max_files}
+    return {}
+
+
+def _serve(conn):
+    """
+    (解析进程主循环) 接收 (路径, 页级并行参数, 记录级别, 文本提取引擎)，返回 (infos, 当前 RSS, 峰值 RSS, 性能记录)
+    性能记录在没有开启时为 None，否则为 ({阶段: 秒}, cProfile 结果或 None)
+    """
+    from .invoice_parser import extract_invoice_info
+    from . import profiling
+
+    # 独立的进程组: 超时时连同页级并行的子进程一起结束
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        pdf_path, page_workers, parallel_min_pages, profile_mode, engine = request
+        profile = None
+        if profile_mode:
+            profiling.start_recording()
+            profiler = cProfile.Profile() if profile_mode == profiling.PROFILE_FULL else None
+            if profiler is not None:
+                profiler.enable()
+            try:
+                infos = extract_invoice_info(pdf_path, page_workers, parallel_min_pages, engine)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                phases = profiling.stop_recording()
+            profile = (phases, profiling.cprofile_stats(profiler) if profiler is not None else None)
+        else:
+            infos = extract_invoice_info(pdf_path, page_workers, parallel_min_pages, engine)
+        # pdfminer 的对象之间有循环引用，立即回收，避免 RSS 在两次自动 GC 之间堆高
+        gc.collect()
+        conn.send((infos, current_rss_bytes(), peak_rss_bytes(), profile))
+
+
+class ParseWorker:
+    """一个可回收的解析进程 (在首次解析时启动，达到文件数或内存上限后结束)"""
+
+    def __init__(self, max_files, max_rss_mb):
+        self.max_files = max_files
+        self.max_rss_bytes = max_rss_mb * _MB
+        self._process = None
+        self._conn = None
+        self._files = 0  # 当前进程已解析的文件数
+
+    def _start(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, args=(child_conn,), name='fapiao-parser', daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._files = 0
+
+    def _kill(self):
+        """立即结束解析进程 (POSIX 上结束整个进程组)"""
+        if hasattr(os, 'killpg'):
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self._process.kill()
+        self._process.join()
+
+    def stop(self, kill=False):
+        """结束解析进程 (下次解析时重新启动)。kill=True 时不等待，直接结束"""
+        if self._process is None:
+            return
+        if not kill:
+            try:
+                self._conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._kill()
+        self._conn.close()
+        self._process = self._conn = None
+
+    def parse(self, pdf_path, page_workers, parallel_min_pages, memory, timeout=None, profiler=None,
+              engine='pdfplumber'):
+        """
+        在解析进程中提取一个 PDF，返回 infos (与 invoice_parser.extract_invoice_info 相同)。
+        memory 是任务统计中的内存字典 (见 new_memory_stats)，在这里更新高水位和回收次数。
+        超过 timeout 秒没有结果时结束解析进程并抛出 ParseTimeout；
+        解析进程意外退出时抛出 ParseCrashed。两种情况下一个文件都会使用新的解析进程。
+        (*** 新增 ***) profiler (profiling.JobProfiler) 不为 None 时，解析进程记录的阶段耗时合并到其中。
+        (*** 新增 ***) engine: 文本提取引擎 (见 text_engines.py)。
+        """
+        if self._process is None:
+            self._start()
+        try:
+            profile_mode = profiler.mode if profiler is not None else 0
+            self._conn.send((pdf_path, page_workers, parallel_min_pages, profile_mode, engine))
+            if not self._conn.poll(timeout):
+                self.stop(kill=True)
+                raise ParseTimeout(f"解析超时 (超过 {timeout:g} 秒)")
+            infos, rss, peak, profile = self._conn.recv()
+        except (EOFError, OSError) as e:
+            self._process.join(timeout=1)
+            reason = f"解析进程异常退出 (退出码 {self._process.exitcode})"
+            print(f"[解析进程] 解析 {pdf_path} 时{reason}: {e}")
+            memory['parser_crashes'] += 1
+            self.stop(kill=True)
+            raise ParseCrashed(reason)
+
+        if profile is not None and profiler is not None:
+            profiler.add_remote(*profile)
+
+        self._files += 1
+        memory['parser_peak_rss_mb'] = max(memory['parser_peak_rss_mb'], round(peak / _MB, 1))
+
+        # 回收检查: 文件数 / 内存
+        if (self.max_files and self._files >= self.max_files) or (self.max_rss_bytes and rss > self.max_rss_bytes):
+            memory['parser_recycles'] += 1
+            self.stop()
+        return infos
+
+
+def new_memory_stats():
+    """任务统计中的内存高水位 (MB): 解析进程峰值 RSS / 任务进程 RSS，以及解析进程的回收 / 异常退出次数"""
+    return {'parser_peak_rss_mb': 0, 'process_peak_rss_mb': 0, 'parser_recycles': 0, 'parser_crashes': 0}
+
+
+def record_process_rss(memory):
+    """更新任务进程 (调用方) 的 RSS 高水位"""
+    memory['process_peak_rss_mb'] = max(memory['process_peak_rss_mb'], round(current_rss_bytes() / _MB, 1))
+
+
+def acquire(config):
+    """取得一个解析进程 (优先复用空闲的)"""
+    with _idle_lock:
+        if _idle:
+            return _idle.pop()
+    return ParseWorker(config['PARSER_MAX_FILES'], config['PARSER_MAX_RSS_MB'])
+
+
+def release(worker):
+    """任务结束后归还解析进程，供下一个任务复用"""
+    with _idle_lock:
+        _idle.append(worker)
@@ -0,0 +1,217 @@
+# app/services/previews.py
+"""
+(*** 新增 ***) PDF 预览缩略图
+
+- 把 PDF 第一页渲染为 PNG / WebP，结果保存在磁盘缓存 (PREVIEW_CACHE_FOLDER) 中，
+  文件名为 "<PDF 的 SHA-256>_<宽度>.<格式>"，内容相同的 PDF 共用同一张缩略图；
+- 缓存总大小超过 PREVIEW_CACHE_MAX_MB 时按最近最少使用淘汰 (命中时更新文件的 mtime)；
+- 渲染在独立的进程池中进行 (每个进程 PREVIEW_RENDER_WORKERS 个渲染进程)，
+  排队的渲染超过 PREVIEW_MAX_PENDING 时直接拒绝，预览请求再多也不会挤占解析任务的 CPU；
+- 入库时提交一次默认宽度的预渲染 (尽力而为: 渲染队列已满时跳过)，第一次查看时直接命中缓存。
+"""
+import io
+import os
+import time
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 支持的格式 -> Content-Type
+FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+DEFAULT_FORMAT = 'png'
+
+# 宽度向上取整到 WIDTH_STEP 的倍数，减少缓存中几乎相同的尺寸
+MIN_WIDTH = 64
+WIDTH_STEP = 32
+
+# 淘汰时删到上限的 90%，避免每写一个文件就淘汰一次
+_EVICT_TARGET_RATIO = 0.9
+# 渲染进程异常退出后遗留的临时文件，超过此时间 (秒) 后清理
+_STALE_TMP_SECONDS = 3600
+
+_pool = None
+_pending = None  # 限制排队中的渲染数 (BoundedSemaphore)
+_inflight = {}   # {缓存路径: Future}，同一张缩略图的并发请求只渲染一次
+_lock = threading.Lock()
+
+
+class PreviewBusy(Exception):
+    """渲染队列已满 (调用方应稍后重试)"""
+
+
+def normalize_width(width, config):
+    """把请求的宽度限制在 [MIN_WIDTH, PREVIEW_MAX_WIDTH] 之间，并取整到 WIDTH_STEP 的倍数"""
+    width = width or config['PREVIEW_DEFAULT_WIDTH']
+    width = -(-max(width, MIN_WIDTH) // WIDTH_STEP) * WIDTH_STEP
+    return min(width, config['PREVIEW_MAX_WIDTH'])
+
+
+def cache_path(config, file_hash, width, fmt):
+    return os.path.join(config['PREVIEW_CACHE_FOLDER'], f"{file_hash}_{width}.{fmt}")
+
+
+def _read_cached(path):
+    """读取缓存的缩略图并更新其 mtime (LRU)；不存在时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass  # (刚好被淘汰，不影响本次返回)
+    return data
+
+
+def _render_to_file(pdf_path, width, fmt, target_path):
+    """
+    (在渲染进程中执行)
+    渲染第一页并原子地写入 target_path (先写临时文件再重命名)，返回文件大小。
+    (*** 修改 ***) pdf_path 也可以是打包存储的 packstore.BlobRef (从段文件中读取)。
+    """
+    import pdfplumber
+    from . import packstore
+
+    if isinstance(pdf_path, packstore.BlobRef):
+        pdf_path = io.BytesIO(packstore.read_blob(pdf_path))
+
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    with pdfplumber.open(pdf_path) as pdf:
+        page = pdf.pages[0]
+        try:
+            image = page.to_image(width=width, antialias=True).original
+        finally:
+            page.close()
+    if fmt == 'webp':
+        image.save(tmp_path, format='WEBP', quality=80)
+    else:
+        image.save(tmp_path, format='PNG', optimize=True)
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+def _evict(cache_dir, max_bytes):
+    """缓存总大小超过 max_bytes 时，按 mtime 从旧到新删除，直到低于上限的 90%"""
+    entries, total = [], 0
+    now = time.time()
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.endswith('.tmp'):
+                if now - stat.st_mtime > _STALE_TMP_SECONDS:
+                    os.remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+    removed = 0
+    target = max_bytes * _EVICT_TARGET_RATIO
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def _on_render_done(target_path, cache_dir, max_bytes, future):
+    _pending.release()
+    with _lock:
+        _inflight.pop(target_path, None)
+    if future.exception() is None:
+        try:
+            _evict(cache_dir, max_bytes)
+        except Exception as e:
+            print(f"[预览] 缓存淘汰失败: {e}")
+
+
+def _get_pool(config):
+    """(在 _lock 内调用) 返回渲染进程池，没有时创建"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=config['PREVIEW_RENDER_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def _discard_pool():
+    """(在 _lock 内调用) 丢弃已损坏的进程池，下次提交时重新创建"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _submit(config, pdf_path, width, fmt, target_path):
+    """提交渲染 (同一目标正在渲染时复用同一个 Future)。渲染队列已满时抛出 PreviewBusy"""
+    global _pending
+    with _lock:
+        future = _inflight.get(target_path)
+        if future is not None:
+            return future
+        if _pending is None:
+            _pending = threading.BoundedSemaphore(config['PREVIEW_MAX_PENDING'])
+        if not _pending.acquire(blocking=False):
+            raise PreviewBusy()
+        try:
+            try:
+                future = _get_pool(config).submit(_render_to_file, pdf_path, width, fmt, target_path)
+            except BrokenProcessPool:
+                # (*** 新增 ***) 渲染进程异常退出 (OOM / 渲染畸形 PDF 时崩溃) 后进程池不能再用: 换一个新进程池重试一次
+                _discard_pool()
+                future = _get_pool(config).submit(_render_to_file, pdf_path, width, fmt, target_path)
+        except BaseException:
+            _pending.release()  # (没有提交成功，不会有完成回调释放名额)
+            raise
+        _inflight[target_path] = future
+
+    future.add_done_callback(functools.partial(
+        _on_render_done, target_path, config['PREVIEW_CACHE_FOLDER'], config['PREVIEW_CACHE_MAX_MB'] * 1024 * 1024
+    ))
+    return future
+
+
+def get_preview(config, pdf_path, file_hash, width, fmt):
+    """
+    (由 routes.py 调用)
+    返回缩略图的字节内容: 先查缓存，未命中时渲染并等待 (最多 PREVIEW_RENDER_TIMEOUT 秒)。
+    渲染队列已满时抛出 PreviewBusy，等待超时时抛出 TimeoutError。
+    """
+    target_path = cache_path(config, file_hash, width, fmt)
+    data = _read_cached(target_path)
+    if data is not None:
+        return data
+
+    _submit(config, pdf_path, width, fmt, target_path).result(timeout=config['PREVIEW_RENDER_TIMEOUT'])
+    data = _read_cached(target_path)
+    if data is None:
+        raise FileNotFoundError(f"缩略图刚生成就被淘汰，请调大 PREVIEW_CACHE_MAX_MB: {target_path}")
+    return data
+
+
+def prerender(config, pdf_path, file_hash):
+    """
+    (由 invoice_parser.process_extracted_pdfs 调用)
+    入库后在后台渲染默认宽度的缩略图，不等待结果；渲染队列已满时跳过。
+    """
+    width = normalize_width(None, config)
+    target_path = cache_path(config, file_hash, width, DEFAULT_FORMAT)
+    if os.path.exists(target_path):
+        return
+    try:
+        _submit(config, pdf_path, width, DEFAULT_FORMAT, target_path)
+    except PreviewBusy:
+        pass
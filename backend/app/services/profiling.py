@@ -0,0 +1,226 @@
+# app/services/profiling.py
+"""
+(*** 新增 ***) 任务性能记录 (按需开启)
+
+上传时指定 profile=1，或按 PROFILE_SAMPLE_RATE 抽样的任务，会记录每个 PDF 各阶段的耗时:
+open (打开 PDF) / extract_text (提取页面文本) / classify (页面分类) / crop (区域裁剪提取) /
+table (提取表格) / fallback (pdfium 引擎回退到 pdfplumber) / assemble (组装记录) / parse (解析总耗时，含进程间通信) / hash / insert (写入数据库) / copy。
+profile=1 的任务同时记录 cProfile (解析进程和任务进程合并)，找出耗时的代码路径。
+任务进程中同一时间只能有一个 cProfile 在运行 (Python 3.12 起 cProfile 基于进程级的 sys.monitoring):
+多个 profile=1 的任务在同一进程中并发时，后开始的文件跳过任务进程中的 cProfile，并在报告的 cprofile_skipped_files 中记录；
+3.12 起任务进程中的 cProfile 还会记入同一时间其他线程的调用 (解析进程中的结果不受影响)。
+结果保存在 job_profiles 表中，通过 GET /api/v1/upload/profile/<job_id> 查看。
+
+解析代码只需在关键步骤外包一层 `with profiling.phase('名称'):`，没有开启记录的线程中这是一个空操作。
+(页级并行时，子进程中提取的页面不细分阶段，统一计入 parallel_pages)
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import datetime
+import threading
+
+# 记录级别 (jobs.profile 列的取值)
+PROFILE_OFF = 0
+PROFILE_TIMELINE = 1  # 只记录各阶段耗时 (开销很小，可用于抽样)
+PROFILE_FULL = 2      # 同时记录 cProfile (开销较大，只在明确要求时开启)
+
+MODE_NAMES = {PROFILE_TIMELINE: 'timeline', PROFILE_FULL: 'full'}
+
+# 报告中保留的最慢文件数 / cProfile 函数数
+_SLOWEST_FILES = 20
+_CPROFILE_LINES = 60
+
+_local = threading.local()  # 当前线程正在记录的阶段耗时 {阶段: 秒}
+_cprofile_lock = threading.Lock()  # (*** 新增 ***) 任务进程中正在运行的 cProfile (同一时间最多一个)
+
+
+class _Phase:
+    __slots__ = ('phases', 'name', 'start')
+
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.phases[self.name] = self.phases.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """记录一个阶段的耗时 (累加到当前文件)；当前线程没有开启记录时不做任何事"""
+    phases = getattr(_local, 'phases', None)
+    return _NO_PHASE if phases is None else _Phase(phases, name)
+
+
+def start_recording(phases=None):
+    """在当前线程开始记录阶段耗时 (记入 phases 字典)"""
+    _local.phases = {} if phases is None else phases
+    return _local.phases
+
+
+def stop_recording():
+    """停止记录，返回记录到的 {阶段: 秒}"""
+    phases = getattr(_local, 'phases', None)
+    _local.phases = None
+    return phases or {}
+
+
+def cprofile_stats(profiler):
+    """把 cProfile.Profile 的结果转换为可在进程之间传递的字典"""
+    profiler.create_stats()
+    return profiler.stats
+
+
+class _StatsHolder:
+    """(pstats.Stats.add 接受带 create_stats() 和 stats 属性的对象)"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class JobProfiler:
+    """一个任务的性能记录: 逐文件的阶段耗时，以及 (PROFILE_FULL 时) 合并的 cProfile"""
+
+    def __init__(self, mode, max_files):
+        self.mode = mode
+        self.max_files = max_files
+        self.started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self._started = time.perf_counter()
+        self.job_phases = {}
+        self.files = []
+        self._current = None
+        self._file_started = 0.0
+        self._profiler = cProfile.Profile() if mode == PROFILE_FULL else None
+        self._stats = pstats.Stats() if mode == PROFILE_FULL else None
+        self._profiling = False  # 当前文件是否正在本线程中运行 cProfile
+        self.cprofile_skipped = 0
+
+    def job_phase(self, name):
+        """任务级阶段 (例如 unzip) 的耗时"""
+        return _Phase(self.job_phases, name)
+
+    def start_file(self, pdf_path):
+        try:
+            size = os.path.getsize(pdf_path)
+        except OSError:
+            size = None
+        self._current = {'file': os.path.basename(pdf_path), 'size': size, 'phases': {}}
+        self._file_started = time.perf_counter()
+        start_recording(self._current['phases'])
+        if self._profiler is not None:
+            self._enable_cprofile()
+
+    def _enable_cprofile(self):
+        """(*** 新增 ***) 其他任务 (或其他性能分析工具) 正在使用 cProfile 时跳过本文件"""
+        if not _cprofile_lock.acquire(blocking=False):
+            self.cprofile_skipped += 1
+            return
+        try:
+            self._profiler.enable()
+        except ValueError:
+            # (Python 3.12+: "Another profiling tool is already active")
+            _cprofile_lock.release()
+            self.cprofile_skipped += 1
+            return
+        self._profiling = True
+
+    def _disable_cprofile(self):
+        if self._profiling:
+            self._profiler.disable()
+            self._profiling = False
+            _cprofile_lock.release()
+
+    def add_remote(self, phases, stats=None):
+        """合并解析进程返回的阶段耗时和 cProfile 结果"""
+        if self._current is not None:
+            for name, seconds in phases.items():
+                self._current['phases'][name] = self._current['phases'].get(name, 0.0) + seconds
+        if stats and self._stats is not None:
+            self._stats.add(_StatsHolder(stats))
+
+    def end_file(self, outcome, invoices=0):
+        """outcome: 'stored' / 'skipped' / 'quarantined' 等"""
+        if self._current is None:
+            return
+        self._disable_cprofile()
+        stop_recording()
+        current, self._current = self._current, None
+        current['seconds'] = time.perf_counter() - self._file_started
+        current['outcome'] = outcome
+        current['invoices'] = invoices
+        self.files.append(current)
+
+    def report(self):
+        """生成可保存为 JSON 的报告"""
+        totals = {}
+        for entry in self.files:
+            for name, seconds in entry['phases'].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+
+        files = self.files
+        truncated = 0
+        if self.max_files and len(files) > self.max_files:
+            # 文件太多时只保留最慢的 max_files 个 (仍按处理顺序排列)
+            keep = set(map(id, sorted(files, key=lambda entry: entry['seconds'], reverse=True)[:self.max_files]))
+            truncated = len(files) - self.max_files
+            files = [entry for entry in files if id(entry) in keep]
+
+        slowest = sorted(self.files, key=lambda entry: entry['seconds'], reverse=True)[:_SLOWEST_FILES]
+        return {
+            'mode': MODE_NAMES.get(self.mode, 'off'),
+            'started_at': self.started_at,
+            'wall_seconds': _round(time.perf_counter() - self._started),
+            'job_phases': _round_dict(self.job_phases),
+            'phase_totals': _round_dict(totals),
+            'file_count': len(self.files),
+            'files_truncated': truncated,
+            'slowest_files': [
+                {'file': entry['file'], 'seconds': _round(entry['seconds']), 'outcome': entry['outcome']}
+                for entry in slowest
+            ],
+            'files': [dict(entry, seconds=_round(entry['seconds']), phases=_round_dict(entry['phases'])) for entry in files],
+            'cprofile': self._cprofile_text(),
+            'cprofile_skipped_files': self.cprofile_skipped,
+        }
+
+    def _cprofile_text(self):
+        if self._stats is None:
+            return None
+        local_stats = cprofile_stats(self._profiler)
+        if local_stats:  # (所有文件都跳过了任务进程中的 cProfile 时为空)
+            self._stats.add(_StatsHolder(local_stats))
+        if not self._stats.stats:
+            return None
+        out = io.StringIO()
+        self._stats.stream = out
+        self._stats.sort_stats('cumulative').print_stats(_CPROFILE_LINES)
+        return out.getvalue()
+
+
+def _round(seconds):
+    return round(seconds, 4)
+
+
+def _round_dict(phases):
+    return {name: _round(seconds) for name, seconds in sorted(phases.items(), key=lambda item: -item[1])}
@@ -0,0 +1,27 @@
+# app/services/quarantine.py
+"""
+(*** 新增 ***) 隔离区
+
+解析超时或导致解析进程崩溃的 PDF 不会留在临时目录中被清理掉，
+而是移到 QUARANTINE_FOLDER，并在 quarantine 表中记录来源任务和原因，便于事后排查。
+"""
+import os
+import shutil
+from .. import database as db
+
+
+def quarantine_file(config, pdf_path, reason, job_id=None):
+    """把 pdf_path 移入隔离区并记录原因，返回隔离后的路径"""
+    filename = os.path.basename(pdf_path)
+    prefix = f"job{job_id}_" if job_id is not None else ""
+    target_path = os.path.join(config['QUARANTINE_FOLDER'], prefix + filename)
+    counter = 1
+    while os.path.exists(target_path):
+        name, ext = os.path.splitext(prefix + filename)
+        target_path = os.path.join(config['QUARANTINE_FOLDER'], f"{name}_{counter}{ext}")
+        counter += 1
+
+    shutil.move(pdf_path, target_path)
+    db.add_quarantine_record(job_id, filename, target_path, reason)
+    print(f"[隔离区] {filename}: {reason} -> {target_path}")
+    return target_path
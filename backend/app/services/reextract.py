@@ -0,0 +1,207 @@
+# app/services/reextract.py
+"""
+批量重新提取 (Re-extraction)
+
+当 invoice_parser 的提取逻辑改进 (PARSER_VERSION 递增) 后，
+用新版本的解析器重新处理 EXTRACT_FOLDER (或打包存储的段文件) 中已保存的 PDF，
+只更新提取结果发生变化的行，不需要清空后重新上传。
+
+- 按 id 顺序分块处理，每块完成后把进度写入 reextract_runs 表，进程重启后可以续跑；
+- 每块中的 PDF 由进程池并行解析；
+- 每块之间可以休眠 (REEXTRACT_THROTTLE_SECONDS)，并在有上传任务处理中时让路，
+  避免抢占正常上传的 CPU 和数据库写锁。
+- (*** 新增 ***) 多进程部署时用文件锁保证同一时间只有一个进程在执行；
+  暂停请求写入 reextract_runs 表，由执行任务的进程在块之间读取。
+"""
+import os
+import time
+import tempfile
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .. import database as db
+from . import coordination, parse_worker, file_reaper, packstore
+
+_thread = None
+_thread_lock = threading.Lock()
+_pause_event = threading.Event()
+
+
+def _new_stats():
+    return {'rows_checked': 0, 'rows_updated': 0, 'rows_unchanged': 0, 'rows_missing_file': 0,
+            'rows_unmatched': 0, 'rows_edited_kept': 0, 'conflicts': 0}
+
+
+def _match_info(row, infos):
+    """
+    为数据库中的一行找到对应的新提取结果:
+    优先按 (代码, 号码) 匹配；文件只提取出一条记录时直接对应。
+    """
+    for info in infos:
+        if (info[2], info[3]) == (row['invoice_code'], row['invoice_number']):
+            return info
+    if len(infos) == 1:
+        return infos[0]
+    return None
+
+
+def _diff_fields(row, info):
+    """返回与数据库中的值不同的字段 {字段: 新值}"""
+    changes = {}
+    for field, value in zip(db.EXTRACTED_FIELDS, info):
+        if row[field] != value:
+            changes[field] = value
+    return changes
+
+
+def current_parser_version():
+    """返回当前解析器版本 (按需导入 invoice_parser)"""
+    from . import invoice_parser
+    return invoice_parser.PARSER_VERSION
+
+
+def _process_chunk(rows, pool, stats, config):
+    """解析一块发票对应的 PDF，并写回发生变化的字段"""
+    from . import invoice_parser
+    target_version = invoice_parser.PARSER_VERSION
+
+    # 1. 同一块中的文件去重后并行解析
+    # (已经是按文件并行，子进程内不再启用页级并行)
+    # (*** 修改 ***) 打包存储的 PDF 先从段文件写到临时目录再解析
+    sources = {row['id']: packstore.stored_source(config, row) for row in rows}
+    unique = sorted({source for source in sources.values() if source is not None}, key=str)
+    extract = functools.partial(invoice_parser.extract_invoice_info, engine=config['PDF_TEXT_ENGINE'])
+    with tempfile.TemporaryDirectory(prefix=file_reaper.temp_dir_prefix()) as spool_dir, \
+            packstore.BlobReader() as reader:
+        paths = {}
+        for index, source in enumerate(unique):
+            path = source
+            if isinstance(source, packstore.BlobRef):
+                try:
+                    data = reader.read(source)
+                except OSError:
+                    continue  # (段文件缺失: 与文件缺失相同)
+                path = os.path.join(spool_dir, f"{index}.pdf")
+                with open(path, 'wb') as f:
+                    f.write(data)
+            paths[source] = path
+        results = dict(zip(paths, pool.map(extract, paths.values())))
+
+    # 2. 逐行比较
+    changed_rows, unchanged_ids = [], []
+    for row in rows:
+        stats['rows_checked'] += 1
+        infos = results.get(sources[row['id']])
+        if infos is None:
+            stats['rows_missing_file'] += 1
+            continue  # (文件缺失: 保持原版本，下次仍会尝试)
+
+        info = _match_info(row, infos)
+        if info is None:
+            stats['rows_unmatched'] += 1
+            unchanged_ids.append(row['id'])
+            continue
+
+        changes = _diff_fields(row, info)
+        if changes and row['manually_edited']:
+            # 用户手动修改过的行不覆盖
+            stats['rows_edited_kept'] += 1
+            unchanged_ids.append(row['id'])
+        elif changes:
+            changed_rows.append((row['id'], changes))
+        else:
+            stats['rows_unchanged'] += 1
+            unchanged_ids.append(row['id'])
+
+    # 3. 单个事务写回
+    conflicts = db.apply_reextract_results(changed_rows, unchanged_ids, target_version)
+    stats['conflicts'] += conflicts
+    stats['rows_updated'] += len(changed_rows) - conflicts
+
+
+def _pause_requested(run_id):
+    return _pause_event.is_set() or db.get_reextract_run(run_id)['status'] == 'pausing'
+
+
+def _run(app, run_id, run_lock):
+    with app.app_context():
+        config = app.config
+        run = db.get_reextract_run(run_id)
+        stats = dict(_new_stats(), **run['stats'])
+        last_id = run['last_invoice_id']
+        target_version = current_parser_version()
+
+        pool = ProcessPoolExecutor(
+            max_workers=config['REEXTRACT_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn'),
+            **parse_worker.pool_kwargs(config['PARSER_MAX_FILES'])
+        )
+        print(f"[重新提取 {run_id}] 开始 (目标版本 {target_version}, 从 id > {last_id} 继续)")
+        try:
+            while True:
+                if _pause_requested(run_id):
+                    db.update_reextract_run(run_id, status='paused', last_invoice_id=last_id, stats=stats)
+                    print(f"[重新提取 {run_id}] 已暂停 (id {last_id})")
+                    return
+
+                # 有上传任务正在处理时让路
+                if config['REEXTRACT_YIELD_TO_UPLOADS'] and db.count_processing_jobs() > 0:
+                    time.sleep(max(config['REEXTRACT_THROTTLE_SECONDS'], 1.0))
+                    continue
+
+                rows = db.get_reextract_chunk(last_id, target_version, config['REEXTRACT_CHUNK_SIZE'])
+                if not rows:
+                    break
+
+                _process_chunk(rows, pool, stats, config)
+                last_id = rows[-1]['id']
+                db.update_reextract_run(run_id, last_invoice_id=last_id, stats=stats)
+
+                if config['REEXTRACT_THROTTLE_SECONDS'] > 0:
+                    time.sleep(config['REEXTRACT_THROTTLE_SECONDS'])
+
+            db.update_reextract_run(run_id, status='finished', last_invoice_id=last_id, stats=stats)
+            print(f"[重新提取 {run_id}] 完成。 统计: {stats}")
+
+        except Exception as e:
+            print(f"[重新提取 {run_id}] 失败: {e}")
+            db.update_reextract_run(run_id, status='failed', last_invoice_id=last_id, stats=dict(stats, error=str(e)))
+
+        finally:
+            pool.shutdown(wait=True)
+            coordination.release_lock(run_lock)
+
+
+def start_reextract(app):
+    """
+    (由 routes.py 调用)
+    启动 (或续跑) 当前 PARSER_VERSION 的重新提取任务。
+    返回 (run_id, started)，started 为 False 表示已有任务在运行 (本进程或其他进程)。
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return None, False
+        run_lock = coordination.try_lock(coordination.lock_path(app.config, 'reextract'))
+        if run_lock is None:
+            return None, False
+
+        target_version = current_parser_version()
+        run = db.get_active_reextract_run(target_version)
+        if run is None:
+            run_id = db.create_reextract_run(target_version)
+        else:
+            run_id = run['id']
+            db.update_reextract_run(run_id, status='running')
+
+        _pause_event.clear()
+        _thread = threading.Thread(target=_run, args=(app, run_id, run_lock), name='reextract', daemon=True)
+        _thread.start()
+        return run_id, True
+
+
+def pause_reextract():
+    """(由 routes.py 调用) 请求暂停: 当前块处理完后保存进度并退出"""
+    _pause_event.set()
+    db.request_reextract_pause()
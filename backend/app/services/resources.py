@@ -0,0 +1,33 @@
+# app/services/resources.py
+"""
+进程资源 (内存) 读取的辅助函数
+"""
+import os
+import sys
+
+try:
+    import resource  # (仅 Unix 可用)
+except ImportError:  # pragma: no cover (Windows)
+    resource = None
+
+
+def current_rss_bytes():
+    """
+    返回当前进程的常驻内存 (RSS)，单位字节。
+    Linux 读取 /proc/self/statm；其他平台退化为峰值 RSS (ru_maxrss)；都不可用时返回 0。
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """返回当前进程的峰值 RSS，单位字节 (不可用时返回 0)"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上 ru_maxrss 单位是字节，Linux 上是 KB
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,122 @@
+# app/services/summary_tables.py
+"""
+(*** 新增 ***) 汇总单表格的快速提取
+
+结果与 pdfplumber 的 page.extract_tables() (默认设置) 完全相同。单元格仍由 pdfplumber 的 TableFinder
+根据框线确定 (空单元格、合并单元格的处理都保持不变)，只替换了单元格文本的提取 (Table.extract):
+- Table.extract 对每一行扫描整页的字符，再对行内每个单元格扫描一遍 (行数 x 字符数，150 行的汇总单每页数万次比较)；
+  这里每个字符按单元格上边界二分查找，一次遍历就分配到所在的单元格；
+- 汇总单中的代码 / 号码 / 金额 / 日期几乎都是单行、不含空白的单元格，直接按 pdfplumber 的分词规则
+  (相邻字符间距超过 x_tolerance 时插入空格) 拼接文本；其他单元格仍调用 pdfplumber 的 extract_text。
+
+pdfium 引擎 (text_engines.PdfiumPage) 的字符来自 pdfium，只需要框线: 页面尚未解析时只解析图形
+(load_graphics，跳过文字渲染，约为完整解析耗时的一半)，不再为了表格完整解析整页。
+"""
+import bisect
+from operator import itemgetter
+from pdfplumber.table import TableSettings
+from pdfplumber.utils import extract_text
+
+try:
+    # (pdfplumber 的内部接口；版本不兼容时退回 page.extract_tables() 和完整解析)
+    from pdfminer.pdfinterp import PDFPageInterpreter
+    from pdfplumber.page import PDFPageAggregatorWithMarkedContent
+    from pdfplumber.utils.exceptions import PdfminerException
+    from pdfplumber.utils.text import LIGATURES
+except ImportError:
+    PDFPageAggregatorWithMarkedContent = None
+
+# 与 page.extract_tables() 相同的单元格文本参数 (x_tolerance / y_tolerance)
+_TEXT_SETTINGS = TableSettings.resolve(None).text_settings or {}
+_X_TOLERANCE = _TEXT_SETTINGS.get('x_tolerance', 3)
+_Y_TOLERANCE = _TEXT_SETTINGS.get('y_tolerance', 3)
+
+_by_x0 = itemgetter('x0')
+
+
+def extract_tables(page, chars=None):
+    """
+    与 page.extract_tables() 相同。
+    chars: 单元格文本使用的字符 (默认为 page.chars；pdfium 引擎传入 pdfium 读取的字符)。
+    """
+    if PDFPageAggregatorWithMarkedContent is None:
+        return page.extract_tables()
+    if chars is None:
+        chars = page.chars
+    return [_extract_table(table, chars) for table in page.find_tables()]
+
+
+def load_graphics(page):
+    """
+    页面尚未解析时，只解析图形 (线 / 矩形 / 曲线，用于查找表格)，跳过文字渲染。
+    返回是否这样做了: 此后 page.chars 为空，调用方用完后应调用 page.close()，需要文字时会重新完整解析。
+    """
+    if PDFPageAggregatorWithMarkedContent is None or hasattr(page, '_layout'):
+        return False
+    device = _GraphicsAggregator(page.pdf.rsrcmgr, pageno=page.page_number, laparams=page.pdf.laparams)
+    try:
+        PDFPageInterpreter(page.pdf.rsrcmgr, device).process_page(page.page_obj)
+    except Exception as e:
+        raise PdfminerException(e)  # (与 pdfplumber 完整解析时的异常相同)
+    page._layout = device.get_result()
+    return True
+
+
+if PDFPageAggregatorWithMarkedContent is not None:
+    class _GraphicsAggregator(PDFPageAggregatorWithMarkedContent):
+        def render_string(self, *args, **kwargs):
+            pass
+
+
+def _extract_table(table, chars):
+    """与 Table.extract() 相同: 返回行列表，每行为单元格文本 (没有单元格的位置为 None)"""
+    rows = table.rows
+    cell_chars = [[None if cell is None else [] for cell in row.cells] for row in rows]
+
+    # 单元格按上边界排序，字符只需检查上边界在 (字符中心 - 最大单元格高度, 字符中心] 内的单元格
+    cells = sorted(
+        (cell[1], cell[3], cell[0], cell[2], cell_chars[r][c])
+        for r, row in enumerate(rows) for c, cell in enumerate(row.cells) if cell is not None
+    )
+    if not cells:
+        return [[None] * len(row.cells) for row in rows]
+    tops = [cell[0] for cell in cells]
+    max_height = max(bottom - top for top, bottom, _, _, _ in cells)
+
+    for char in chars:
+        v_mid = (char['top'] + char['bottom']) / 2
+        h_mid = (char['x0'] + char['x1']) / 2
+        end = bisect.bisect_right(tops, v_mid)
+        for index in range(bisect.bisect_right(tops, v_mid - max_height, 0, end), end):
+            _, bottom, x0, x1, collected = cells[index]
+            if v_mid < bottom and x0 <= h_mid < x1:
+                collected.append(char)
+
+    return [[None if collected is None else _cell_text(collected) for collected in row] for row in cell_chars]
+
+
+def _cell_text(chars):
+    """与 extract_text(chars, x_tolerance, y_tolerance) 相同"""
+    if not chars:
+        return ""
+    top_min = top_max = chars[0]['top']
+    for char in chars:
+        text = char['text']
+        if not char['upright'] or not text or text.isspace() or text in LIGATURES:
+            return extract_text(chars, **_TEXT_SETTINGS)
+        top = char['top']
+        if top < top_min:
+            top_min = top
+        elif top > top_max:
+            top_max = top
+    if top_max - top_min > _Y_TOLERANCE:
+        return extract_text(chars, **_TEXT_SETTINGS)  # (多行单元格)
+
+    # 单行: 按 x0 排序 (稳定排序，与 pdfplumber 相同)，间距超过 x_tolerance 处断词，词之间用空格连接
+    ordered = sorted(chars, key=_by_x0)
+    parts = [ordered[0]['text']]
+    for previous, char in zip(ordered, ordered[1:]):
+        if char['x0'] > previous['x1'] + _X_TOLERANCE:
+            parts.append(' ')
+        parts.append(char['text'])
+    return ''.join(parts)
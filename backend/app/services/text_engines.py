@@ -0,0 +1,278 @@
+# app/services/text_engines.py
+"""
+(*** 新增 ***) PDF 文本提取引擎
+
+invoice_parser 通过统一的文档 / 页面接口取得文本，不直接依赖某个 PDF 库:
+    document = open_document(pdf_path, engine)
+    document.page_count / document.page(index) / document.close()
+    page.width / page.height
+    page.extract_text()        整页文本
+    page.crop_text(bbox)       区域 (x0, top, x1, bottom) 内的文本
+    page.extract_tables()      表格 (summary_tables: 与 pdfplumber 的 extract_tables 结果相同，更快)
+    page.fallback()            同一页的 pdfplumber 页面 (本身就是 pdfplumber 页面时为 None)
+    page.close()
+
+引擎由 Config.PDF_TEXT_ENGINE 选择:
+    'pdfplumber' (默认) —— pdfminer.six 用纯 Python 解释内容流，最慢，但最成熟；
+    'pdfium'            —— 用 pypdfium2 (pdfplumber 自带的依赖，C 实现) 读取字符和字符框，
+                           再交给 pdfplumber 相同的排版算法 (chars_to_textmap) 拼成文本，
+                           整页文本和区域文本与 pdfplumber 的结果一致，速度快一个数量级。
+pdfium 不识别表格，需要表格的页面 (汇总单) 由 pdfplumber 只解析框线来定位单元格，单元格文本使用 pdfium 的字符；
+pdfium 无法得到可靠字符的页面
+(旋转页面、MediaBox 原点不为 0、缺少 ToUnicode 映射的字体) 整页改用 pdfplumber。
+字段校验失败时的回退由 invoice_parser 负责 (见 _extract_page)。
+
+pdfium 不是线程安全的 (即使是不同的文档)，同一进程中所有 pdfium 调用都在 _pdfium_lock 内进行。
+"""
+import math
+import ctypes
+import threading
+import pdfplumber
+from pdfplumber.utils import chars_to_textmap, clip_obj
+from . import summary_tables
+from ..config import TEXT_ENGINES, DEFAULT_TEXT_ENGINE, check_text_engine
+
+ENGINES = TEXT_ENGINES
+DEFAULT_ENGINE = DEFAULT_TEXT_ENGINE
+
+_pdfium_lock = threading.Lock()
+
+
+def open_document(pdf_path, engine=DEFAULT_ENGINE, page_range=None):
+    """
+    用指定的引擎打开 PDF (支持 with)。
+    page_range: (start, end)，只会访问 [start, end) 范围内的页面时传入 (pdfplumber 只加载这些页)。
+    """
+    check_text_engine(engine)
+    if engine == 'pdfplumber':
+        return PlumberDocument(pdf_path, page_range)
+    return PdfiumDocument(pdf_path)
+
+
+# --- pdfplumber ---
+
+class PlumberDocument:
+    def __init__(self, pdf_path, page_range=None):
+        if page_range is None:
+            self._pdf = pdfplumber.open(pdf_path)
+            self._first = 0
+        else:
+            start, end = page_range
+            self._pdf = pdfplumber.open(pdf_path, pages=range(start + 1, end + 1))
+            self._first = start
+
+    @property
+    def page_count(self):
+        return len(self._pdf.pages)
+
+    def page(self, index):
+        return PlumberPage(self._pdf.pages[index - self._first])
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PlumberPage:
+    def __init__(self, page):
+        self._page = page
+        self.width, self.height = page.width, page.height
+
+    def extract_text(self):
+        return self._page.extract_text() or ""
+
+    def crop_text(self, bbox):
+        return self._page.crop(bbox).extract_text() or ""
+
+    def extract_tables(self, chars=None):
+        """chars: 单元格文本使用的字符 (pdfium 引擎传入)；此时页面尚未解析的话只解析框线，用完即释放"""
+        if chars is None:
+            return summary_tables.extract_tables(self._page)
+        graphics_only = summary_tables.load_graphics(self._page)
+        try:
+            return summary_tables.extract_tables(self._page, chars)
+        finally:
+            if graphics_only:
+                self._page.close()  # (之后需要文本时重新完整解析)
+
+    def fallback(self):
+        return None
+
+    def close(self):
+        # 释放该页缓存的对象 (chars / objects / layout)，控制内存占用
+        self._page.close()
+
+
+# --- pdfium ---
+
+class PdfiumDocument:
+    def __init__(self, pdf_path):
+        import pypdfium2
+
+        self._pdf_path = pdf_path
+        with _pdfium_lock:
+            self._pdf = pypdfium2.PdfDocument(pdf_path)
+            self.page_count = len(self._pdf)
+        self._plumber = None  # 回退使用的 pdfplumber 文档 (按需打开)
+
+    def page(self, index):
+        return PdfiumPage(self, index)
+
+    def plumber_page(self, index):
+        if self._plumber is None:
+            self._plumber = PlumberDocument(self._pdf_path)
+        return self._plumber.page(index)
+
+    def close(self):
+        with _pdfium_lock:
+            self._pdf.close()
+        if self._plumber is not None:
+            self._plumber.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PdfiumPage:
+    def __init__(self, document, index):
+        self._document = document
+        self._index = index
+        self._plumber = None
+        with _pdfium_lock:
+            page = document._pdf[index]
+            try:
+                left, bottom, right, top = page.get_mediabox()
+                self.width, self.height = right - left, top - bottom
+                # 旋转的页面 / 原点不为 0 的页面: 坐标与 pdfplumber 不同，整页使用 pdfplumber
+                self._native = page.get_rotation() == 0 and left == 0 and bottom == 0
+            finally:
+                page.close()
+        self._chars = None  # 按需读取 (首次提取文本时)
+
+    def _get_chars(self):
+        """返回 pdfplumber 格式的字符列表；无法可靠读取时返回 None"""
+        if self._native and self._chars is None:
+            with _pdfium_lock:
+                page = self._document._pdf[self._index]
+                try:
+                    self._chars = _read_chars(page, self.height)
+                finally:
+                    page.close()
+            if self._chars is None:
+                self._native = False
+        return self._chars if self._native else None
+
+    def extract_text(self):
+        chars = self._get_chars()
+        if chars is None:
+            return self.fallback().extract_text()
+        return _chars_to_text(chars, (0, 0, self.width, self.height))
+
+    def crop_text(self, bbox):
+        chars = self._get_chars()
+        if chars is None:
+            return self.fallback().crop_text(bbox)
+        return _chars_to_text(_crop_chars(chars, bbox), bbox)
+
+    def extract_tables(self):
+        chars = self._get_chars()
+        if chars is None:
+            return self.fallback().extract_tables()
+        return self.fallback().extract_tables(chars)
+
+    def fallback(self):
+        if self._plumber is None:
+            self._plumber = self._document.plumber_page(self._index)
+        return self._plumber
+
+    def close(self):
+        self._chars = None
+        if self._plumber is not None:
+            self._plumber.close()
+
+
+def _crop_chars(chars, bbox):
+    """
+    与 pdfplumber 的 page.crop(bbox).chars 相同 (与区域相交的字符，超出部分裁掉)。
+    完全在区域内 / 完全在区域外的字符直接判断，只有跨边界的字符才调用 clip_obj (开销大)。
+    """
+    x0, top, x1, bottom = bbox
+    cropped = []
+    for char in chars:
+        if char['x1'] < x0 or char['x0'] > x1 or char['bottom'] < top or char['top'] > bottom:
+            continue
+        if (char['x0'] >= x0 and char['x1'] <= x1 and char['top'] >= top and char['bottom'] <= bottom
+                and char['x1'] - char['x0'] + char['bottom'] - char['top'] > 0):
+            cropped.append(char)
+            continue
+        char = clip_obj(char, bbox)
+        if char is not None:
+            cropped.append(char)
+    return cropped
+
+
+def _chars_to_text(chars, bbox):
+    """与 pdfplumber 的 Page.extract_text() 相同的排版参数"""
+    x0, top, x1, bottom = bbox
+    return chars_to_textmap(chars, layout_bbox=bbox, layout_width=x1 - x0, layout_height=bottom - top).as_string
+
+
+def _is_upright(angle):
+    """FPDFText_GetCharAngle 返回 [0, 2π) 弧度 (出错时为 -1)"""
+    return angle >= 0 and min(angle, 2 * math.pi - angle) < 1e-3
+
+
+def _read_chars(page, height):
+    """
+    (在 _pdfium_lock 内调用) 读取页面上的字符，转换为 pdfplumber 的字符格式。
+    字符框与 pdfminer 一致: 左右为字符的前进宽度，下边为基线 + 字体下沉，高度为字号。
+    字体缺少 ToUnicode 映射时返回 None (pdfminer 对这种字符输出 "(cid:N)"，结果无法保持一致)。
+    """
+    import pypdfium2.raw as pdfium_c
+
+    textpage = page.get_textpage()
+    try:
+        handle = textpage.raw
+        rect = pdfium_c.FS_RECTF()
+        rect_ref = ctypes.byref(rect)
+        chars = []
+        pending_high = None  # UTF-16 代理对的高位
+        for index in range(pdfium_c.FPDFText_CountChars(handle)):
+            if pdfium_c.FPDFText_IsGenerated(handle, index) == 1:
+                continue  # pdfium 按位置推断出的空格 / 换行，不是内容流中的字符
+            if pdfium_c.FPDFText_HasUnicodeMapError(handle, index) == 1:
+                return None
+            code = pdfium_c.FPDFText_GetUnicode(handle, index)
+            if 0xD800 <= code < 0xDC00:
+                pending_high = code
+                continue
+            if 0xDC00 <= code < 0xE000 and pending_high is not None:
+                code = 0x10000 + ((pending_high - 0xD800) << 10) + (code - 0xDC00)
+            pending_high = None
+
+            pdfium_c.FPDFText_GetLooseCharBox(handle, index, rect_ref)
+            size = pdfium_c.FPDFText_GetFontSize(handle, index)
+            char_top = height - (rect.bottom + size)
+            chars.append({
+                'text': chr(code),
+                'x0': rect.left,
+                'x1': rect.right,
+                'top': char_top,
+                'bottom': height - rect.bottom,
+                'doctop': char_top,
+                'width': rect.right - rect.left,
+                'height': size,
+                'size': size,
+                'upright': _is_upright(pdfium_c.FPDFText_GetCharAngle(handle, index)),
+            })
+        return chars
+    finally:
+        textpage.close()
@@ -0,0 +1,49 @@
+# app/services/values.py
+"""
+字段值解析的辅助函数 (日期 / 金额)
+
+(*** 新增 ***) 从 invoice_parser.py 中拆分出来: 这里只依赖标准库，
+Web 进程在校验用户输入时导入它，不会连带导入 pdfplumber / pdfminer / PIL。
+"""
+import re
+from datetime import date, datetime
+
+# (*** 新增 ***) 日期缺失或无法解析时 parse_date 返回的默认日期
+UNKNOWN_DATE = date(1900, 1, 1)
+
+
+def parse_date(date_str):
+    """
+    一个辅助函数，用于将不同格式的日期字符串（如 "2020年12月23日" 或 "2020-12-23"）
+    统一解析为 Python 的 date 对象。
+    如果解析失败或输入为空，返回一个默认日期（1900-01-01）。
+    """
+    if not date_str:
+        return UNKNOWN_DATE
+    try:
+        if '年' in date_str:
+            return datetime.strptime(date_str, '%Y年%m月%d日').date()
+        else:
+            return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        # 如果格式不匹配
+        print(f"日期格式错误: {date_str}，使用默认日期。")
+        return UNKNOWN_DATE
+
+
+def safe_float(float_str):
+    """
+    一个辅助函数，用于安全地将字符串转换为浮点数。
+    它会清理掉货币符号 (¥, ￥), 空格, 和逗号, 然后再转换。
+    如果转换失败，返回 0.0。
+    """
+    if not float_str:
+        return 0.0
+    try:
+        # 将输入统一转为字符串，并移除首尾空格
+        cleaned_str = str(float_str).strip()
+        # 使用正则表达式移除所有 ¥, ￥, 空格, 和逗号
+        cleaned_str = re.sub(r'[¥￥\s,]', '', cleaned_str)
+        return float(cleaned_str)
+    except (ValueError, TypeError):
+        return 0.0
@@ -1,74 +1,380 @@
 import os
 import zipfile
-import shutil
 import tempfile
+import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from .file_reaper import temp_dir_prefix
 
+# 流式解压时每次读写的块大小
+_COPY_CHUNK_SIZE = 1024 * 1024
 
-def recursive_extract_all_pdfs(zip_path, final_output_dir):
+# 压缩比检查只针对解压后超过此大小的成员
+# (很小的文件压缩比天然可能很高，但不会造成磁盘压力)
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+# 最多解压的压缩包个数 (包括嵌套的 ZIP)，防止无限递归
+MAX_EXTRACTIONS = 20
+
+# 默认解压预算 (可由 Config 中的 ZIP_* 配置覆盖，见 limits_from_config)
+DEFAULT_LIMITS = {
+    'max_total_bytes': 2 * 1024 * 1024 * 1024,  # 所有层级累计写出的字节数
+    'max_member_ratio': 100,                     # 单个成员的 解压大小 / 压缩大小
+    'max_members': 20000,                        # 所有层级累计的成员数
+    'max_depth': 5,                              # 嵌套 ZIP 的最大层级
+}
+
+
+class ExtractionBudgetExceeded(Exception):
+    """
+    (*** 新增 ***)
+    解压超出预算 (总字节数 / 压缩比 / 成员数 / 嵌套层级)。
+    stats 属性保存超限时的部分统计，便于在任务结果中展示。
+    """
+
+    def __init__(self, message, stats):
+        super().__init__(message)
+        self.stats = stats
+
+
+def limits_from_config(config):
+    """从 Flask 配置中读取解压预算"""
+    return {
+        'max_total_bytes': config['ZIP_MAX_TOTAL_BYTES'],
+        'max_member_ratio': config['ZIP_MAX_MEMBER_RATIO'],
+        'max_members': config['ZIP_MAX_MEMBERS'],
+        'max_depth': config['ZIP_MAX_DEPTH'],
+    }
+
+
+def _unique_target_path(output_dir, filename):
+    """处理文件名冲突: 已存在时追加 _1, _2 ..."""
+    target_path = os.path.join(output_dir, filename)
+    counter = 1
+    while os.path.exists(target_path):
+        name, ext = os.path.splitext(filename)
+        target_path = os.path.join(output_dir, f"{name}_{counter}{ext}")
+        counter += 1
+    return target_path
+
+
+def _check_archive_budget(zip_ref, stats, limits, archive_name, written_bytes=None):
+    """
+    在写出任何文件之前，根据中央目录 (声明的大小) 检查整个压缩包是否超出预算。
+    (*** 修改 ***) written_bytes: 之前的压缩包已写出 (或已计划写出) 的字节数，默认为 stats['bytes_written']
+    """
+    if written_bytes is None:
+        written_bytes = stats['bytes_written']
+    members = [info for info in zip_ref.infolist() if not info.is_dir()]
+
+    if stats['members_seen'] + len(members) > limits['max_members']:
+        raise ExtractionBudgetExceeded(
+            f"压缩包 {archive_name} 超出成员数量限制 "
+            f"({stats['members_seen'] + len(members)} > {limits['max_members']})", stats)
+
+    declared_bytes = 0
+    for info in members:
+        if info.file_size >= RATIO_CHECK_MIN_BYTES:
+            ratio = info.file_size / max(info.compress_size, 1)
+            if ratio > limits['max_member_ratio']:
+                raise ExtractionBudgetExceeded(
+                    f"压缩包 {archive_name} 中的 {info.filename} 压缩比异常 "
+                    f"({ratio:.0f} > {limits['max_member_ratio']})，疑似 ZIP 炸弹", stats)
+        if _is_wanted(info.filename):
+            declared_bytes += info.file_size
+
+    if written_bytes + declared_bytes > limits['max_total_bytes']:
+        raise ExtractionBudgetExceeded(
+            f"压缩包 {archive_name} 解压后超出总大小限制 "
+            f"({written_bytes + declared_bytes} > {limits['max_total_bytes']} 字节)", stats)
+
+    return members
+
+
+def _is_wanted(filename):
+    """只有 PDF 和嵌套 ZIP 需要写出，其他文件直接跳过"""
+    return filename.lower().endswith(('.pdf', '.zip'))
+
+
+class _Aborted(Exception):
+    """(并行解压) 其他成员已经失败，停止写出"""
+
+
+def _stream_member(zip_ref, info, target_path, stats, limits, lock=None, abort=None):
+    """
+    流式写出单个成员，边写边统计实际字节数。
+    (中央目录中声明的大小可能被伪造，所以写出过程中再次检查预算)
+    (*** 修改 ***) 并行解压时多个线程共用 stats: lock 保护字节计数，abort 被设置后立即停止；
+    超出预算时设置 abort，让其他线程也停止写出。
+    """
+    try:
+        with zip_ref.open(info) as src, open(target_path, 'wb') as dst:
+            while True:
+                chunk = src.read(_COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if abort is not None and abort.is_set():
+                    raise _Aborted()
+                if lock is None:
+                    stats['bytes_written'] += len(chunk)
+                    written = stats['bytes_written']
+                else:
+                    with lock:
+                        stats['bytes_written'] += len(chunk)
+                        written = stats['bytes_written']
+                if written > limits['max_total_bytes']:
+                    if abort is not None:
+                        abort.set()
+                    raise ExtractionBudgetExceeded(
+                        f"解压 {info.filename} 时超出总大小限制 ({limits['max_total_bytes']} 字节)", stats)
+                dst.write(chunk)
+    except BaseException:
+        # 删除写了一半的文件
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        raise
+
+
+def _extract_serial(zip_path, final_output_dir, limits, stats, processing_temp_dir):
+    """逐个压缩包、逐个成员解压 (广度优先)"""
+    # 队列用于存储待解压的ZIP包
+    zip_queue = deque([(zip_path, 0)])  # (压缩包路径, 嵌套层级)
+    extraction_count = 0
+
+    while zip_queue:
+        current_zip, current_level = zip_queue.popleft()
+        if extraction_count >= MAX_EXTRACTIONS:
+            stats['archives_skipped'] += 1
+            continue
+        extraction_count += 1
+
+        # 为本次解压创建一个唯一的子目录 (只存放嵌套的 ZIP)
+        current_extract_dir = os.path.join(processing_temp_dir, f"extract_{extraction_count}")
+        os.makedirs(current_extract_dir, exist_ok=True)
+
+        print(f"正在解压 (层级 {current_level}): {os.path.basename(current_zip)}")
+
+        try:
+            zip_ref = zipfile.ZipFile(current_zip, 'r')
+        except Exception as e:
+            print(f"解压失败: {e}")
+            continue  # 跳过这个损坏的ZIP
+
+        with zip_ref:
+            stats['archives_opened'] += 1
+            stats['max_depth_seen'] = max(stats['max_depth_seen'], current_level)
+
+            # 1. 写出之前先按中央目录检查预算
+            members = _check_archive_budget(zip_ref, stats, limits, os.path.basename(current_zip))
+            stats['members_seen'] += len(members)
+
+            # 2. 遍历成员，只写出 PDF 和嵌套 ZIP
+            for info in members:
+                file = os.path.basename(info.filename)
+                lower = file.lower()
+
+                if lower.endswith('.pdf'):
+                    # 3. 如果是PDF，直接写入 *最终* 输出目录
+                    # (final_output_dir 是我们上传流程中的 'temp_extract_dir')
+                    target_path = _unique_target_path(final_output_dir, file)
+                    try:
+                        _stream_member(zip_ref, info, target_path, stats, limits)
+                    except ExtractionBudgetExceeded:
+                        raise
+                    except Exception as e:
+                        print(f"  解压成员失败 {info.filename}: {e}")
+                        continue
+                    stats['pdf_found'] += 1
+
+                elif lower.endswith('.zip'):
+                    # 4. 如果是嵌套的ZIP，检查层级后加入队列
+                    # (注意: .rar 和 .7z 需要额外库 (unrar, py7zr)，这里不处理)
+                    if current_level + 1 > limits['max_depth']:
+                        raise ExtractionBudgetExceeded(
+                            f"嵌套 ZIP {file} 超出最大层级限制 ({limits['max_depth']})", stats)
+                    nested_path = _unique_target_path(current_extract_dir, file)
+                    try:
+                        _stream_member(zip_ref, info, nested_path, stats, limits)
+                    except ExtractionBudgetExceeded:
+                        raise
+                    except Exception as e:
+                        print(f"  解压成员失败 {info.filename}: {e}")
+                        continue
+                    print(f"  发现嵌套ZIP: {file} (加入队列)")
+                    zip_queue.append((nested_path, current_level + 1))
+
+        # 5. 嵌套 ZIP 处理完后立即删除，释放磁盘空间
+        if current_zip != zip_path:
+            os.remove(current_zip)
+
+
+def _member_written(future, member_name):
+    """
+    等待一个成员写出完成: 成功返回 True；损坏的成员打印错误后返回 False；超出预算时抛出异常。
+    (因其他成员超出预算而停止的成员返回 False，超出预算的异常会在轮到那个成员时抛出)
+    """
+    try:
+        future.result()
+    except ExtractionBudgetExceeded:
+        raise
+    except _Aborted:
+        return False
+    except Exception as e:
+        print(f"  解压成员失败 {member_name}: {e}")
+        return False
+    return True
+
+
+def _extract_parallel(zip_path, final_output_dir, limits, stats, threads, processing_temp_dir):
+    """
+    (*** 新增 ***)
+    并行解压: threads 个线程同时写出不同的成员 (包括不同层级的压缩包)，zlib 解压时会释放 GIL。
+    结果与 _extract_serial 相同:
+    - 压缩包仍按广度优先的顺序打开 (嵌套 ZIP 写出后才打开)，MAX_EXTRACTIONS 和预算检查的顺序不变；
+    - PDF 先写到输出目录中的临时文件 (.unzip_<序号>.part)，再严格按串行的顺序重命名为最终文件名，
+      文件名冲突时追加 _1, _2 ... 的结果与串行时一致 (写出失败的成员不占用文件名)。
+    """
+    lock = threading.Lock()
+    abort = threading.Event()
+    # 已计划写出的成员声明大小之和 (相当于串行时检查预算那一刻已经写出的字节数)
+    planned_bytes = 0
+    pdf_queue = deque()  # 按串行顺序排列的 PDF: (future, 临时文件, 文件名, 成员名)
+    archives = []        # 已打开的压缩包: (zip_ref, 成员的 futures, 全部写出后要删除的嵌套 ZIP)
+    zip_queue = deque([(None, zip_path, 0, None)])  # (写出嵌套 ZIP 的 future, 路径, 嵌套层级, 成员名)
+    extraction_count = 0
+    part_count = 0
+
+    def commit_pdfs(block):
+        """按顺序把已写完的 PDF 重命名为最终文件名 (block=False 时遇到还没写完的就停止)"""
+        while pdf_queue and (block or pdf_queue[0][0].done()):
+            future, part_path, file, member_name = pdf_queue.popleft()
+            if _member_written(future, member_name):
+                os.replace(part_path, _unique_target_path(final_output_dir, file))
+                stats['pdf_found'] += 1
+
+    def close_archives(block):
+        """关闭所有成员都已写出的压缩包，并删除处理完的嵌套 ZIP"""
+        for archive in list(archives):
+            zip_ref, futures, nested_path = archive
+            if block:
+                wait(futures)
+            elif not all(future.done() for future in futures):
+                continue
+            zip_ref.close()
+            if nested_path:
+                os.remove(nested_path)
+            archives.remove(archive)
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='fapiao-unzip') as pool:
+        try:
+            while zip_queue:
+                future, current_zip, current_level, member_name = zip_queue.popleft()
+                if future is not None and not _member_written(future, member_name):
+                    continue
+                if extraction_count >= MAX_EXTRACTIONS:
+                    stats['archives_skipped'] += 1
+                    continue
+                extraction_count += 1
+
+                current_extract_dir = os.path.join(processing_temp_dir, f"extract_{extraction_count}")
+                os.makedirs(current_extract_dir, exist_ok=True)
+
+                print(f"正在解压 (层级 {current_level}): {os.path.basename(current_zip)}")
+
+                try:
+                    zip_ref = zipfile.ZipFile(current_zip, 'r')
+                except Exception as e:
+                    print(f"解压失败: {e}")
+                    continue
+
+                futures = []
+                archives.append((zip_ref, futures, current_zip if current_zip != zip_path else None))
+                stats['archives_opened'] += 1
+                stats['max_depth_seen'] = max(stats['max_depth_seen'], current_level)
+
+                members = _check_archive_budget(
+                    zip_ref, stats, limits, os.path.basename(current_zip), written_bytes=planned_bytes
+                )
+                stats['members_seen'] += len(members)
+                planned_bytes += sum(info.file_size for info in members if _is_wanted(info.filename))
+
+                for index, info in enumerate(members):
+                    file = os.path.basename(info.filename)
+                    lower = file.lower()
+
+                    if lower.endswith('.pdf'):
+                        part_path = os.path.join(final_output_dir, f".unzip_{part_count}.part")
+                        part_count += 1
+                        future = pool.submit(_stream_member, zip_ref, info, part_path, stats, limits, lock, abort)
+                        pdf_queue.append((future, part_path, file, info.filename))
+
+                    elif lower.endswith('.zip'):
+                        if current_level + 1 > limits['max_depth']:
+                            raise ExtractionBudgetExceeded(
+                                f"嵌套 ZIP {file} 超出最大层级限制 ({limits['max_depth']})", stats)
+                        # (同一压缩包中可能有同名的嵌套 ZIP，按成员序号区分)
+                        nested_path = os.path.join(current_extract_dir, f"{index}_{file}")
+                        future = pool.submit(_stream_member, zip_ref, info, nested_path, stats, limits, lock, abort)
+                        print(f"  发现嵌套ZIP: {file} (加入队列)")
+                        zip_queue.append((future, nested_path, current_level + 1, info.filename))
+
+                    else:
+                        continue
+                    futures.append(future)
+
+                commit_pdfs(block=False)
+                close_archives(block=False)
+
+            commit_pdfs(block=True)
+            close_archives(block=True)
+
+        except BaseException:
+            # 停止其他线程，等它们退出后再关闭压缩包，并删除已写完但还没重命名的 PDF
+            abort.set()
+            for zip_ref, futures, _ in archives:
+                wait(futures)
+                zip_ref.close()
+            for _, part_path, _, _ in pdf_queue:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            raise
+
+
+def recursive_extract_all_pdfs(zip_path, final_output_dir, limits=None, threads=1):
     """
     递归解压ZIP包。
     它会解压 `zip_path` 到 `final_output_dir`。
     如果解压出的文件还是ZIP包，它会再次解压它们（使用队列）。
     返回找到的PDF文件总数。
     (逻辑来自 app.py / jieyasuo.py)
+
+    (*** 修改 ***) 不再使用 extractall，而是逐个成员流式写出，只写出 PDF 和嵌套 ZIP。
+    写出之前和写出过程中都会检查解压预算 (limits，见 DEFAULT_LIMITS)，
+    超出时抛出 ExtractionBudgetExceeded (附带部分统计)。
+
+    (*** 新增 ***) threads > 1 时并行解压 (见 _extract_parallel)，输出的文件名和 pdf_found 与串行时相同。
     """
-    pdf_files_found_count = 0
+    limits = dict(DEFAULT_LIMITS, **(limits or {}))
+    stats = {
+        'archives_opened': 0,
+        'archives_skipped': 0,
+        'members_seen': 0,
+        'bytes_written': 0,
+        'max_depth_seen': 0,
+        'pdf_found': 0,
+    }
 
     # 使用一个临时目录来处理所有中间解压文件
     # (注意：我们是在一个 *已经* 是临时的目录 'temp_extract_dir' 中操作)
     # (为了安全，我们再创建一个临时的子目录)
-    with tempfile.TemporaryDirectory() as processing_temp_dir:
-
-        # 队列用于存储待解压的ZIP包
-        zip_queue = deque([(zip_path, 0)])  # (压缩包路径, 嵌套层级)
-        extraction_count = 0
-        max_extractions = 20  # 防止无限递归或恶意ZIP炸弹
-
-        while zip_queue and extraction_count < max_extractions:
-            current_zip, current_level = zip_queue.popleft()
-            extraction_count += 1
-
-            # 为本次解压创建一个唯一的子目录
-            current_extract_dir = os.path.join(processing_temp_dir, f"extract_{extraction_count}")
-            os.makedirs(current_extract_dir, exist_ok=True)
-
-            print(f"正在解压 (层级 {current_level}): {os.path.basename(current_zip)}")
-
-            try:
-                # 1. 解压
-                with zipfile.ZipFile(current_zip, 'r') as zip_ref:
-                    zip_ref.extractall(current_extract_dir)
-            except Exception as e:
-                print(f"解压失败: {e}")
-                continue  # 跳过这个损坏的ZIP
-
-            # 2. 遍历解压后的文件
-            for root, dirs, files in os.walk(current_extract_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-
-                    if file.lower().endswith('.pdf'):
-                        # 3. 如果是PDF，复制到 *最终* 输出目录
-                        # (final_output_dir 是我们上传流程中的 'temp_extract_dir')
-
-                        # 处理文件名冲突 (虽然在临时目录中不太可能，但保险起见)
-                        target_path = os.path.join(final_output_dir, file)
-                        counter = 1
-                        while os.path.exists(target_path):
-                            name, ext = os.path.splitext(file)
-                            target_path = os.path.join(final_output_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-
-                        shutil.copy2(file_path, target_path)
-                        pdf_files_found_count += 1
-
-                    elif file.lower().endswith(('.zip', '.rar', '.7z')):
-                        # 4. 如果是嵌套的ZIP，加入队列
-                        # (注意: .rar 和 .7z 需要额外库 (unrar, py7zr)，这里只处理 .zip)
-                        if file.lower().endswith('.zip'):
-                            print(f"  发现嵌套ZIP: {file} (加入队列)")
-                            zip_queue.append((file_path, current_level + 1))
-
-    print(f"解压完成，共找到 {pdf_files_found_count} 个PDF文件。")
-    return pdf_files_found_count
\ No newline at end of file
+    # (使用统一前缀 (含本进程 PID)，进程异常退出后遗留的目录可由 file_reaper 识别并清理)
+    with tempfile.TemporaryDirectory(prefix=temp_dir_prefix('zip_')) as processing_temp_dir:
+        if threads > 1:
+            _extract_parallel(zip_path, final_output_dir, limits, stats, threads, processing_temp_dir)
+        else:
+            _extract_serial(zip_path, final_output_dir, limits, stats, processing_temp_dir)
+
+    if stats['archives_skipped']:
+        print(f"嵌套压缩包过多，已跳过 {stats['archives_skipped']} 个。")
+    print(f"解压完成，共找到 {stats['pdf_found']} 个PDF文件。")
+    return stats['pdf_found']
@@ -1,9 +1,146 @@
 # app/tasks.py
 import os
 import tempfile
+import contextlib
 import shutil
+import threading
+import traceback
+from flask import current_app
 from . import create_app  # 导入您的 app 工厂
-from .services import zip_handler, invoice_parser
+from . import database as db
+from .services import zip_handler, file_reaper, coordination, profiling
+
+# (*** 新增 ***) 进程内复用的 App 实例
+# create_app 会重新加载配置、注册蓝图并检查数据库表，每个任务都调用一次开销很大。
+# 常驻的 worker 进程 (worker.py / RQ 的 SimpleWorker) 只需要创建一次。
+_app = None
+
+
+def get_app():
+    """返回当前进程的 App 实例 (首次调用时创建)"""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+
+def run_zip_job(zip_path, job_id=None, log_prefix='[Job]'):
+    """
+    (*** 新增 ***)
+    解压并解析一个 ZIP，返回 stats。必须在 App 上下文中调用。
+    线程方案 (routes.py)、常驻 worker (worker.py) 和 RQ 任务共用此函数。
+    传入 job_id 时，结果 (或失败信息) 会写入 jobs 表。
+    (*** 新增 ***) 任务开启了性能记录时 (jobs.profile)，结束后把报告写入 job_profiles 表。
+    """
+    config = current_app.config
+    profile_mode = db.get_job_profile_mode(job_id) if job_id is not None else profiling.PROFILE_OFF
+    profiler = profiling.JobProfiler(profile_mode, config['PROFILE_MAX_FILES']) if profile_mode else None
+
+    temp_extract_dir = tempfile.mkdtemp(prefix=file_reaper.temp_dir_prefix())
+    print(f"{log_prefix} 开始处理: {zip_path}")
+    print(f"{log_prefix} 临时目录: {temp_extract_dir}")
+
+    try:
+        # 1. 解压 (调用您已有的服务)
+        unzip_phase = profiler.job_phase('unzip') if profiler is not None else contextlib.nullcontext()
+        with unzip_phase:
+            pdf_count = zip_handler.recursive_extract_all_pdfs(
+                zip_path, temp_extract_dir, limits=zip_handler.limits_from_config(config),
+                threads=config['ZIP_EXTRACT_THREADS']
+            )
+        print(f"{log_prefix} 解压完成, 找到 {pdf_count} 个PDF。")
+
+        # 2. 解析 (耗时操作)
+        # (按需导入: 常驻 worker 已在预热阶段导入，这里不再有额外开销)
+        from .services import invoice_parser
+        stats = invoice_parser.process_extracted_pdfs(temp_extract_dir, job_id, profiler)
+        stats['pdf_found'] = pdf_count  # 补充解压统计
+        print(f"{log_prefix} 解析完成。 统计: {stats}")
+
+        # 3. 更新状态为 "已完成"，并保存 stats 结果
+        if job_id is not None:
+            db.update_job_status(job_id, 'finished', result=stats)
+        return stats
+
+    except zip_handler.ExtractionBudgetExceeded as e:
+        # 超出解压预算: 立即失败，并保存部分统计
+        print(f"{log_prefix} 超出解压预算: {e}")
+        if job_id is not None:
+            db.update_job_status(job_id, 'failed', result={'error': str(e), 'partial_stats': e.stats})
+        raise
+
+    except Exception as e:
+        # 捕获异常，更新状态为 "失败"
+        error_msg = traceback.format_exc()
+        print(f"{log_prefix} 处理失败: {e}")
+        if job_id is not None:
+            db.update_job_status(job_id, 'failed', result=error_msg)
+        raise
+
+    finally:
+        # (*** 新增 ***) 保存性能记录 (任务失败时也保存已记录的部分)
+        if profiler is not None:
+            try:
+                db.save_job_profile(job_id, profiler.report())
+            except Exception as e:
+                print(f"{log_prefix} 保存性能记录失败: {e}")
+
+        # 4. 清理临时目录
+        if os.path.exists(temp_extract_dir):
+            shutil.rmtree(temp_extract_dir, ignore_errors=True)
+            print(f"{log_prefix} 清理临时目录: {temp_extract_dir}")
+
+        # 5. (推荐) 清理原始的 ZIP 文件
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+            print(f"{log_prefix} 清理原始 ZIP: {zip_path}")
+
+
+def process_zip_in_background(app, zip_path, job_id):
+    """
+    这个函数在一个单独的线程中运行，负责所有耗时的 PDF 处理工作。
+    它现在接受一个 job_id 来向数据库报告状态。
+    (*** 修改 ***) 从 routes.py 移到这里，上传接口和卡住任务的恢复 (recover_stale_jobs) 共用。
+    """
+    # 线程没有 Flask 的应用上下文，必须手动创建
+    with app.app_context():
+        # 1. 领取任务并更新状态为 "处理中"
+        # (如果任务已被其他进程领取，则不再重复处理)
+        if not db.claim_job(job_id, coordination.process_id()):
+            print(f"[后台 Job {job_id}] 任务已被其他进程领取，跳过。")
+            return
+
+        try:
+            run_zip_job(zip_path, job_id, log_prefix=f"[后台 Job {job_id}]")
+        except Exception:
+            pass  # (失败信息已由 run_zip_job 写入 jobs 表)
+
+
+def recover_stale_jobs(app):
+    """
+    (*** 新增 ***)
+    (由 file_reaper 的维护线程调用，同一时间只有一个进程执行)
+    领取任务的进程已经退出 (被 gunicorn 超时杀死、崩溃、重启) 时，任务会一直停在 'processing'。
+    上传的 ZIP 还在时把任务放回队列，否则标记为失败。
+    线程模式下放回队列的任务由本进程立即重新启动；worker 模式下由 worker 领取。
+    返回恢复的任务数。必须在 App 上下文中调用。
+    """
+    requeued = []
+    for job in db.get_processing_jobs():
+        if not coordination.is_local_process_dead(job['worker']):
+            continue
+        if job['zip_path'] and os.path.exists(job['zip_path']):
+            if db.requeue_job(job['id'], job['worker']):
+                requeued.append(job)
+                print(f"[任务恢复] 任务 {job['id']} 的进程 {job['worker']} 已退出，重新排队。")
+        else:
+            db.update_job_status(job['id'], 'failed', result='处理该任务的进程已退出，上传的文件已不存在，请重新上传。')
+            print(f"[任务恢复] 任务 {job['id']} 的进程 {job['worker']} 已退出，文件缺失，标记为失败。")
+
+    if app.config['JOB_EXECUTOR'] == 'thread':
+        for job in requeued:
+            threading.Thread(target=process_zip_in_background, args=(app, job['zip_path'], job['id'])).start()
+    return len(requeued)
 
 
 def process_zip_task(zip_path, app_config_dict):
@@ -11,54 +148,25 @@ def process_zip_task(zip_path, app_config_dict):
     【后台任务】这是在 RQ Worker 进程中执行的函数。
     它负责所有耗时的 PDF 处理工作。
 
-    这个函数的内容 = 您之前在 routes.py 中定义的 process_zip_in_background
+    (*** 修改 ***) 不再为每个任务调用 create_app()，而是复用进程内的 App 实例。
+    配合 `rq worker -w rq.worker.SimpleWorker` (不为每个任务 fork 子进程) 使用时，
+    App 创建和解析器导入只发生一次。
     """
 
-    # 1. 【关键】在 Worker 中重建 App 上下文
+    # 1. 获取 (或首次创建) App，并推入上下文
     # 因为 Worker 是一个独立进程，它没有 Flask 的 Web 上下文。
-    # 我们必须创建一个新的 App 实例并推入上下文。
-    app = create_app()
-    # (如果 create_app 需要配置, 您可能需要: app = create_app(app_config_dict))
+    app = get_app()
 
     with app.app_context():
         # 现在 `invoice_parser` 内部的 `current_app.config['EXTRACT_FOLDER']`
         # 和 `db` 模块都可以正常工作了。
-
-        temp_extract_dir = tempfile.mkdtemp()
-        print(f"[RQ Task] 开始处理: {zip_path}")
-        print(f"[RQ Task] 临时目录: {temp_extract_dir}")
-
         try:
-            # 2. 解压 (调用您已有的服务)
-            pdf_count = zip_handler.recursive_extract_all_pdfs(zip_path, temp_extract_dir)
-            print(f"[RQ Task] 解压完成, 找到 {pdf_count} 个PDF。")
-
-            # 3. 解析 (耗时操作)
-            # (此函数已在上一轮修复，可以安全地关闭文件)
-            stats = invoice_parser.process_extracted_pdfs(temp_extract_dir)
-            stats['pdf_found'] = pdf_count  # 补充解压统计
-
-            print(f"[RQ Task] 解析完成。 统计: {stats}")
-
-            # 4. 【关键】返回结果
+            # 2. 【关键】返回结果
             # 这个 'stats' 对象将被 RQ 序列化并存入 Redis，
             # 供 /upload/status 接口查询。
-            return stats
-
+            return run_zip_job(zip_path, log_prefix='[RQ Task]')
         except Exception as e:
             print(f"[RQ Task] 任务失败: {e}")
-            import traceback
             traceback.print_exc()
             # 抛出异常, RQ 会将任务标记为 'failed' 并存储异常信息
             raise e
-
-        finally:
-            # 5. 清理临时目录
-            if os.path.exists(temp_extract_dir):
-                shutil.rmtree(temp_extract_dir, ignore_errors=True)
-                print(f"[RQ Task] 清理临时目录: {temp_extract_dir}")
-
-            # 6. (推荐) 清理原始的 ZIP 文件
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-                print(f"[RQ Task] 清理原始 ZIP: {zip_path}")
\ No newline at end of file
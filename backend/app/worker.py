@@ -0,0 +1,153 @@
+# app/worker.py
+"""
+(*** 新增 ***) 常驻的预热 worker
+
+每个 worker 进程只创建一次 App (加载配置 / 注册蓝图 / 检查数据库表)，
+并预先导入 pdfplumber / pdfminer、加载中文 CMap，然后循环领取 jobs 表中排队的任务。
+单个任务的额外开销只剩一次数据库领取操作 (毫秒级)。
+
+为了防止长时间运行后内存增长，worker 在处理 WORKER_MAX_JOBS 个任务后，
+或 RSS 超过 WORKER_MAX_RSS_MB 时主动退出，由主进程重新启动一个新的 worker (回收)。
+
+用法 (在 backend/ 目录中):
+    python worker.py --processes 2
+Web 端需要设置 JOB_EXECUTOR=worker，上传的任务才会留给 worker 处理。
+"""
+import sys
+import time
+import signal
+import argparse
+import multiprocessing
+
+# worker 主动回收时的退出码 (主进程据此立即重启 worker)
+RECYCLE_EXIT_CODE = 3
+
+# 预热时加载的 CMap (中文发票常用的编码)
+_WARM_CMAPS = ('UniGB-UCS2-H', 'UniGB-UTF16-H')
+_WARM_UNICODE_MAPS = ('Adobe-GB1',)
+
+
+def warm_up():
+    """
+    预热解析器: 导入 pdfplumber / pdfminer，并把常用 CMap 载入 pdfminer 的进程内缓存。
+    (这些开销原本会落在每个进程处理的第一个 PDF 上)
+    """
+    started = time.perf_counter()
+    from .services import invoice_parser  # noqa: F401 (导入 pdfplumber / pdfminer)
+    from pdfminer.cmapdb import CMapDB
+
+    for name in _WARM_CMAPS:
+        try:
+            CMapDB.get_cmap(name)
+        except Exception as e:
+            print(f"[Worker] 预热 CMap {name} 失败: {e}")
+    for name in _WARM_UNICODE_MAPS:
+        try:
+            CMapDB.get_unicode_map(name)
+        except Exception as e:
+            print(f"[Worker] 预热 Unicode Map {name} 失败: {e}")
+    return time.perf_counter() - started
+
+
+def run_worker(max_jobs, max_rss_mb, poll_interval):
+    """
+    worker 进程主循环。返回退出码:
+    0 = 正常结束，RECYCLE_EXIT_CODE = 达到任务数或内存上限，需要回收。
+    """
+    from .tasks import get_app, run_zip_job
+    from . import database as db
+    from .services.resources import current_rss_bytes
+    from .services.coordination import process_id
+
+    started = time.perf_counter()
+    app = get_app()
+    warm_seconds = warm_up()
+    worker_id = process_id()
+    print(f"[Worker {worker_id}] 就绪: 创建 App + 预热共耗时 {time.perf_counter() - started:.2f}s "
+          f"(预热 {warm_seconds:.2f}s)")
+
+    jobs_done = 0
+    with app.app_context():
+        while True:
+            job = db.claim_next_job(worker_id)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            job_started = time.perf_counter()
+            try:
+                run_zip_job(job['zip_path'], job['id'], log_prefix=f"[Worker Job {job['id']}]")
+            except Exception:
+                pass  # (失败信息已由 run_zip_job 写入 jobs 表)
+            jobs_done += 1
+            print(f"[Worker {worker_id}] 任务 {job['id']} 完成，耗时 {time.perf_counter() - job_started:.2f}s")
+
+            # 回收检查: 任务数 / 内存
+            rss_mb = current_rss_bytes() / (1024 * 1024)
+            if max_jobs and jobs_done >= max_jobs:
+                print(f"[Worker {worker_id}] 已处理 {jobs_done} 个任务，回收。")
+                return RECYCLE_EXIT_CODE
+            if max_rss_mb and rss_mb > max_rss_mb:
+                print(f"[Worker {worker_id}] RSS {rss_mb:.0f}MB 超过上限 {max_rss_mb}MB，回收。")
+                return RECYCLE_EXIT_CODE
+
+
+def _worker_main(max_jobs, max_rss_mb, poll_interval):
+    """子进程入口"""
+    sys.exit(run_worker(max_jobs, max_rss_mb, poll_interval))
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def supervise(processes, max_jobs, max_rss_mb, poll_interval):
+    """
+    主进程: 启动 processes 个 worker，任何一个退出 (回收或崩溃) 后立即补上一个新的。
+    """
+    ctx = multiprocessing.get_context('spawn')
+    args = (max_jobs, max_rss_mb, poll_interval)
+
+    def spawn():
+        proc = ctx.Process(target=_worker_main, args=args, name='fapiao-worker')
+        proc.start()
+        return proc
+
+    # 收到 SIGTERM (例如 systemd / docker stop) 时与 Ctrl+C 一样停止所有 worker
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    workers = [spawn() for _ in range(processes)]
+    print(f"[Supervisor] 已启动 {processes} 个 worker (每个最多处理 {max_jobs or '不限'} 个任务，"
+          f"RSS 上限 {max_rss_mb or '不限'}MB)")
+    try:
+        while True:
+            for index, proc in enumerate(workers):
+                proc.join(timeout=0)
+                if proc.is_alive():
+                    continue
+                if proc.exitcode != RECYCLE_EXIT_CODE:
+                    print(f"[Supervisor] worker {proc.pid} 异常退出 (退出码 {proc.exitcode})，1 秒后重启")
+                    time.sleep(1)
+                workers[index] = spawn()
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("[Supervisor] 正在停止 worker...")
+        for proc in workers:
+            proc.terminate()
+        for proc in workers:
+            proc.join()
+
+
+def main(argv=None):
+    from .config import Config
+
+    parser = argparse.ArgumentParser(description='发票处理常驻 worker')
+    parser.add_argument('--processes', type=int, default=Config.WORKER_PROCESSES, help='worker 进程数')
+    parser.add_argument('--max-jobs', type=int, default=Config.WORKER_MAX_JOBS,
+                        help='每个 worker 处理多少个任务后回收 (0 表示不限)')
+    parser.add_argument('--max-rss-mb', type=int, default=Config.WORKER_MAX_RSS_MB,
+                        help='worker 的 RSS 超过此值 (MB) 后回收 (0 表示不限)')
+    parser.add_argument('--poll-interval', type=float, default=Config.WORKER_POLL_INTERVAL,
+                        help='没有任务时的轮询间隔 (秒)')
+    args = parser.parse_args(argv)
+    supervise(args.processes, args.max_jobs, args.max_rss_mb, args.poll_interval)
@@ -0,0 +1,28 @@
+# gunicorn 配置 (由 serve.py 使用，也可以直接运行: gunicorn -c gunicorn.conf.py wsgi:app)
+# 所有参数都来自 Config (即 .env / 环境变量中的 SERVER_*)
+#
+# 优雅重启: kill -HUP <master pid>  (旧进程处理完手头的请求后退出，新进程立即接手)
+# 增减进程: kill -TTIN / -TTOU <master pid>
+from app.config import Config
+
+bind = Config.SERVER_BIND
+workers = Config.SERVER_WORKERS
+
+# gthread: 每个进程多个线程，慢请求 (例如大文件的 /download/zip) 不会阻塞其他用户
+worker_class = 'gthread'
+threads = Config.SERVER_THREADS
+
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = Config.SERVER_KEEPALIVE
+
+# 处理一定数量的请求后重启进程，防止内存缓慢增长
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+
+# 不在 master 中预加载 App: create_app 会启动后台维护线程并获取维护锁，
+# 预加载时锁会被 fork 出的所有子进程共享，master 中的线程也不会被复制到子进程。
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
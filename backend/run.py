@@ -11,7 +11,8 @@ if __name__ == '__main__':
     host = os.environ.get('FLASK_HOST', '127.0.0.1')
     port = int(os.environ.get('FLASK_PORT', 5000))
 
-    # 启动应用
+    # 启动应用 (开发服务器: 单进程，慢请求会阻塞其他用户)
+    # (*** 新增 ***) 部署时请使用 `python serve.py` (gunicorn / waitress，多进程 + 多线程)
     # debug=True 意味着更改代码后服务器会自动重启
     # host='0.0.0.0' 允许局域网访问 (可选)
     print(f" * 后端服务运行在 http://{host}:{port}")
@@ -0,0 +1,33 @@
+import os
+import sys
+from app.config import Config
+
+# 生产模式入口: 多进程 + 多线程的 WSGI 服务器 (开发时仍使用 run.py)
+# - Linux / macOS: gunicorn (配置见 gunicorn.conf.py)
+# - Windows: waitress (单进程多线程，gunicorn 不支持 Windows)
+# 进程数、线程数、超时等通过 .env 中的 SERVER_* 配置
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def serve_gunicorn():
+    os.chdir(backend_dir)
+    args = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    # 用 gunicorn 替换当前进程，信号 (HUP 优雅重启 / TERM 停止) 直接发给 gunicorn master
+    os.execv(sys.executable, args)
+
+
+def serve_waitress():
+    from waitress import serve
+    from wsgi import app
+
+    host, _, port = Config.SERVER_BIND.rpartition(':')
+    print(f" * 后端服务 (waitress, {Config.SERVER_THREADS} 个线程) 运行在 http://{Config.SERVER_BIND}")
+    serve(app, host=host or '127.0.0.1', port=int(port),
+          threads=Config.SERVER_THREADS, channel_timeout=Config.SERVER_TIMEOUT)
+
+
+if __name__ == '__main__':
+    if os.name == 'nt':
+        serve_waitress()
+    else:
+        serve_gunicorn()
@@ -0,0 +1,6 @@
+from app.worker import main
+
+# 常驻的预热 worker: 循环领取 jobs 表中排队的任务
+# (Web 端需设置 JOB_EXECUTOR=worker，上传后任务才会交给这里处理)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+from app import create_app
+
+# 生产模式的 WSGI 入口 (gunicorn wsgi:app / waitress)
+# 每个 Web 进程各自调用一次 create_app；开发时仍使用 run.py
+app = create_app()
@@ -31,37 +31,62 @@ document.addEventListener('DOMContentLoaded', function() {
     const closeModalBtn = document.querySelector('.close-modal');
     const editForm = document.getElementById('edit-form');
     const editIdDisplay = document.getElementById('edit-id-display');
+    const tableContainer = document.querySelector('.table-container');
+
+    // --- (*** 新增: 虚拟滚动 + 增量加载 ***) ---
+    // 每次向后端请求的行数
+    const PAGE_SIZE = 200;
+    // 可视区域上下额外渲染的行数 (减少快速滚动时的白屏)
+    const OVERSCAN_ROWS = 10;
+
+    // 表格的本地状态: 已加载的发票、分页信息、选中状态
+    // (选中状态保存在 Set 中，与 DOM 无关，因此滚动后不会丢失)
+    const tableState = {
+        invoices: [],
+        invoiceById: new Map(),
+        total: 0,
+        hasMore: false,
+        loadingPage: false,
+        searchTerm: '',
+        requestToken: 0,
+        syncSeq: null, // (增量同步的游标: 已同步到的变更序号)
+        rowHeight: 49,
+        selectedIds: new Set()
+    };
 
     // --- (新) 核心数据加载函数 ---
     /**
+     * 重新加载发票列表 (只请求第一页，后续页面在滚动时按需加载)
      * @param {string} searchTerm 搜索关键词
      */
     async function loadInvoices(searchTerm = '') {
-        // 1. 显示加载中
+        // 1. 重置本地状态 (选中状态保留)
+        const token = ++tableState.requestToken;
+        tableState.searchTerm = searchTerm;
+        tableState.invoices = [];
+        tableState.invoiceById = new Map();
+        tableState.total = 0;
+        tableState.hasMore = false;
+        tableState.loadingPage = false;
+        tableState.syncSeq = null;
+
+        // 2. 显示加载中
         invoiceTableBody.innerHTML = '<tr><td colspan="11" style="text-align:center; padding: 20px;"><i class="fas fa-spinner fa-spin"></i> 正在加载...</td></tr>';
         noInvoicesMessage.style.display = 'none';
+        tableContainer.scrollTop = 0;
 
         try {
-            // 2. 调用后端 API
-            const response = await fetch(`${API_BASE_URL}/invoices?search=${encodeURIComponent(searchTerm)}`);
-
-            if (!response.ok) {
-                // (如果后端服务未运行，会在这里失败)
-                let errorMsg = `HTTP 错误! 状态: ${response.status}`;
-                try {
-                    const errData = await response.json();
-                    errorMsg = errData.error || errorMsg;
-                } catch(e) {}
-                throw new Error(errorMsg);
-            }
-
-            const data = await response.json();
+            const data = await fetchInvoicePage(searchTerm, 0);
+            if (token !== tableState.requestToken) return; // (已有更新的请求，丢弃旧结果)
 
             // 3. 渲染数据
-            renderTable(data.invoices || []);
+            appendInvoices(data);
+            tableState.syncSeq = data.sync_seq ?? null;
             updateStats(data.stats || {});
+            renderTable();
 
         } catch (error) {
+            if (token !== tableState.requestToken) return;
             console.error('加载发票失败:', error);
             const msg = (error.message.includes("Failed to fetch"))
                 ? "加载失败：无法连接到后端服务 (请确保 backend/run.py 正在运行)"
@@ -73,71 +98,249 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    // --- (新) 渲染函数 ---
     /**
-     * @param {Array} invoices 发票数据数组
+     * (*** 新增 ***) 请求一页发票数据
+     * @param {string} searchTerm 搜索关键词
+     * @param {number} offset 起始偏移
+     */
+    async function fetchInvoicePage(searchTerm, offset) {
+        const params = new URLSearchParams({ search: searchTerm, limit: PAGE_SIZE, offset: offset });
+        const response = await fetch(`${API_BASE_URL}/invoices?${params}`);
+
+        if (!response.ok) {
+            // (如果后端服务未运行，会在这里失败)
+            let errorMsg = `HTTP 错误! 状态: ${response.status}`;
+            try {
+                const errData = await response.json();
+                errorMsg = errData.error || errorMsg;
+            } catch(e) {}
+            throw new Error(errorMsg);
+        }
+        return response.json();
+    }
+
+    /**
+     * (*** 新增 ***) 把一页结果合并进本地状态
+     * @param {Object} data /invoices 接口返回的数据
+     */
+    function appendInvoices(data) {
+        (data.invoices || []).forEach(inv => {
+            if (tableState.invoiceById.has(inv.id)) return; // (分页期间数据变化可能导致重复)
+            tableState.invoices.push(inv);
+            tableState.invoiceById.set(inv.id, inv);
+        });
+        tableState.total = data.total || tableState.invoices.length;
+        tableState.hasMore = Boolean(data.has_more);
+    }
+
+    /**
+     * (*** 新增 ***) 增量同步: 只请求上次同步之后变化的发票并合并进本地状态，
+     * 不重新下载整个列表 (服务端要求重新加载时才回退到 loadInvoices)。
      */
-    function renderTable(invoices) {
-        invoiceTableBody.innerHTML = ''; // 清空
+    async function syncInvoices() {
+        if (tableState.syncSeq === null) {
+            return loadInvoices(tableState.searchTerm);
+        }
+        const token = tableState.requestToken;
+
+        try {
+            let hasMore = true;
+            while (hasMore) {
+                const params = new URLSearchParams({ since: tableState.syncSeq, search: tableState.searchTerm });
+                const response = await fetch(`${API_BASE_URL}/invoices/changes?${params}`);
+                if (!response.ok) throw new Error(`HTTP 错误! 状态: ${response.status}`);
+                const data = await response.json();
+                if (token !== tableState.requestToken) return; // (期间重新加载过列表)
+
+                if (data.reset) {
+                    return loadInvoices(tableState.searchTerm);
+                }
+                mergeChanges(data);
+                tableState.syncSeq = data.since;
+                if (data.stats) updateStats(data.stats);
+                hasMore = data.has_more;
+            }
+            renderTable();
+        } catch (error) {
+            if (token !== tableState.requestToken) return;
+            console.error('增量同步失败，重新加载:', error);
+            loadInvoices(tableState.searchTerm);
+        }
+    }
+
+    /**
+     * 与后端相同的排序: 开票日期倒序 (空值在最后)，再按 id 倒序
+     */
+    function compareInvoices(a, b) {
+        if (a.issue_date !== b.issue_date) {
+            if (!a.issue_date) return 1;
+            if (!b.issue_date) return -1;
+            return a.issue_date < b.issue_date ? 1 : -1;
+        }
+        return b.id - a.id;
+    }
 
-        if (!invoices || invoices.length === 0) {
+    /**
+     * (*** 新增 ***) 把 /invoices/changes 的结果合并进本地状态
+     * @param {Object} data 变更数据 (invoices: 变化后的行, deleted: 需要移除的 id)
+     */
+    function mergeChanges(data) {
+        const removed = new Set(data.deleted || []);
+        (data.invoices || []).forEach(inv => removed.add(inv.id));
+        // (还有未加载的分页时，排在已加载末尾之后的新行留给后续分页加载)
+        const boundary = tableState.hasMore ? tableState.invoices[tableState.invoices.length - 1] : null;
+
+        const invoices = tableState.invoices.filter(inv => !removed.has(inv.id));
+        (data.deleted || []).forEach(id => {
+            tableState.invoiceById.delete(id);
+            tableState.selectedIds.delete(String(id));
+        });
+        (data.invoices || []).forEach(inv => {
+            if (!tableState.invoiceById.has(inv.id) && boundary && compareInvoices(inv, boundary) > 0) return;
+            invoices.push(inv);
+            tableState.invoiceById.set(inv.id, inv);
+        });
+
+        invoices.sort(compareInvoices);
+        tableState.invoices = invoices;
+        if (data.total !== undefined) tableState.total = data.total;
+    }
+
+    /**
+     * (*** 新增 ***) 滚动接近末尾时加载下一页
+     */
+    async function loadNextPage() {
+        if (tableState.loadingPage || !tableState.hasMore) return;
+        tableState.loadingPage = true;
+        const token = tableState.requestToken;
+
+        try {
+            const data = await fetchInvoicePage(tableState.searchTerm, tableState.invoices.length);
+            if (token !== tableState.requestToken) return;
+            appendInvoices(data);
+            updateStats(data.stats || {});
+            renderVisibleRows();
+        } catch (error) {
+            if (token !== tableState.requestToken) return;
+            console.error('加载下一页失败:', error);
+            showNotification(`加载下一页失败: ${error.message}`, 'error');
+            tableState.hasMore = false; // (避免滚动时反复重试)
+        } finally {
+            if (token === tableState.requestToken) tableState.loadingPage = false;
+        }
+    }
+
+    // --- (新) 渲染函数 ---
+    /**
+     * 渲染表格 (只渲染可视区域内的行)
+     */
+    function renderTable() {
+        if (tableState.invoices.length === 0) {
+            invoiceTableBody.innerHTML = ''; // 清空
             noInvoicesMessage.style.display = 'block'; // 显示 "未找到"
+            updateDownloadButtonState();
             return;
         }
 
         noInvoicesMessage.style.display = 'none'; // 隐藏 "未找到"
+        renderVisibleRows();
 
-        invoices.forEach(inv => {
-            // (格式化金额)
-            const amount = (inv.amount !== null && inv.amount !== undefined) ? `¥${Number(inv.amount).toFixed(2)}` : 'N/A';
-            const totalAmount = (inv.total_amount !== null && inv.total_amount !== undefined) ? `¥${Number(inv.total_amount).toFixed(2)}` : 'N/A';
-
-            // (创建 HTML 字符串)
-            const row = `
-                <tr>
-                    <td><input type="checkbox" name="selected_ids" value="${inv.id}" class="invoice-checkbox"></td>
-                    <td>${inv.invoice_code || 'N/A'}</td>
-                    <td><span class="invoice-number">${inv.invoice_number || 'N/A'}</span></td>
-                    <td>${inv.issue_date || 'N/A'}</td>
-                    <td class="invoice-amount">${amount}</td>
-                    <td class="invoice-amount">${totalAmount}</td>
-                    <td>${inv.buyer_name || 'N/A'}</td>
-                    <td>${inv.buyer_tax_id || 'N/A'}</td>
-                    <td>${inv.seller_name || 'N/A'}</td>
-                    <td>${inv.seller_tax_id || 'N/A'}</td>
-                    <td>
-                        <a href="${API_BASE_URL}/download/${inv.id}" class="action-btn download-link" title="下载" target="_blank">
-                            <i class="fas fa-download"></i>
-                        </a>
-
-                        <button type="button" class="action-btn edit-btn" title="编辑"
-                            data-id="${inv.id}"
-                            data-code="${inv.invoice_code || ''}"
-                            data-number="${inv.invoice_number || ''}"
-                            data-date="${inv.issue_date || ''}"
-                            data-amount="${inv.amount || 0.0}"
-                            data-total_amount="${inv.total_amount || 0.0}"
-                            data-buyer="${inv.buyer_name || ''}"
-                            data-buyer_tax_id="${inv.buyer_tax_id || ''}"
-                            data-seller="${inv.seller_name || ''}"
-                            data-seller_tax_id="${inv.seller_tax_id || ''}">
-                            <i class="fas fa-edit"></i>
-                        </button>
-
-                        <button type="button" class="action-btn delete-btn" title="删除" data-id="${inv.id}">
-                            <i class="fas fa-trash"></i>
-                        </button>
-                    </td>
-                </tr>
-            `;
-            // (插入到 DOM)
-            invoiceTableBody.insertAdjacentHTML('beforeend', row);
-        });
+        // (用真实行高校正估算值，之后的滚动计算都以它为准)
+        const firstRow = invoiceTableBody.querySelector('tr.invoice-row');
+        if (firstRow && firstRow.offsetHeight > 0 && firstRow.offsetHeight !== tableState.rowHeight) {
+            tableState.rowHeight = firstRow.offsetHeight;
+            renderVisibleRows();
+        }
+    }
+
+    /**
+     * (*** 新增 ***) 根据滚动位置计算可视窗口，只生成这部分行的 DOM。
+     * 上下用两个占位行撑起总高度，保证滚动条长度正确。
+     */
+    function renderVisibleRows() {
+        const invoices = tableState.invoices;
+        const rowHeight = tableState.rowHeight;
+        const scrollTop = tableContainer.scrollTop;
+        const viewportHeight = tableContainer.clientHeight || 600;
+
+        const start = Math.max(0, Math.floor(scrollTop / rowHeight) - OVERSCAN_ROWS);
+        const end = Math.min(invoices.length, Math.ceil((scrollTop + viewportHeight) / rowHeight) + OVERSCAN_ROWS);
+
+        let html = spacerRow(start * rowHeight);
+        for (let i = start; i < end; i++) {
+            html += invoiceRowHtml(invoices[i]);
+        }
+        html += spacerRow((invoices.length - end) * rowHeight);
+        if (tableState.hasMore) {
+            html += '<tr class="loading-row"><td colspan="11" style="text-align:center;"><i class="fas fa-spinner fa-spin"></i> 正在加载更多...</td></tr>';
+        }
+        invoiceTableBody.innerHTML = html;
+
+        updateDownloadButtonState();
+
+        // (接近已加载数据的末尾时，预取下一页)
+        if (end >= invoices.length - OVERSCAN_ROWS) {
+            loadNextPage();
+        }
+    }
 
-        // (新) 渲染后必须重新附加事件监听器
-        addDynamicEventListeners();
+    /**
+     * @param {number} height 占位高度 (px)
+     */
+    function spacerRow(height) {
+        return height > 0 ? `<tr class="spacer-row" style="height: ${height}px;"><td colspan="11"></td></tr>` : '';
     }
 
+    /**
+     * @param {Object} inv 单张发票数据
+     */
+    function invoiceRowHtml(inv) {
+        // (格式化金额)
+        const amount = (inv.amount !== null && inv.amount !== undefined) ? `¥${Number(inv.amount).toFixed(2)}` : 'N/A';
+        const totalAmount = (inv.total_amount !== null && inv.total_amount !== undefined) ? `¥${Number(inv.total_amount).toFixed(2)}` : 'N/A';
+        const checked = tableState.selectedIds.has(String(inv.id)) ? 'checked' : '';
+
+        // (编辑/删除按钮只携带 id，数据从本地状态中读取)
+        return `
+            <tr class="invoice-row">
+                <td><input type="checkbox" name="selected_ids" value="${inv.id}" class="invoice-checkbox" ${checked}></td>
+                <td>${inv.invoice_code || 'N/A'}</td>
+                <td><span class="invoice-number">${inv.invoice_number || 'N/A'}</span></td>
+                <td>${inv.issue_date || 'N/A'}</td>
+                <td class="invoice-amount">${amount}</td>
+                <td class="invoice-amount">${totalAmount}</td>
+                <td>${inv.buyer_name || 'N/A'}</td>
+                <td>${inv.buyer_tax_id || 'N/A'}</td>
+                <td>${inv.seller_name || 'N/A'}</td>
+                <td>${inv.seller_tax_id || 'N/A'}</td>
+                <td>
+                    <a href="${API_BASE_URL}/download/${inv.id}" class="action-btn download-link" title="下载" target="_blank">
+                        <i class="fas fa-download"></i>
+                    </a>
+
+                    <button type="button" class="action-btn edit-btn" title="编辑" data-id="${inv.id}">
+                        <i class="fas fa-edit"></i>
+                    </button>
+
+                    <button type="button" class="action-btn delete-btn" title="删除" data-id="${inv.id}">
+                        <i class="fas fa-trash"></i>
+                    </button>
+                </td>
+            </tr>
+        `;
+    }
+
+    // (滚动时按帧重新渲染可视区域)
+    let scrollFrameRequested = false;
+    tableContainer.addEventListener('scroll', function() {
+        if (scrollFrameRequested || tableState.invoices.length === 0) return;
+        scrollFrameRequested = true;
+        window.requestAnimationFrame(() => {
+            scrollFrameRequested = false;
+            renderVisibleRows();
+        });
+    });
+
     /**
      * @param {Object} stats 统计数据对象
      */
@@ -209,12 +412,16 @@ document.addEventListener('DOMContentLoaded', function() {
 
                     // 2. 向用户显示成功信息 (*** 现在可以安全读取 stats ***)
                     const stats = data.stats; // `stats` 此时必定存在
-                    const msg = `文件 "${filename}" 处理完成！\n找到 PDF: ${stats.pdf_found}\n处理: ${stats.processed}\n成功导入: ${stats.inserted}\n跳过(重复): ${stats.duplicates}`;
+                    let msg = `文件 "${filename}" 处理完成！\n找到 PDF: ${stats.pdf_found}\n处理: ${stats.processed}\n成功导入: ${stats.inserted}\n跳过(重复): ${stats.duplicates}`;
+                    // (*** 新增 ***) 解析超时 / 异常的文件已移入隔离区
+                    if (stats.quarantined) {
+                        msg += `\n已隔离(解析超时或异常): ${stats.quarantined}`;
+                    }
                     showNotification(msg, 'success');
 
                     // 3. (*** 解决“需要刷新”的问题 ***)
-                    // 主动刷新列表
-                    loadInvoices(searchInput.value); // (保持当前搜索)
+                    // (*** 修改 ***) 增量同步: 只获取新导入的发票，而不是重新下载整个列表
+                    syncInvoices();
 
                 } else if (data.status === 'failed') {
                     // --- 失败 ---
@@ -224,8 +431,12 @@ document.addEventListener('DOMContentLoaded', function() {
                     uploadBtn.disabled = false;
                     uploadBtn.innerHTML = '<i class="fas fa-upload"></i> 上传并处理';
 
-                    // 2. 向用户显示错误信息
-                    showNotification(`文件 "${filename}" 处理失败: \n${data.error}`, 'error');
+                    // 2. 向用户显示错误信息 (超出解压预算时附带部分统计)
+                    let failMsg = `文件 "${filename}" 处理失败: \n${data.error}`;
+                    if (data.stats) {
+                        failMsg += `\n已解压: ${data.stats.bytes_written} 字节, 成员: ${data.stats.members_seen}, PDF: ${data.stats.pdf_found}`;
+                    }
+                    showNotification(failMsg, 'error');
 
                 } else {
                     // --- 处理中 (queued 或 processing) ---
@@ -252,18 +463,18 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
 
-    // (新) 上传 (*** 已重构为异步轮询 ***)
-    uploadForm.addEventListener('submit', async function(e) {
-        e.preventDefault(); // 阻止表单默认提交
-
-        if (!fileInput.files || fileInput.files.length === 0) {
-            showNotification('未选择文件', 'error');
-            return;
-        }
-
-        const file = fileInput.files[0];
+    /**
+     * (*** 新增函数: 提交上传 ***)
+     * 相同的 ZIP 已处理过时，询问用户是否强制重新处理 (force=1)。
+     * @param {File} file 要上传的 ZIP
+     * @param {boolean} force 是否强制重新处理
+     */
+    async function submitUpload(file, force) {
         const formData = new FormData();
         formData.append('zip_file', file);
+        if (force) {
+            formData.append('force', '1');
+        }
 
         uploadBtn.disabled = true;
         uploadBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> 上传中...';
@@ -282,13 +493,27 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(result.error || `服务器错误: ${response.status}`);
             }
 
+            // (*** 新增 ***) 相同的 ZIP 已处理完成: 不再重复处理，可选择强制重新处理
+            if (result.deduplicated && result.status === 'finished') {
+                uploadBtn.disabled = false;
+                uploadBtn.innerHTML = '<i class="fas fa-upload"></i> 上传并处理';
+                if (confirm(`${result.message}。\n是否强制重新处理?`)) {
+                    await submitUpload(file, true);
+                } else {
+                    uploadForm.reset();
+                }
+                return;
+            }
+
             // --- 步骤 2: 检查 202 状态和 Job ID ---
             // (我们后端的代码返回 202 Accepted)
             if (response.status === 202 && result.job_id) {
                 const jobId = result.job_id;
 
                 // (更新 UI: "上传完成，正在后台处理...")
-                showNotification(`文件 "${file.name}" 已上传，开始后台处理...`, 'success');
+                // (*** 新增 ***) 相同的 ZIP 正在处理中时，轮询同一个任务
+                const startMsg = result.deduplicated ? result.message : `文件 "${file.name}" 已上传，开始后台处理...`;
+                showNotification(startMsg, 'success');
 
                 // (*** 关键: 调用轮询器，而不是在这里刷新 ***)
                 pollJobStatus(jobId, file.name);
@@ -308,6 +533,20 @@ document.addEventListener('DOMContentLoaded', function() {
             uploadBtn.disabled = false;
             uploadBtn.innerHTML = '<i class="fas fa-upload"></i> 上传并处理';
         }
+    }
+
+
+    // (新) 上传 (*** 已重构为异步轮询 ***)
+    uploadForm.addEventListener('submit', async function(e) {
+        e.preventDefault(); // 阻止表单默认提交
+
+        if (!fileInput.files || fileInput.files.length === 0) {
+            showNotification('未选择文件', 'error');
+            return;
+        }
+
+        const file = fileInput.files[0];
+        await submitUpload(file, false);
 
         // (*** 移除旧的 finally 块 ***)
     });
@@ -340,89 +579,98 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     // --- (新) 动态内容 (表格内) 的事件监听器 ---
-    // (此函数保持不变)
-    function addDynamicEventListeners() {
-
-        // (新) 批量下载复选框逻辑
-        const checkboxes = document.querySelectorAll('.invoice-checkbox');
-
-        function updateDownloadButtonState() {
-            const selectedCount = document.querySelectorAll('.invoice-checkbox:checked').length;
-            downloadSelectedBtn.disabled = selectedCount === 0;
-            downloadSelectedBtn.innerHTML = `<i class="fas fa-download"></i> 打包下载 (${selectedCount})`;
-            // (更新全选框状态)
-            selectAllCheckbox.checked = (checkboxes.length > 0 && selectedCount === checkboxes.length);
-        }
+    // (*** 修改: 改为挂在 tbody 上的事件委托，只绑定一次，
+    //  重新渲染行时无需再逐行绑定监听器 ***)
 
-        checkboxes.forEach(checkbox => {
-            checkbox.addEventListener('change', updateDownloadButtonState);
-        });
+    /**
+     * 根据选中状态更新批量下载按钮和全选框
+     */
+    function updateDownloadButtonState() {
+        const selectedCount = tableState.selectedIds.size;
+        downloadSelectedBtn.disabled = selectedCount === 0;
+        downloadSelectedBtn.innerHTML = `<i class="fas fa-download"></i> 打包下载 (${selectedCount})`;
+        // (更新全选框状态: 已加载的发票全部选中时勾选)
+        const loaded = tableState.invoices;
+        selectAllCheckbox.checked = (loaded.length > 0 && loaded.every(inv => tableState.selectedIds.has(String(inv.id))));
+    }
 
-        // (初始化按钮状态)
+    // (新) 批量下载复选框逻辑
+    invoiceTableBody.addEventListener('change', function(e) {
+        const checkbox = e.target.closest('.invoice-checkbox');
+        if (!checkbox) return;
+        if (checkbox.checked) {
+            tableState.selectedIds.add(checkbox.value);
+        } else {
+            tableState.selectedIds.delete(checkbox.value);
+        }
         updateDownloadButtonState();
+    });
 
-
+    invoiceTableBody.addEventListener('click', async function(e) {
         // (新) 编辑模态框逻辑
-        document.querySelectorAll('.edit-btn').forEach(button => {
-            button.addEventListener('click', function() {
-                const data = this.dataset;
-
-                // 1. 填充表单内容
-                editIdDisplay.textContent = data.id;
-                document.getElementById('edit-buyer_name').value = data.buyer;
-                document.getElementById('edit-buyer_tax_id').value = data.buyer_tax_id;
-                document.getElementById('edit-seller_name').value = data.seller;
-                document.getElementById('edit-seller_tax_id').value = data.seller_tax_id;
-                document.getElementById('edit-invoice_code').value = data.code;
-                document.getElementById('edit-invoice_number').value = data.number;
-                document.getElementById('edit-issue_date').value = data.date;
-                document.getElementById('edit-amount').value = data.amount;
-                document.getElementById('edit-total_amount').value = data.total_amount;
-
-                // 2. 显示模态框
-                modal.style.display = 'flex';
-            });
-        });
+        const editButton = e.target.closest('.edit-btn');
+        if (editButton) {
+            const inv = tableState.invoiceById.get(Number(editButton.dataset.id));
+            if (!inv) return;
+
+            // 1. 填充表单内容
+            editIdDisplay.textContent = inv.id;
+            document.getElementById('edit-buyer_name').value = inv.buyer_name || '';
+            document.getElementById('edit-buyer_tax_id').value = inv.buyer_tax_id || '';
+            document.getElementById('edit-seller_name').value = inv.seller_name || '';
+            document.getElementById('edit-seller_tax_id').value = inv.seller_tax_id || '';
+            document.getElementById('edit-invoice_code').value = inv.invoice_code || '';
+            document.getElementById('edit-invoice_number').value = inv.invoice_number || '';
+            document.getElementById('edit-issue_date').value = inv.issue_date || '';
+            document.getElementById('edit-amount').value = inv.amount || 0.0;
+            document.getElementById('edit-total_amount').value = inv.total_amount || 0.0;
+
+            // 2. 显示模态框
+            modal.style.display = 'flex';
+            return;
+        }
 
         // (新) 删除按钮逻辑
-        document.querySelectorAll('.delete-btn').forEach(button => {
-            button.addEventListener('click', async function() {
-                const invoiceId = this.dataset.id;
-                if (confirm(`您确定要删除发票 (ID: ${invoiceId}) 吗？`)) {
-                    try {
-                        const response = await fetch(`${API_BASE_URL}/invoices/${invoiceId}`, {
-                            method: 'DELETE'
-                        });
-                        const result = await response.json();
-                        if (!response.ok) throw new Error(result.error || '删除失败');
-
-                        showNotification(`发票 ID ${invoiceId} 已删除。`, 'success');
-                        loadInvoices(searchInput.value); // (刷新，并保持当前搜索)
-
-                    } catch (error) {
-                        showNotification(`删除失败: ${error.message}`, 'error');
-                    }
+        const deleteButton = e.target.closest('.delete-btn');
+        if (deleteButton) {
+            const invoiceId = deleteButton.dataset.id;
+            if (confirm(`您确定要删除发票 (ID: ${invoiceId}) 吗？`)) {
+                try {
+                    const response = await fetch(`${API_BASE_URL}/invoices/${invoiceId}`, {
+                        method: 'DELETE'
+                    });
+                    const result = await response.json();
+                    if (!response.ok) throw new Error(result.error || '删除失败');
+
+                    tableState.selectedIds.delete(String(invoiceId));
+                    showNotification(`发票 ID ${invoiceId} 已删除。`, 'success');
+                    syncInvoices(); // (增量刷新，保持当前搜索)
+
+                } catch (error) {
+                    showNotification(`删除失败: ${error.message}`, 'error');
                 }
-            });
-        });
-    }
+            }
+        }
+    });
 
-    // (新) 全选框 (此函数保持不变)
+    // (新) 全选框 (*** 修改: 作用于所有已加载的发票，而不仅是当前渲染的行 ***)
     selectAllCheckbox.addEventListener('change', function() {
-        const checkboxes = document.querySelectorAll('.invoice-checkbox');
-        checkboxes.forEach(checkbox => {
-            checkbox.checked = this.checked;
+        tableState.invoices.forEach(inv => {
+            if (this.checked) {
+                tableState.selectedIds.add(String(inv.id));
+            } else {
+                tableState.selectedIds.delete(String(inv.id));
+            }
         });
-        // (触发一次更新)
-        addDynamicEventListeners();
+        renderVisibleRows();
     });
 
 
     // (新) 批量下载提交 (此函数保持不变)
     downloadForm.addEventListener('submit', async function(e) {
         e.preventDefault();
-        const selectedCheckboxes = document.querySelectorAll('.invoice-checkbox:checked');
-        const selectedIds = Array.from(selectedCheckboxes).map(cb => cb.value);
+        // (从选中状态读取，包含已滚出可视区域的行)
+        const selectedIds = Array.from(tableState.selectedIds);
 
         if (selectedIds.length === 0) {
             showNotification('未选中任何发票', 'error');
@@ -456,15 +704,11 @@ document.addEventListener('DOMContentLoaded', function() {
             window.URL.revokeObjectURL(url);
             a.remove();
 
-            // (取消全选)
-            selectAllCheckbox.checked = false;
-            addDynamicEventListeners();
-
         } catch(error) {
             showNotification(`打包下载失败: ${error.message}`, 'error');
         } finally {
             // (恢复按钮状态)
-            addDynamicEventListeners();
+            updateDownloadButtonState();
         }
     });
 
@@ -507,7 +751,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
             showNotification(`发票 ID ${invoiceId} 已更新。`, 'success');
             modal.style.display = 'none';
-            loadInvoices(searchInput.value); // (刷新，并保持当前搜索)
+            syncInvoices(); // (增量刷新，保持当前搜索)
 
         } catch (error) {
              showNotification(`更新失败: ${error.message}`, 'error');
@@ -0,0 +1,361 @@
+"""
+(*** 新增 ***) 离线批量导入
+
+不经过 Web 上传接口，直接把目录树中的 PDF / ZIP (或 ZIP 列表) 导入数据库。
+解压和解析使用与上传任务相同的 zip_handler / invoice_parser，并利用所有 CPU 核心:
+- 每个 PDF (包括 ZIP 中解压出的 PDF) 是一个独立的解析任务，分发到进程池；
+- 解析结果在主进程中按批 (--batch-size 张发票) 写入数据库，每批只提交一次；
+- 每批提交后，把已处理文件的 SHA-256 追加到清单文件 (manifest)。
+  中断后重新运行同一命令，清单中已有的文件 (以及整个已完成的 ZIP) 会直接跳过。
+
+用法 (在项目根目录):
+    python scripts/bulk_ingest.py /data/archive/2019 /data/archive/2020.zip
+    python scripts/bulk_ingest.py --list zips.txt --workers 16 --batch-size 1000
+"""
+import gc
+import os
+import sys
+import time
+import shutil
+import bisect
+import argparse
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../backend'))
+sys.path.insert(0, backend_dir)
+# 批量导入不需要后台文件回收线程 (Config 在导入 app 时读取环境变量)
+os.environ.setdefault('FILE_REAPER_ENABLED', '0')
+
+from app.services import zip_handler, parse_worker  # noqa: E402
+from app.services.fingerprint import sha256_file  # noqa: E402
+
+# 每个进程最多同时排队的任务数 (避免一次提交上百万个任务)
+_TASKS_PER_WORKER = 4
+# 进度条宽度 / 刷新间隔 (秒)
+_BAR_WIDTH = 30
+_PROGRESS_INTERVAL = 0.5
+
+# --- 解析进程 ---
+
+# 解析进程中的清单只保存每个 SHA-256 的前 64 位 (有序数组，每个文件 8 字节)，
+# 数百万个文件也只占十几 MB；命中后由主进程用完整的 SHA-256 复核。
+_known_prefixes = array('Q')
+_text_engine = 'pdfplumber'  # (*** 新增 ***) 文本提取引擎 (PDF_TEXT_ENGINE)
+
+
+def _load_manifest(path):
+    """读取清单文件中已导入文件的 SHA-256"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='ascii') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def _init_worker(manifest_path, verbose, text_engine):
+    """(解析进程初始化) 读取清单；默认屏蔽解析器的逐文件输出，以免打乱进度条"""
+    global _known_prefixes, _text_engine
+    _text_engine = text_engine
+    _known_prefixes = array('Q', sorted({int(file_hash[:16], 16) for file_hash in _load_manifest(manifest_path)}))
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def _probably_known(file_hash):
+    prefix = int(file_hash[:16], 16)
+    index = bisect.bisect_left(_known_prefixes, prefix)
+    return index < len(_known_prefixes) and _known_prefixes[index] == prefix
+
+
+def _parse_pdf(pdf_path, force=False):
+    """(在解析进程中执行) 返回 (文件 SHA-256, infos)；清单中 (可能) 已有的文件返回 infos=None"""
+    from app.services.invoice_parser import extract_invoice_info
+
+    file_hash = sha256_file(pdf_path)
+    if not force and _probably_known(file_hash):
+        return file_hash, None
+    # (文件级并行已经占满所有核心，不再做页级并行)
+    infos = extract_invoice_info(pdf_path, page_workers=0, engine=_text_engine)
+    gc.collect()  # (pdfminer 的对象之间有循环引用，立即回收)
+    return file_hash, infos
+
+
+def _extract_zip(zip_path, output_dir, limits, force=False):
+    """(在解析进程中执行) 解压到 output_dir，返回 (文件 SHA-256, [PDF 路径])；清单中 (可能) 已有时返回 None"""
+    file_hash = sha256_file(zip_path)
+    if not force and _probably_known(file_hash):
+        return file_hash, None
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    try:
+        zip_handler.recursive_extract_all_pdfs(zip_path, output_dir, limits=limits)
+    except BaseException:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+    return file_hash, sorted(os.path.join(output_dir, name) for name in os.listdir(output_dir))
+
+
+# --- 主进程 ---
+
+def _iter_sources(paths):
+    """展开命令行给出的路径: 目录递归查找 PDF 和 ZIP，返回 ('pdf' | 'zip', 路径)"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    kind = _kind_of(name)
+                    if kind:
+                        yield kind, os.path.abspath(os.path.join(root, name))
+        elif _kind_of(path):
+            yield _kind_of(path), os.path.abspath(path)
+        else:
+            print(f"跳过不支持的路径: {path}", file=sys.stderr)
+
+
+def _kind_of(name):
+    lower = name.lower()
+    if lower.endswith('.pdf'):
+        return 'pdf'
+    if lower.endswith('.zip'):
+        return 'zip'
+    return None
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class _Archive:
+    """一个已解压的 ZIP: 所有成员都写入数据库后，才删除解压目录并记入清单"""
+
+    def __init__(self, file_hash, output_dir, remaining):
+        self.file_hash = file_hash
+        self.output_dir = output_dir
+        self.remaining = remaining
+        self.failed = False  # (有成员解析失败时不记入清单，下次重新处理)
+
+
+class BulkIngest:
+    def __init__(self, manifest, batch_size, total_sources):
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.total_sources = total_sources
+        self.known_hashes = _load_manifest(manifest.name)
+        self.stats = {
+            'sources_done': 0, 'pdfs_parsed': 0, 'already_ingested': 0, 'failed': 0,
+            'processed': 0, 'inserted': 0, 'skipped': 0, 'duplicates': 0,
+        }
+        # 待写入的一批: 解析结果 / 文件指纹 / 全部成员已解析的 ZIP
+        self.pending_parsed = []
+        self.pending_invoices = 0
+        self.pending_hashes = set()
+        self.finished_archives = []
+        self.started = time.monotonic()
+        self._last_progress = 0
+
+    def is_known(self, file_hash):
+        return file_hash in self.known_hashes or file_hash in self.pending_hashes
+
+    def add_pdf(self, pdf_path, file_hash, infos, archive):
+        """记录一个 PDF 的解析结果 (infos=None 表示清单中已有)"""
+        if infos is not None:
+            self.stats['pdfs_parsed'] += 1
+        if self.is_known(file_hash):
+            self.stats['already_ingested'] += 1
+        elif not infos:
+            # (非发票文件，同样记入清单，下次不再解析)
+            self.stats['skipped'] += 1
+            self.pending_hashes.add(file_hash)
+        else:
+            self.stats['processed'] += 1
+            self.pending_parsed.append((pdf_path, file_hash, infos))
+            self.pending_invoices += len(infos)
+            self.pending_hashes.add(file_hash)
+        self.member_done(archive)
+
+    def member_done(self, archive, failed=False):
+        if archive is None:
+            self.stats['sources_done'] += 1
+            return
+        archive.remaining -= 1
+        archive.failed = archive.failed or failed
+        if archive.remaining == 0:
+            self.finished_archives.append(archive)
+            self.stats['sources_done'] += 1
+
+    def flush(self, force=False):
+        """写入一批 (所有发票一次提交)，然后把文件指纹追加到清单并清理已完成 ZIP 的解压目录"""
+        if not force and self.pending_invoices < self.batch_size:
+            return
+        from app.services.invoice_parser import store_parsed_pdfs
+
+        if self.pending_parsed:
+            store_parsed_pdfs(self.pending_parsed, self.stats)
+
+        hashes = self.pending_hashes | {archive.file_hash for archive in self.finished_archives if not archive.failed}
+        if hashes:
+            self.manifest.write(''.join(f"{file_hash}\n" for file_hash in hashes))
+            self.manifest.flush()
+            os.fsync(self.manifest.fileno())
+        self.known_hashes |= hashes
+        for archive in self.finished_archives:
+            shutil.rmtree(archive.output_dir, ignore_errors=True)
+
+        self.pending_parsed, self.pending_invoices = [], 0
+        self.pending_hashes, self.finished_archives = set(), []
+
+    def progress(self, final=False):
+        now = time.monotonic()
+        if not final and now - self._last_progress < _PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        stats, elapsed = self.stats, max(now - self.started, 1e-6)
+        done, total = stats['sources_done'], max(self.total_sources, 1)
+        filled = int(_BAR_WIDTH * min(done / total, 1))
+        files_per_second = stats['pdfs_parsed'] / elapsed
+        eta = (total - done) * elapsed / done if done else 0
+        line = (f"\r[{'=' * filled}{' ' * (_BAR_WIDTH - filled)}] {done}/{self.total_sources} "
+                f"{100 * done / total:5.1f}%  {files_per_second:.1f} PDF/s  "
+                f"{stats['inserted'] / elapsed:.1f} 发票/s  已用 {_format_duration(elapsed)}  "
+                f"剩余 {_format_duration(eta)}")
+        sys.stderr.write(line + ('\n' if final else ''))
+        sys.stderr.flush()
+
+
+def run(app, paths, workers, batch_size, manifest_path, staging_dir, verbose):
+    total_sources = sum(1 for _ in _iter_sources(paths))
+    print(f"共 {total_sources} 个 PDF / ZIP，{workers} 个解析进程", file=sys.stderr)
+
+    limits = zip_handler.limits_from_config(app.config)
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(manifest_path, verbose, app.config['PDF_TEXT_ENGINE']),
+        # 每个解析进程处理 PARSER_MAX_FILES 个任务后换新进程，防止内存缓慢增长
+        **parse_worker.pool_kwargs(app.config['PARSER_MAX_FILES'])
+    )
+    sources = _iter_sources(paths)
+    members = deque()  # 已解压的 ZIP 中待解析的 PDF: (路径, _Archive)
+    in_flight = {}     # {Future: (类型, 路径, _Archive 或解压目录)}
+
+    with open(manifest_path, 'a', encoding='ascii') as manifest, pool:
+        ingest = BulkIngest(manifest, batch_size, total_sources)
+        archive_count = 0
+        while True:
+            # 1. 保持每个进程有少量排队任务 (优先解析已解压的 ZIP 成员，尽早释放解压目录)
+            while len(in_flight) < workers * _TASKS_PER_WORKER:
+                if members:
+                    pdf_path, archive = members.popleft()
+                    in_flight[pool.submit(_parse_pdf, pdf_path)] = ('pdf', pdf_path, archive)
+                    continue
+                kind, path = next(sources, (None, None))
+                if kind is None:
+                    break
+                if kind == 'pdf':
+                    in_flight[pool.submit(_parse_pdf, path)] = ('pdf', path, None)
+                else:
+                    archive_count += 1
+                    output_dir = os.path.join(staging_dir, str(archive_count))
+                    in_flight[pool.submit(_extract_zip, path, output_dir, limits)] = ('zip', path, output_dir)
+            if not in_flight:
+                break
+
+            # 2. 收集完成的任务
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, path, context = in_flight.pop(future)
+                archive = context if kind == 'pdf' else None
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"\n处理失败 {path}: {e}", file=sys.stderr)
+                    ingest.stats['failed'] += 1
+                    ingest.member_done(archive, failed=True)
+                    continue
+
+                file_hash, found = result
+                if found is None and file_hash not in ingest.known_hashes:
+                    # 解析进程只比较了前 64 位，完整的 SHA-256 不在清单中: 重新提交并强制处理
+                    task = _parse_pdf if kind == 'pdf' else _extract_zip
+                    args = (path,) if kind == 'pdf' else (path, context, limits)
+                    in_flight[pool.submit(task, *args, force=True)] = (kind, path, context)
+                    continue
+                if kind == 'pdf':
+                    ingest.add_pdf(path, file_hash, found, archive)
+                    continue
+                output_dir, pdf_paths = context, found
+                if ingest.is_known(file_hash):
+                    ingest.stats['already_ingested'] += 1
+                    ingest.member_done(None)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                elif not pdf_paths:
+                    ingest.pending_hashes.add(file_hash)
+                    ingest.finished_archives.append(_Archive(file_hash, output_dir, 0))
+                    ingest.member_done(None)
+                else:
+                    archive = _Archive(file_hash, output_dir, len(pdf_paths))
+                    members.extend((pdf_path, archive) for pdf_path in pdf_paths)
+
+            # 3. 攒够一批后写入数据库
+            ingest.flush()
+            ingest.progress()
+
+        ingest.flush(force=True)
+        ingest.progress(final=True)
+    return ingest.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线批量导入目录树中的 PDF / ZIP 发票 (可中断后续传)')
+    parser.add_argument('paths', nargs='*', help='目录 (递归查找 PDF 和 ZIP)、PDF 或 ZIP 文件')
+    parser.add_argument('--list', dest='list_file', help='从文件中读取路径 (每行一个)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='解析进程数 (默认: CPU 核心数)')
+    parser.add_argument('--batch-size', type=int, default=500, help='每批写入数据库的发票数 (默认: 500)')
+    parser.add_argument('--manifest', help='已导入文件的清单 (默认: 数据库所在目录的 bulk_ingest.manifest)')
+    parser.add_argument('--staging-dir', help='ZIP 解压目录 (默认: 数据库所在目录的 bulk_ingest_staging)')
+    parser.add_argument('--prerender', action='store_true', help='同时预渲染预览缩略图 (默认关闭)')
+    parser.add_argument('--verbose', action='store_true', help='显示解析进程的逐文件输出')
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    if args.list_file:
+        with open(args.list_file, encoding='utf-8') as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    if not paths:
+        parser.error('请指定要导入的目录或文件')
+
+    from app import create_app
+    from app.services import coordination
+
+    app = create_app()
+    app.config['PREVIEW_PRERENDER'] = args.prerender
+    instance_dir = os.path.dirname(app.config['DATABASE_PATH'])
+    manifest_path = os.path.abspath(args.manifest or os.path.join(instance_dir, 'bulk_ingest.manifest'))
+    staging_dir = os.path.abspath(args.staging_dir or os.path.join(instance_dir, 'bulk_ingest_staging'))
+
+    # 同一时间只允许一个批量导入 (解压目录和清单不能共用)
+    lock = coordination.try_lock(coordination.lock_path(app.config, 'bulk-ingest'))
+    if lock is None:
+        sys.exit('另一个批量导入正在运行')
+    try:
+        # 上次中断时遗留的解压目录 (对应的 ZIP 未记入清单，会重新解压)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        with app.app_context():
+            stats = run(app, paths, max(1, args.workers), max(1, args.batch_size), manifest_path, staging_dir,
+                        args.verbose)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    finally:
+        coordination.release_lock(lock)
+
+    print(f"完成: 新增发票 {stats['inserted']}，重复 {stats['duplicates']}，"
+          f"非发票/跳过 {stats['skipped']}，清单中已有 {stats['already_ingested']}，失败 {stats['failed']}")
+
+
+if __name__ == '__main__':
+    main()
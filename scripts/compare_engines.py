@@ -0,0 +1,165 @@
+"""
+(*** 新增 ***) 比较两个文本提取引擎 (见 backend/app/services/text_engines.py) 的准确率和速度
+
+对语料中的每个 PDF 分别用两个引擎运行 extract_invoice_info，逐字段比较提取结果
+(以 --baseline 引擎为准)，报告:
+- 每个引擎的总耗时、每秒处理的文件数、候选引擎的加速比；
+- 结果完全一致的文件比例、发票条数不同的文件；
+- 每个字段的不一致次数 (按对齐后的发票记录统计)；
+- 候选引擎回退到 pdfplumber 的文件数 (字段校验不通过 / 页面无法解码)；
+- 前 --show-diffs 个不一致的具体内容。
+
+用法 (在项目根目录):
+    python scripts/compare_engines.py /data/invoices --json engines.json
+    python scripts/compare_engines.py --generate 200        # 没有真实语料时，用 fixture_pdfs.py 生成
+"""
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import contextlib
+
+backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../backend'))
+sys.path.insert(0, backend_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import EXTRACTED_FIELDS as FIELDS  # noqa: E402  (info 元组的前 11 项)
+from app.services import profiling, text_engines  # noqa: E402
+from app.services.invoice_parser import extract_invoice_info  # noqa: E402
+
+
+def iter_pdfs(paths):
+    """展开命令行给出的路径: 目录递归查找 PDF"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.pdf'):
+                        yield os.path.join(root, name)
+        elif path.lower().endswith('.pdf'):
+            yield path
+        else:
+            print(f"跳过不支持的路径: {path}", file=sys.stderr)
+
+
+def run_engine(pdf_path, engine, verbose):
+    """返回 (infos, 秒, 是否回退到 pdfplumber)"""
+    phases = profiling.start_recording()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    try:
+        with output:
+            infos = extract_invoice_info(pdf_path, page_workers=0, engine=engine)
+    finally:
+        profiling.stop_recording()
+    return infos, time.perf_counter() - started, 'fallback' in phases
+
+
+def _jsonable(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def compare(pdf_paths, baseline, candidate, show_diffs, verbose):
+    report = {
+        'baseline': baseline,
+        'candidate': candidate,
+        'files': 0,
+        'identical_files': 0,
+        'record_count_mismatches': 0,
+        'records_compared': 0,
+        'field_mismatches': {field: 0 for field in FIELDS},
+        'candidate_fallback_files': 0,
+        'seconds': {baseline: 0.0, candidate: 0.0},
+        'diffs': [],
+    }
+    for pdf_path in pdf_paths:
+        expected, baseline_seconds, _ = run_engine(pdf_path, baseline, verbose)
+        actual, candidate_seconds, fell_back = run_engine(pdf_path, candidate, verbose)
+        report['files'] += 1
+        report['seconds'][baseline] += baseline_seconds
+        report['seconds'][candidate] += candidate_seconds
+        report['candidate_fallback_files'] += fell_back
+
+        if [info[:len(FIELDS)] for info in expected] == [info[:len(FIELDS)] for info in actual]:
+            report['identical_files'] += 1
+            continue
+
+        if len(expected) != len(actual):
+            report['record_count_mismatches'] += 1
+        differences = []
+        for index, (want, got) in enumerate(zip(expected, actual)):
+            report['records_compared'] += 1
+            for field, want_value, got_value in zip(FIELDS, want, got):
+                if want_value != got_value:
+                    report['field_mismatches'][field] += 1
+                    differences.append({'record': index, 'field': field,
+                                        baseline: _jsonable(want_value), candidate: _jsonable(got_value)})
+        if len(report['diffs']) < show_diffs:
+            report['diffs'].append({'file': pdf_path, 'records': [len(expected), len(actual)],
+                                    'differences': differences})
+    return report
+
+
+def print_report(report):
+    baseline, candidate = report['baseline'], report['candidate']
+    files = report['files']
+    print(f"文件数: {files}")
+    if not files:
+        return
+    for engine in (baseline, candidate):
+        seconds = report['seconds'][engine]
+        print(f"  {engine:<12} {seconds:8.2f} 秒  {files / seconds if seconds else 0:8.1f} 文件/秒")
+    if report['seconds'][candidate]:
+        print(f"  加速比: {report['seconds'][baseline] / report['seconds'][candidate]:.2f}x")
+    print(f"结果一致: {report['identical_files']}/{files} ({100 * report['identical_files'] / files:.2f}%)")
+    print(f"发票条数不同的文件: {report['record_count_mismatches']}")
+    print(f"{candidate} 回退到 pdfplumber 的文件: {report['candidate_fallback_files']}")
+    mismatched = {field: count for field, count in report['field_mismatches'].items() if count}
+    if mismatched:
+        print(f"字段不一致 (共比较 {report['records_compared']} 条不一致文件中的记录):")
+        for field, count in sorted(mismatched.items(), key=lambda item: -item[1]):
+            print(f"  {field:<16} {count}")
+    for diff in report['diffs']:
+        print(f"\n{diff['file']} (发票条数 {baseline}={diff['records'][0]}, {candidate}={diff['records'][1]})")
+        for item in diff['differences'][:20]:
+            print(f"  #{item['record']} {item['field']}: {item[baseline]!r} != {item[candidate]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较两个 PDF 文本提取引擎的准确率和速度')
+    parser.add_argument('paths', nargs='*', help='目录 (递归查找 PDF) 或 PDF 文件')
+    parser.add_argument('--baseline', default='pdfplumber', choices=text_engines.ENGINES, help='基准引擎')
+    parser.add_argument('--candidate', default='pdfium', choices=text_engines.ENGINES, help='比较的引擎')
+    parser.add_argument('--generate', type=int, default=0, help='没有语料时生成 N 个测试 PDF (scripts/fixture_pdfs.py)')
+    parser.add_argument('--pages', type=int, default=1, help='生成的每个 PDF 的发票页数 (默认 1)')
+    parser.add_argument('--show-diffs', type=int, default=10, help='显示前 N 个不一致的文件 (默认 10)')
+    parser.add_argument('--json', dest='json_path', help='把报告写入 JSON 文件')
+    parser.add_argument('--fail-on-diff', action='store_true', help='有任何不一致时以退出码 1 结束')
+    parser.add_argument('--verbose', action='store_true', help='显示解析器的逐文件输出')
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    with tempfile.TemporaryDirectory(prefix='compare_engines_') as fixture_dir:
+        if args.generate:
+            import fixture_pdfs
+            fixture_pdfs.generate(fixture_dir, args.generate, args.pages)
+            paths.append(fixture_dir)
+        if not paths:
+            parser.error('请指定语料路径，或使用 --generate 生成测试 PDF')
+
+        report = compare(iter_pdfs(paths), args.baseline, args.candidate, args.show_diffs, args.verbose)
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.fail_on_diff and report['identical_files'] != report['files']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
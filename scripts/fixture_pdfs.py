@@ -0,0 +1,145 @@
+"""
+(*** 新增 ***) 离线生成测试用的发票 PDF / ZIP
+
+不依赖任何 PDF 生成库: 直接写出最小的 PDF 文件，文字使用 PDF 阅读器内置的 STSong-Light 字体
+(UniGB-UCS2-H 编码，不嵌入字体)，版式与真实电子发票的关键行一致，可被 invoice_parser 正常解析。
+供压力测试 (scripts/load_test.py) 等脚本在没有真实发票的环境中使用。
+
+用法 (在项目根目录):
+    python scripts/fixture_pdfs.py /tmp/fixtures --count 200 --pages 1
+"""
+import io
+import os
+import random
+import zipfile
+import argparse
+import datetime
+
+# A4 (pt)
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+_BUYERS = ['华东建设有限公司', '北方物流股份有限公司', '南山科技有限公司', '西城餐饮管理有限公司', '东湖医药连锁有限公司']
+_SELLERS = ['中石化销售有限公司', '京东商贸有限公司', '顺丰速运有限公司', '万达酒店管理有限公司', '国网电力有限公司']
+_AMOUNT_WORDS = '壹佰圆整'  # (解析器不使用大写金额，固定文字即可)
+
+
+def random_invoice(rng, index):
+    """生成一张随机发票的字段 (index 保证同一批中发票号码唯一)"""
+    buyer = rng.randrange(len(_BUYERS))
+    seller = rng.randrange(len(_SELLERS))
+    amount = round(rng.uniform(10, 20000), 2)
+    tax = round(amount * rng.choice((0.01, 0.03, 0.06, 0.13)), 2)
+    return {
+        'invoice_code': f"0{rng.randrange(10 ** 10, 10 ** 11)}",
+        'invoice_number': f"{index:08d}",
+        'issue_date': datetime.date(2023, 1, 1) + datetime.timedelta(days=rng.randrange(730)),
+        'amount': amount,
+        'tax': tax,
+        'buyer_name': _BUYERS[buyer],
+        'buyer_tax_id': f"91330100MA{buyer:08d}",
+        'seller_name': _SELLERS[seller],
+        'seller_tax_id': f"91110000MA{seller:08d}",
+    }
+
+
+def _page_lines(invoice):
+    """一页发票的文字行: [(x 比例, y 比例, 字号, 文字)]"""
+    total = invoice['amount'] + invoice['tax']
+    date = invoice['issue_date']
+    return [
+        (0.30, 0.96, 14, '电子普通发票'),
+        (0.55, 0.90, 9, f"发票代码: {invoice['invoice_code']}"),
+        (0.55, 0.87, 9, f"发票号码: {invoice['invoice_number']}"),
+        (0.55, 0.84, 9, f"开票日期: {date.year}年{date.month:02d}月{date.day:02d}日"),
+        (0.08, 0.75, 9, f"名 称: {invoice['buyer_name']}"),
+        (0.08, 0.72, 9, f"纳税人识别号: {invoice['buyer_tax_id']}"),
+        (0.08, 0.50, 9, f"合 计 ¥{invoice['amount']:.2f} ¥{invoice['tax']:.2f}"),
+        (0.08, 0.45, 9, f"价税合计(大写) {_AMOUNT_WORDS} (小写)¥{total:.2f}"),
+        (0.08, 0.20, 9, f"名 称: {invoice['seller_name']}"),
+        (0.08, 0.17, 9, f"纳税人识别号: {invoice['seller_tax_id']}"),
+    ]
+
+
+def _content_stream(lines):
+    ops = []
+    for x, y, size, text in lines:
+        hex_text = text.encode('utf-16-be').hex().upper()
+        ops.append(f"BT /F1 {size} Tf {PAGE_WIDTH * x:.1f} {PAGE_HEIGHT * y:.1f} Td <{hex_text}> Tj ET")
+    return '\n'.join(ops).encode('ascii')
+
+
+def invoice_pdf_bytes(invoices):
+    """返回一个 PDF 文件的内容，每张发票一页"""
+    # 对象编号: 1 目录, 2 页面树, 3 字体, 4 CID 字体, 5 字体描述, 之后每页 (页面, 内容) 两个对象
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+           b"/DescendantFonts [4 0 R] >>",
+        4: b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+           b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+           b"/FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+        5: b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+           b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>",
+    }
+    kids = []
+    for i, invoice in enumerate(invoices):
+        page_id, content_id = 6 + 2 * i, 7 + 2 * i
+        stream = _content_stream(_page_lines(invoice))
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode('ascii')
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        kids.append(f"{page_id} 0 R")
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode('ascii')
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = out.tell()
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id]))
+    xref_offset = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for obj_id in sorted(objects):
+        out.write(b"%010d 00000 n \n" % offsets[obj_id])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+    return out.getvalue()
+
+
+def invoice_zip_bytes(pdfs):
+    """把 [(文件名, PDF 内容)] 打包为 ZIP (上传接口的格式)"""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in pdfs:
+            zf.writestr(name, data)
+    return out.getvalue()
+
+
+def generate(output_dir, count, pages=1, seed=0):
+    """在 output_dir 中生成 count 个 PDF (每个 pages 页)，返回文件路径列表"""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        invoices = [random_invoice(rng, i * pages + p) for p in range(pages)]
+        path = os.path.join(output_dir, f"fixture_{i:06d}.pdf")
+        with open(path, 'wb') as f:
+            f.write(invoice_pdf_bytes(invoices))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线生成测试用的发票 PDF')
+    parser.add_argument('output_dir', help='输出目录')
+    parser.add_argument('--count', type=int, default=100, help='PDF 文件数 (默认 100)')
+    parser.add_argument('--pages', type=int, default=1, help='每个 PDF 的发票页数 (默认 1)')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子 (相同的种子生成相同的发票)')
+    args = parser.parse_args()
+    paths = generate(args.output_dir, args.count, args.pages, args.seed)
+    print(f"已生成 {len(paths)} 个 PDF: {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
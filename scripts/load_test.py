@@ -0,0 +1,504 @@
+"""
+(*** 新增 ***) 压力测试
+
+按可配置的场景比例，用多个并发的虚拟用户同时上传 ZIP、轮询任务、分页 / 搜索列表、下载单张发票和打包下载，
+结束后按接口输出请求数、错误率和 p50 / p95 / p99 延迟，以及 SQLite 写锁等待统计
+(GET /maintenance/db-locks)。测试数据由 fixture_pdfs.py 离线生成，不需要真实发票。
+
+两种运行方式:
+- 默认在本进程内通过 Flask 测试客户端驱动 App，数据库和文件都放在临时目录 (或 --workdir) 中，
+  不影响正式数据。上传任务仍在后台线程和独立的解析进程中处理，与线上一致；
+  但虚拟用户和 App 共用一个 Python 进程 (GIL)，绝对吞吐量偏低，适合比较改动前后的差异；
+- --url 指向已经启动的服务 (例如 python serve.py)，通过 HTTP 请求测试真实的部署。
+  服务端需要设置 DB_LOCK_STATS=1 才有写锁统计；多进程部署时统计只来自其中一个进程。
+  注意: 会向该服务上传测试发票。
+
+用法 (在项目根目录):
+    python scripts/load_test.py --users 50 --duration 60
+    python scripts/load_test.py --mix list=50,search=30,upload=5,download=10,bundle=5 --seed-invoices 20000
+    python scripts/load_test.py --url http://127.0.0.1:5000 --users 20 --json report.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import hashlib
+import argparse
+import datetime
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import fixture_pdfs
+
+backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../backend'))
+sys.path.insert(0, backend_dir)
+
+API_PREFIX = '/api/v1'
+
+# 默认的场景比例 (权重)
+DEFAULT_MIX = 'list=35,search=30,changes=10,analytics=5,download=12,bundle=3,upload=5'
+# 上传后轮询任务状态的间隔 / 最长等待 (秒)
+_POLL_INTERVAL = 0.5
+_JOB_TIMEOUT = 600
+# 测试期间新上传的发票号码从这里开始编号 (与预置数据不重复)
+_UPLOAD_NUMBER_BASE = 50000000
+# 预置数据每批写入的发票数
+_SEED_BATCH = 500
+
+_SEARCH_TERMS = ['有限公司', '科技', '物流', '酒店', '91330100', '2023', '0000', '电力', '不存在的关键词']
+
+
+# --- 传输层: 测试客户端 / HTTP ---
+
+class _TestClientTransport:
+    """在本进程内通过 Flask 测试客户端发送请求 (每个线程一个客户端)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def request(self, method, path, json_body=None, upload=None):
+        """返回 (状态码, 响应内容 bytes)；upload 为 (文件名, ZIP 内容)"""
+        kwargs = {}
+        if json_body is not None:
+            kwargs['json'] = json_body
+        if upload is not None:
+            kwargs['data'] = {'zip_file': (io.BytesIO(upload[1]), upload[0])}
+            kwargs['content_type'] = 'multipart/form-data'
+        response = self._client().open(API_PREFIX + path, method=method, **kwargs)
+        try:
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+
+class _HttpTransport:
+    """通过 HTTP 请求一个已经运行的服务"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/') + API_PREFIX
+        self.timeout = timeout
+
+    def request(self, method, path, json_body=None, upload=None):
+        headers, data = {}, None
+        if json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if upload is not None:
+            boundary = uuid.uuid4().hex
+            data = (
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"zip_file\"; filename=\"{upload[0]}\"\r\n"
+                f"Content-Type: application/zip\r\n\r\n"
+            ).encode('utf-8') + upload[1] + f"\r\n--{boundary}--\r\n".encode('ascii')
+            headers['Content-Type'] = f"multipart/form-data; boundary={boundary}"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+# --- 统计 ---
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+class Recorder:
+    """按接口记录每个请求的耗时和结果 (线程安全)"""
+
+    def __init__(self):
+        self._samples = {}  # {接口: [耗时 (秒)]}
+        self._errors = {}   # {接口: {状态码: 次数}}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, elapsed, status):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append(elapsed)
+            if status == 0 or status >= 400:
+                errors = self._errors.setdefault(endpoint, {})
+                errors[status] = errors.get(status, 0) + 1
+
+    def summary(self, duration):
+        rows = {}
+        with self._lock:
+            for endpoint, samples in sorted(self._samples.items()):
+                samples = sorted(samples)
+                errors = self._errors.get(endpoint, {})
+                error_count = sum(errors.values())
+                rows[endpoint] = {
+                    'requests': len(samples),
+                    'errors': error_count,
+                    'error_rate': round(error_count / len(samples), 4),
+                    'error_statuses': {str(status): count for status, count in sorted(errors.items())},
+                    'rps': round(len(samples) / duration, 2) if duration else 0,
+                    'p50_ms': round(_percentile(samples, 0.50) * 1000, 1),
+                    'p95_ms': round(_percentile(samples, 0.95) * 1000, 1),
+                    'p99_ms': round(_percentile(samples, 0.99) * 1000, 1),
+                    'max_ms': round(samples[-1] * 1000, 1),
+                }
+        return rows
+
+
+# --- 虚拟用户 ---
+
+class LoadTest:
+    def __init__(self, transport, args):
+        self.transport = transport
+        self.args = args
+        self.recorder = Recorder()
+        self.invoice_ids = []
+        self.mix = _parse_mix(args.mix)
+        self._scenarios = [name for name, _ in self.mix]
+        self._weights = [weight for _, weight in self.mix]
+        self._upload_lock = threading.Lock()
+        self._next_number = _UPLOAD_NUMBER_BASE + random.randrange(10 ** 7)
+        self.uploads = {'started': 0, 'finished': 0, 'failed': 0, 'timed_out': 0, 'inserted': 0}
+
+    def call(self, endpoint, method, path, json_body=None, upload=None):
+        """发送一个请求并记录耗时；返回 (状态码, 解析后的 JSON 或 None)"""
+        start = time.perf_counter()
+        try:
+            status, body = self.transport.request(method, path, json_body, upload)
+        except Exception as e:
+            self.recorder.record(endpoint, time.perf_counter() - start, 0)
+            if self.args.verbose:
+                print(f"[{endpoint}] 请求失败: {e}", file=sys.stderr)
+            return 0, None
+        self.recorder.record(endpoint, time.perf_counter() - start, status)
+        if self.args.verbose and status >= 400:
+            print(f"[{endpoint}] HTTP {status}: {body[:200]!r}", file=sys.stderr)
+        if not body.startswith((b'{', b'[')):
+            return status, None  # (PDF / ZIP 等文件内容)
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+    def load_invoice_ids(self):
+        """读取现有发票的 id (下载 / 打包下载场景使用)"""
+        ids, offset = [], 0
+        while len(ids) < self.args.max_ids:
+            status, data = self.call('setup', 'GET', f"/invoices?limit=500&offset={offset}")
+            if status != 200 or not data or not data.get('invoices'):
+                break
+            ids.extend(invoice['id'] for invoice in data['invoices'])
+            offset += len(data['invoices'])
+            if not data.get('has_more'):
+                break
+        self.invoice_ids = ids
+
+    def user_loop(self, deadline, seed):
+        rng = random.Random(seed)
+        state = {'sync_seq': None}
+        while time.monotonic() < deadline:
+            scenario = rng.choices(self._scenarios, self._weights)[0]
+            getattr(self, f"scenario_{scenario}")(rng, state, deadline)
+            if self.args.think_time:
+                time.sleep(rng.uniform(0, 2 * self.args.think_time))
+
+    # 场景: 每个场景发送一个或多个请求
+
+    def scenario_list(self, rng, state, deadline):
+        """翻页浏览 (从第一页开始，随机翻几页)"""
+        size = self.args.page_size
+        pages = max(1, len(self.invoice_ids) // size)
+        for offset in [0] + [rng.randrange(pages) * size for _ in range(rng.randrange(3))]:
+            status, data = self.call('GET /invoices', 'GET', f"/invoices?limit={size}&offset={offset}")
+            if status == 200 and data:
+                state['sync_seq'] = data.get('sync_seq', state['sync_seq'])
+
+    def scenario_search(self, rng, state, deadline):
+        """搜索并翻到第二页"""
+        term = urllib.parse.quote(rng.choice(_SEARCH_TERMS))
+        size = self.args.page_size
+        status, data = self.call('GET /invoices?search', 'GET', f"/invoices?search={term}&limit={size}")
+        if status == 200 and data and data.get('has_more'):
+            self.call('GET /invoices?search', 'GET', f"/invoices?search={term}&limit={size}&offset={size}")
+
+    def scenario_changes(self, rng, state, deadline):
+        """增量同步 (没有起点时先加载第一页)"""
+        if state['sync_seq'] is None:
+            self.scenario_list(rng, state, deadline)
+            if state['sync_seq'] is None:
+                return
+        status, data = self.call('GET /invoices/changes', 'GET', f"/invoices/changes?since={state['sync_seq']}")
+        if status == 200 and data:
+            state['sync_seq'] = data.get('since', state['sync_seq'])
+
+    def scenario_analytics(self, rng, state, deadline):
+        by = rng.choice(('seller', 'buyer', 'type'))
+        self.call('GET /analytics', 'GET', f"/analytics?by={by}")
+
+    def scenario_download(self, rng, state, deadline):
+        if self.invoice_ids:
+            self.call('GET /download/<id>', 'GET', f"/download/{rng.choice(self.invoice_ids)}")
+
+    def scenario_preview(self, rng, state, deadline):
+        if self.invoice_ids:
+            self.call('GET /invoices/<id>/preview', 'GET', f"/invoices/{rng.choice(self.invoice_ids)}/preview")
+
+    def scenario_bundle(self, rng, state, deadline):
+        """打包下载 (--bundle-size 张发票)"""
+        if self.invoice_ids:
+            ids = rng.sample(self.invoice_ids, min(self.args.bundle_size, len(self.invoice_ids)))
+            self.call('POST /download/zip', 'POST', '/download/zip', json_body={'selected_ids': ids})
+
+    def scenario_upload(self, rng, state, deadline):
+        """上传一个新的 ZIP (--upload-files 个 PDF)，然后轮询直到任务结束"""
+        self.upload_zip(rng, self.args.upload_files)
+
+    def upload_zip(self, rng, file_count):
+        with self._upload_lock:
+            first_number = self._next_number
+            self._next_number += file_count
+            self.uploads['started'] += 1
+        pdfs = []
+        for i in range(file_count):
+            invoice = fixture_pdfs.random_invoice(rng, first_number + i)
+            pdfs.append((f"invoice_{first_number + i}.pdf", fixture_pdfs.invoice_pdf_bytes([invoice])))
+        upload = (f"load_{first_number}.zip", fixture_pdfs.invoice_zip_bytes(pdfs))
+
+        start = time.perf_counter()
+        status, data = self.call('POST /upload', 'POST', '/upload', upload=upload)
+        if status not in (200, 202) or not data or 'job_id' not in data:
+            self._count_upload('failed')
+            return
+        # (测试结束时间到了也等任务完成，否则正在处理的任务会和下一次测试重叠)
+        while time.perf_counter() - start < _JOB_TIMEOUT:
+            time.sleep(_POLL_INTERVAL)
+            status, job = self.call('GET /upload/status/<id>', 'GET', f"/upload/status/{data['job_id']}")
+            if status != 200 or not job or job.get('status') in ('finished', 'failed'):
+                break
+        else:
+            self._count_upload('timed_out')
+            return
+        finished = status == 200 and job and job.get('status') == 'finished'
+        self.recorder.record('upload job (end to end)', time.perf_counter() - start, 200 if finished else 500)
+        inserted = (job.get('stats') or {}).get('inserted', 0) if finished else 0
+        self._count_upload('finished' if finished else 'failed', inserted)
+
+    def _count_upload(self, outcome, inserted=0):
+        with self._upload_lock:
+            self.uploads[outcome] += 1
+            self.uploads['inserted'] += inserted
+
+    def run(self):
+        """启动 --users 个虚拟用户运行 --duration 秒，返回实际耗时"""
+        start = time.monotonic()
+        deadline = start + self.args.duration
+        threads = [
+            threading.Thread(target=self.user_loop, args=(deadline, self.args.seed * 1000 + i), daemon=True)
+            for i in range(self.args.users)
+        ]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            remaining = max(0, deadline - time.monotonic())
+            print(f"\r运行中... 剩余 {remaining:4.0f} 秒", end='', file=sys.stderr, flush=True)
+            time.sleep(1)
+        print(file=sys.stderr)
+        return time.monotonic() - start
+
+
+def _parse_mix(spec):
+    """'list=50,search=30' -> [('list', 50.0), ('search', 30.0)] (权重为 0 的场景不运行)"""
+    mix = []
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        if not hasattr(LoadTest, f"scenario_{name}"):
+            raise argparse.ArgumentTypeError(f"未知的场景: {name}")
+        try:
+            weight = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"场景权重必须是数字: {item}")
+        if weight > 0:
+            mix.append((name, weight))
+    if not mix:
+        raise argparse.ArgumentTypeError('至少需要一个权重大于 0 的场景')
+    return mix
+
+
+# --- 预置数据 ---
+
+def seed_database(app, count, seed):
+    """(本进程模式) 直接写入 count 张发票及其 PDF 文件 (不经过解析，速度快)"""
+    from app import database as db
+
+    rng = random.Random(seed)
+    extract_dir = app.config['EXTRACT_FOLDER']
+    with app.app_context():
+        for start in range(0, count, _SEED_BATCH):
+            records = []
+            for index in range(start, min(count, start + _SEED_BATCH)):
+                invoice = fixture_pdfs.random_invoice(rng, index)
+                data = fixture_pdfs.invoice_pdf_bytes([invoice])
+                path = os.path.join(extract_dir, f"seed_{index:08d}.pdf")
+                with open(path, 'wb') as f:
+                    f.write(data)
+                info = (
+                    'invoice', None, invoice['invoice_code'], invoice['invoice_number'], invoice['issue_date'],
+                    invoice['amount'], round(invoice['amount'] + invoice['tax'], 2),
+                    invoice['buyer_name'], invoice['buyer_tax_id'], invoice['seller_name'], invoice['seller_tax_id'],
+                    None
+                )
+                records.append((info, path, hashlib.sha256(data).hexdigest()))
+            _, error = db.add_invoice_records(records)
+            if error:
+                raise RuntimeError(f"写入预置数据失败: {error}")
+
+
+def seed_by_upload(test, count):
+    """(HTTP 模式) 通过上传接口写入 count 张发票 (每个 ZIP _SEED_BATCH 个 PDF)"""
+    rng = random.Random(test.args.seed)
+    for start in range(0, count, _SEED_BATCH):
+        test.upload_zip(rng, min(_SEED_BATCH, count - start))
+    test.uploads = {key: 0 for key in test.uploads}
+
+
+def _setup_workdir(workdir):
+    """(本进程模式) 数据库、上传和提取目录都放在 workdir 中 (Config 在导入 app 时读取环境变量)"""
+    os.makedirs(workdir, exist_ok=True)
+    folders = {
+        'DATABASE_PATH': 'instance/invoices.db',
+        'UPLOAD_FOLDER': 'uploads',
+        'EXTRACT_FOLDER': 'extracted_invoices',
+        'QUARANTINE_FOLDER': 'quarantine',
+        'PREVIEW_CACHE_FOLDER': 'instance/previews',
+    }
+    for key, relative in folders.items():
+        os.environ[key] = os.path.join(workdir, relative)
+    os.environ.setdefault('DB_LOCK_STATS', '1')
+
+
+# --- 报告 ---
+
+def print_report(report):
+    print(f"\n并发用户 {report['users']}，持续 {report['duration_s']} 秒，场景比例 {report['mix']}")
+    header = f"{'接口':<28}{'请求数':>8}{'错误率':>9}{'RPS':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'最大 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<28}{row['requests']:>8}{row['error_rate']:>9.2%}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+        if row['error_statuses']:
+            print(f"{'':<28}错误状态码: {row['error_statuses']}")
+    uploads = report['uploads']
+    print(f"\n上传任务: 开始 {uploads['started']}，完成 {uploads['finished']}，失败 {uploads['failed']}，"
+          f"超时 {uploads['timed_out']}，新增发票 {uploads['inserted']}")
+    locks = report['lock_waits']
+    if locks is None:
+        print("写锁等待: 不可用 (服务端需要 SQLite 后端并设置 DB_LOCK_STATS=1)")
+    else:
+        print(f"写锁等待: {locks['count']} 次写事务，合计 {locks['total_ms']:.0f} ms，p50 {locks['p50_ms']} ms，"
+              f"p95 {locks['p95_ms']} ms，p99 {locks['p99_ms']} ms，最大 {locks['max_ms']} ms，"
+              f"超时 (database is locked) {locks['busy_errors']} 次")
+
+
+def _lock_waits(transport, reset=False):
+    status, body = transport.request('DELETE' if reset else 'GET', '/maintenance/db-locks')
+    if status != 200:
+        return None
+    data = json.loads(body)
+    return data['lock_waits'] if data.get('enabled') else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上传 / 轮询 / 列表 / 下载混合场景的压力测试')
+    parser.add_argument('--url', help='已运行服务的地址 (例如 http://127.0.0.1:5000)；默认在本进程内测试')
+    parser.add_argument('--workdir', help='(本进程模式) 数据目录 (默认: 临时目录，结束后删除)')
+    parser.add_argument('--users', type=int, default=50, help='并发虚拟用户数 (默认 50)')
+    parser.add_argument('--duration', type=float, default=30, help='持续时间 (秒，默认 30)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'场景权重 (默认 {DEFAULT_MIX}；另有 preview)')
+    parser.add_argument('--seed-invoices', type=int, default=2000, help='测试前预置的发票数 (默认 2000)')
+    parser.add_argument('--upload-files', type=int, default=20, help='每次上传的 ZIP 中的 PDF 数 (默认 20)')
+    parser.add_argument('--bundle-size', type=int, default=50, help='每次打包下载的发票数 (默认 50)')
+    parser.add_argument('--page-size', type=int, default=50, help='列表每页条数 (默认 50)')
+    parser.add_argument('--think-time', type=float, default=0, help='每个用户两次操作之间的平均间隔 (秒，默认 0)')
+    parser.add_argument('--max-ids', type=int, default=20000, help='下载场景最多使用的发票 id 数 (默认 20000)')
+    parser.add_argument('--timeout', type=float, default=120, help='(HTTP 模式) 单个请求的超时 (秒)')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--json', dest='json_path', help='把报告另存为 JSON')
+    parser.add_argument('--max-error-rate', type=float, help='任一接口的错误率超过此值时以状态码 1 退出 (用于 CI)')
+    parser.add_argument('--verbose', action='store_true', help='打印失败请求的详情 (本进程模式下同时显示 App 的输出)')
+    args = parser.parse_args()
+    try:
+        mix = _parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    workdir = None
+    if args.url:
+        transport = _HttpTransport(args.url, args.timeout)
+    else:
+        workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='fapiao-load-'))
+        _setup_workdir(workdir)
+        from app import create_app
+        app = create_app()
+        if args.seed_invoices:
+            print(f"写入 {args.seed_invoices} 张预置发票...", file=sys.stderr)
+            seed_database(app, args.seed_invoices, args.seed)
+        transport = _TestClientTransport(app)
+
+    try:
+        test = LoadTest(transport, args)
+        if args.url and args.seed_invoices:
+            print(f"通过上传写入 {args.seed_invoices} 张预置发票...", file=sys.stderr)
+            seed_by_upload(test, args.seed_invoices)
+        test.load_invoice_ids()
+        test.recorder = Recorder()  # (预置阶段的请求不计入报告)
+        _lock_waits(transport, reset=True)
+
+        # (本进程模式) App 的逐任务输出会打乱进度和报告，默认屏蔽
+        real_stdout = sys.stdout
+        if not args.url and not args.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        try:
+            duration = test.run()
+        finally:
+            if sys.stdout is not real_stdout:
+                sys.stdout.close()
+                sys.stdout = real_stdout
+        report = {
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'target': args.url or 'in-process',
+            'users': args.users,
+            'duration_s': round(duration, 1),
+            'mix': ','.join(f"{name}={weight:g}" for name, weight in mix),
+            'invoices_at_start': len(test.invoice_ids),
+            'endpoints': test.recorder.summary(duration),
+            'uploads': test.uploads,
+            'lock_waits': _lock_waits(transport),
+        }
+    finally:
+        if workdir and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.max_error_rate is not None:
+        failing = [name for name, row in report['endpoints'].items() if row['error_rate'] > args.max_error_rate]
+        if failing:
+            sys.exit(f"错误率超过 {args.max_error_rate:.2%} 的接口: {', '.join(failing)}")
+
+
+if __name__ == '__main__':
+    main()